@@ -15,6 +15,7 @@ interface ChatWindowProps {
   onInputChange: (value: string) => void;
   onSubmit: (e: React.FormEvent<HTMLFormElement>) => void;
   isGenerating: boolean;
+  queuePosition?: number;
   onWmsClick: (searchResult: SearchResult) => void;
   onDownloadClick: (info: SearchResult) => void;
   onEnterFullScreen: () => void;
@@ -28,6 +29,7 @@ export const ChatWindow = ({
   onInputChange,
   onSubmit,
   isGenerating,
+  queuePosition = 0,
   onWmsClick,
   onDownloadClick,
   onEnterFullScreen,
@@ -86,6 +88,11 @@ export const ChatWindow = ({
               <TypingIndicator />
             </div>
           )}
+          {isGenerating && queuePosition > 0 && (
+            <div className="text-sm text-gray-500">
+              Mange spør akkurat nå. Du er nummer {queuePosition} i køen.
+            </div>
+          )}
           <div ref={chatEndRef} />
         </div>
       </ScrollArea>
@@ -30,6 +30,19 @@ export interface InsertImagePayload {
   downloadFormats?: SearchResult["downloadFormats"];
 }
 
+// Fields of an 'insertImage' card sent once they are looked up; absent fields are unchanged
+export interface UpdateImageCardPayload {
+  datasetUuid: string;
+  datasetDownloadUrl?: string | null;
+  wmsUrl?: SearchResult["wmsUrl"] | "None";
+  downloadFormats?: SearchResult["downloadFormats"];
+}
+
+// Place of a chat turn waiting for the server's LLM capacity; 0 once it is no longer waiting
+export interface QueuePositionPayload {
+  position: number;
+}
+
 // New payload type for the 'updateDatasetWms' action
 export interface UpdateWmsPayload {
   uuid: string;
@@ -48,9 +61,11 @@ export type WebSocketPayload =
   | SearchResult[]
   | MapUpdate
   | InsertImagePayload
+  | UpdateImageCardPayload
   | UpdateWmsPayload
   | DownloadDatasetPayload
   | ChatStreamPayload
+  | QueuePositionPayload
   | object;
 
 export interface WebSocketMessage {
@@ -1,15 +1,25 @@
-import { useState, useEffect, useCallback } from "react";
-import { ChatMessage, WebSocketMessage, SearchResult, WMSLayer } from "./types";
+import { useState, useEffect, useCallback, useRef } from "react";
+import {
+  ChatMessage,
+  WebSocketMessage,
+  SearchResult,
+  WMSLayer,
+  UpdateImageCardPayload,
+  QueuePositionPayload,
+} from "./types";
 
 export const useWebSocket = () => {
   const [ws, setWs] = useState<WebSocket | null>(null);
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [isStreaming, setIsStreaming] = useState(false);
+  const [queuePosition, setQueuePosition] = useState(0);
   const [searchResults, setSearchResults] = useState<SearchResult[]>([]);
   const [uuidToFind, setUuidToFind] = useState<string>("");
   const [specificObject, setSpecificObject] = useState<SearchResult | null>(
     null
   );
+  // UUID of specificObject, readable by updates that arrive before the next render
+  const specificUuidRef = useRef<string | null>(null);
   const [datasetName, setDatasetName] = useState<string>("");
   const [geographicalAreas, setGeographicalAreas] = useState<
     Array<{ type: string; name: string; code: string }>
@@ -110,13 +120,44 @@ export const useWebSocket = () => {
     return Array.from(new Set(fmts));
   };
 
+  const applyDownloadFormats = (
+    downloadFormats: NonNullable<SearchResult["downloadFormats"]>
+  ) => {
+    const rawGeoAreas = downloadFormats.map((fmt: any) => ({
+      type: fmt.type,
+      name: fmt.name,
+      code: fmt.code,
+    }));
+    setGeographicalAreas(dedupeAreas(rawGeoAreas));
+
+    const rawProjections = downloadFormats.flatMap((fmt: any) =>
+      fmt.projections
+        ? fmt.projections.map((proj: any) => ({
+            name: proj.name,
+            code: proj.code,
+          }))
+        : []
+    );
+    setProjections(dedupeProjections(rawProjections));
+
+    const rawFormats = downloadFormats.flatMap((fmt: any) =>
+      fmt.formats ? fmt.formats.map((format: any) => format.name) : []
+    );
+    setFormats(dedupeFormats(rawFormats));
+  };
+
   const handleServerMessage = (data: WebSocketMessage) => {
     const { action, payload } = data;
     console.log("Received payload:", payload);
     console.log("Action:", action);
     switch (action) {
+      case "queuePosition":
+        setQueuePosition((payload as QueuePositionPayload).position);
+        break;
+
       case "chatStream":
         setIsStreaming(true);
+        setQueuePosition(0);
         if (payload.isNewMessage && !payload.payload) break;
         setMessages((prev) => {
           const lastMsg = prev[prev.length - 1];
@@ -174,6 +215,7 @@ export const useWebSocket = () => {
           datasetUuid,
           downloadFormats,
         } = payload;
+        specificUuidRef.current = datasetUuid;
         setSpecificObject({
           uuid: datasetUuid,
           title: datasetTitle,
@@ -204,30 +246,54 @@ export const useWebSocket = () => {
             downloadFormats: downloadFormats,
           });
           setDatasetName(datasetTitle || "");
+          applyDownloadFormats(downloadFormats);
+        }
+        break;
 
-          const rawGeoAreas = downloadFormats.map((fmt: any) => ({
-            type: fmt.type,
-            name: fmt.name,
-            code: fmt.code,
-          }));
-          setGeographicalAreas(dedupeAreas(rawGeoAreas));
-
-          const rawProjections = downloadFormats.flatMap((fmt: any) =>
-            fmt.projections
-              ? fmt.projections.map((proj: any) => ({
-                  name: proj.name,
-                  code: proj.code,
-                }))
-              : []
-          );
-          setProjections(dedupeProjections(rawProjections));
-
-          const rawFormats = downloadFormats.flatMap((fmt: any) =>
-            fmt.formats ? fmt.formats.map((format: any) => format.name) : []
-          );
-          setFormats(dedupeFormats(rawFormats));
+      case "updateImageCard": {
+        // WMS and download details of a card that is already shown
+        const update = payload as UpdateImageCardPayload;
+        const patch: Partial<ChatMessage> = {};
+        if (update.datasetDownloadUrl !== undefined) {
+          patch.downloadUrl = update.datasetDownloadUrl ?? undefined;
+        }
+        if (update.wmsUrl !== undefined) {
+          patch.wmsUrl = update.wmsUrl;
+        }
+        if (update.downloadFormats !== undefined) {
+          patch.downloadFormats = update.downloadFormats;
+        }
+        setMessages((prev) =>
+          prev.map((msg) =>
+            msg.type === "image" && msg.uuid === update.datasetUuid
+              ? { ...msg, ...patch }
+              : msg
+          )
+        );
+        setSpecificObject((prev) =>
+          prev && prev.uuid === update.datasetUuid
+            ? {
+                ...prev,
+                ...(update.datasetDownloadUrl !== undefined && {
+                  downloadUrl: update.datasetDownloadUrl,
+                }),
+                ...(update.wmsUrl !== undefined &&
+                  update.wmsUrl !== "None" && { wmsUrl: update.wmsUrl }),
+                ...(update.downloadFormats !== undefined && {
+                  downloadFormats: update.downloadFormats,
+                }),
+              }
+            : prev
+        );
+        // A late update for an earlier card must not replace the areas of the current one
+        if (
+          update.downloadFormats &&
+          specificUuidRef.current === update.datasetUuid
+        ) {
+          applyDownloadFormats(update.downloadFormats);
         }
         break;
+      }
 
       case "mapUpdate":
         console.log("Received map update:", payload);
@@ -268,6 +334,7 @@ export const useWebSocket = () => {
     setWs,
     messages,
     isStreaming,
+    queuePosition,
     sendMessage,
     searchResults,
     uuidToFind,
@@ -57,6 +57,7 @@ const DemoV4 = () => {
   const {
     messages: wsMessages,
     isStreaming,
+    queuePosition,
     sendMessage,
     mapUpdates,
     clearMapUpdates,
@@ -430,6 +431,7 @@ const DemoV4 = () => {
               onInputChange={chatManagement.handleChatInputChange}
               onSubmit={handleChatSubmit}
               isGenerating={isStreaming}
+              queuePosition={queuePosition}
               onWmsClick={handleWmsClickFromChat}
               onDownloadClick={chatManagement.handleFullScreenDownload}
               onEnterFullScreen={chatManagement.enterFullScreen}
@@ -11,6 +11,7 @@ class Action(Enum):
     USER_MESSAGE = "userMessage"
     FORMAT_MARKDOWN = "formatMarkdown"
     STREAM_COMPLETE = "streamComplete"
+    QUEUE_POSITION = "queuePosition"
 
     # Search related actions
     SEARCH_FORM_SUBMIT = "searchFormSubmit"
@@ -21,4 +22,6 @@ class Action(Enum):
     SHOW_DATASET = "showDataset"
     DOWNLOAD_DATASET = "downloadDataset"
     DOWNLOAD_DATASET_ORDER = "downloadDatasetOrder"
-    UPDATE_DATASET_WMS = "updateDatasetWms"
\ No newline at end of file
+    UPDATE_DATASET_WMS = "updateDatasetWms"
+    INSERT_IMAGE = "insertImage"
+    UPDATE_IMAGE_CARD = "updateImageCard"
\ No newline at end of file
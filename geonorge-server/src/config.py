@@ -12,6 +12,18 @@ CONFIG = {
         "host": "0.0.0.0",  # Bind to all interfaces
         "port": 8080,
         "http_port": 5000,
+        # Worker processes started by launcher.py; they share the ports above
+        "workers": int(os.getenv("SERVER_WORKERS", "1")),
+        # Bind the ports with SO_REUSEPORT so several workers can listen on them (set by launcher.py)
+        "reuse_port": os.getenv("SERVER_REUSE_PORT", "false").lower() == "true",
+        # Seconds a stopping worker waits for running chat turns before closing its connections
+        "drain_timeout": float(os.getenv("SERVER_DRAIN_TIMEOUT_SECONDS", "60")),
+        # Seconds launcher.py waits for a new worker to finish warming up
+        "ready_timeout": float(os.getenv("SERVER_READY_TIMEOUT_SECONDS", "180")),
+        # With several workers, worker i also serves /metrics and /ready on this port + i; 0 disables
+        "metrics_port_base": int(os.getenv("SERVER_METRICS_PORT_BASE", "0")),
+        # This worker's own /metrics and /ready port (set by launcher.py); 0 disables
+        "metrics_port": int(os.getenv("SERVER_METRICS_PORT", "0")),
     },
     "db": {
         "host": os.getenv("DB_HOST"),
@@ -20,6 +32,11 @@ CONFIG = {
         "name": os.getenv("DB_NAME"),
         "user": os.getenv("DB_USER"),
         "password": os.getenv("DB_PASSWORD"),
+        # Connections opened at startup and kept open when returned to the pool
+        "pool_min_connections": int(os.getenv("DB_POOL_MIN_CONNECTIONS", "4")),
+        "pool_max_connections": int(os.getenv("DB_POOL_MAX_CONNECTIONS", "10")),
+        # Seconds get_connection waits for a free connection when all are in use
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10")),
     },
     "api": {
         "openai_embedding_api_key": os.getenv("OPENAI_EMBEDDING_API_KEY"),
@@ -35,4 +52,155 @@ CONFIG = {
         "gemini_base_endpoint": os.getenv("GEMINI_BASE_ENDPOINT"),
         "gemini_full_endpoint": os.getenv("GEMINI_FULL_ENDPOINT"),
     },
-}
\ No newline at end of file
+    "history": {
+        # Number of most recent exchanges kept verbatim in chat_history
+        "max_exchanges": int(os.getenv("HISTORY_MAX_EXCHANGES", "3")),
+        # Upper bound for the rolling summary of older turns
+        "summary_max_chars": int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "1500")),
+        # Per-message cap for turns that are outside the window but not yet summarised
+        "overflow_message_chars": int(os.getenv("HISTORY_OVERFLOW_MESSAGE_CHARS", "300")),
+    },
+    "gazetteer": {
+        # ';'-separated place-name file (name;lat;lon;type;municipality;population),
+        # built from the SSR/Stedsnavn dump with scripts/build_gazetteer.py
+        "path": os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stedsnavn.csv")),
+    },
+    "llm": {
+        # "gemini" (default) or "fake" (canned replies without network access, for load tests and CI)
+        "provider": os.getenv("LLM_PROVIDER", "gemini").lower(),
+        # Simulated latency of the fake model
+        "fake_first_token_ms": float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300")),
+        "fake_token_ms": float(os.getenv("FAKE_LLM_TOKEN_MS", "20")),
+    },
+    "admission": {
+        # Queue chat turns in front of the supervisor so bursts do not run into 429s (see helpers/admission.py)
+        "enabled": os.getenv("ADMISSION_ENABLED", "true").lower() == "true",
+        # Chat turns running the LLM pipeline at once in this worker; the adaptive limit never exceeds it
+        "max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        # Lower bound of the adaptive limit
+        "min_concurrency": int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+        # Waiting turns beyond this are answered from retrieval alone right away
+        "max_queue": int(os.getenv("LLM_MAX_QUEUE", "50")),
+        # Seconds a turn may wait before it is answered from retrieval alone
+        "max_wait": float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "30")),
+        # Factor the limit is multiplied by after a 429, 503/529 or timeout from the LLM endpoint
+        "backoff_factor": float(os.getenv("LLM_BACKOFF_FACTOR", "0.5")),
+        # Comma-separated addresses or CIDR ranges of reverse proxies whose X-Forwarded-For is trusted
+        "trusted_proxies": [
+            proxy.strip() for proxy in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if proxy.strip()
+        ],
+    },
+    "token_tracking": {
+        # Seconds between writes of the in-memory token counters to logs/token_usage.sqlite3
+        "flush_interval": float(os.getenv("TOKEN_USAGE_FLUSH_SECONDS", "10")),
+    },
+    "embedding": {
+        # "azure" (text-embedding-3-large) or "local" (deterministic, offline; for development and CI)
+        "provider": os.getenv("EMBEDDING_PROVIDER", "azure").lower(),
+        # Vector size produced by the local provider; must match the vector columns
+        "dimensions": int(os.getenv("EMBEDDING_DIMENSIONS", "3072")),
+        # Texts whose embeddings are kept in memory (questions are embedded more than once per turn)
+        "cache_size": int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+    },
+    "response_cache": {
+        # Replay stored answers to questions that are semantically the same (see helpers/response_cache.py)
+        "enabled": os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true",
+        # Minimum cosine similarity between question embeddings for a hit (place names must also match)
+        "similarity_threshold": float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97")),
+        # Stored answers, least recently used evicted first
+        "max_entries": int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        # Seconds an answer is served before it is regenerated
+        "ttl": float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")),
+        # Seconds between checks whether the search table was re-indexed (which empties the cache)
+        "version_check_interval": float(os.getenv("RESPONSE_CACHE_VERSION_CHECK_SECONDS", "30")),
+        # Questions this short are treated as follow-ups when the session has history
+        "followup_max_words": int(os.getenv("RESPONSE_CACHE_FOLLOWUP_MAX_WORDS", "3")),
+    },
+    "upstream": {
+        # Geonorge services used for download formats, orders and WMS lookups
+        "nedlasting_url": os.getenv("NEDLASTING_URL", "https://nedlasting.geonorge.no"),
+        "nedlasting_ngu_url": os.getenv("NEDLASTING_NGU_URL", "https://nedlasting.ngu.no"),
+        "kartkatalog_url": os.getenv("KARTKATALOG_URL", "https://kartkatalog.geonorge.no"),
+        # Route all upstream requests (including WMS hosts) to tests/mock_upstream.py,
+        # e.g. http://localhost:8765. Empty means the real services are used.
+        "mock_url": os.getenv("UPSTREAM_MOCK_URL", ""),
+        # Seconds that download areas and WMS capabilities of a dataset are reused between requests
+        "cache_ttl": float(os.getenv("UPSTREAM_CACHE_TTL_SECONDS", "300")),
+        # Seconds that an empty or failed lookup is reused, so unavailable services are retried soon
+        "cache_failure_ttl": float(os.getenv("UPSTREAM_CACHE_FAILURE_TTL_SECONDS", "30")),
+    },
+    "query_log": {
+        # Count the questions users ask in the query_log table (used to warm the caches at startup)
+        "enabled": os.getenv("QUERY_LOG_ENABLED", "true").lower() == "true",
+        # Seconds between writes of the in-memory counts to the table
+        "flush_interval": float(os.getenv("QUERY_LOG_FLUSH_SECONDS", "60")),
+        # Questions not asked for this many seconds are not used for warming
+        "max_age": float(os.getenv("QUERY_LOG_MAX_AGE_SECONDS", str(30 * 86400))),
+        # Seconds after which a question that has not been asked again is deleted from the table
+        "retention": float(os.getenv("QUERY_LOG_RETENTION_SECONDS", str(30 * 86400))),
+    },
+    "prewarm": {
+        # Warm the database pool and caches before reporting ready on /ready (see helpers/prewarm.py)
+        "enabled": os.getenv("PREWARM_ENABLED", "true").lower() == "true",
+        # Most asked questions whose embeddings and searches are warmed
+        "top_questions": int(os.getenv("PREWARM_TOP_QUESTIONS", "50")),
+        # Top datasets of those searches whose WMS capabilities are looked up
+        "wms_datasets": int(os.getenv("PREWARM_WMS_DATASETS", "20")),
+        "wms_concurrency": int(os.getenv("PREWARM_WMS_CONCURRENCY", "5")),
+        # Seconds after which the server reports ready even if warming has not finished
+        "timeout": float(os.getenv("PREWARM_TIMEOUT_SECONDS", "120")),
+    },
+    "service_catalogue": {
+        # Serve download/WMS details of datasets from a harvested table (see helpers/service_catalogue.py)
+        "enabled": os.getenv("SERVICE_CATALOGUE_ENABLED", "true").lower() == "true",
+        "table": os.getenv("SERVICE_CATALOGUE_TABLE", "dataset_service_catalogue"),
+        # Seconds a harvested row is served before the dataset is looked up live again
+        "max_age": float(os.getenv("SERVICE_CATALOGUE_MAX_AGE_SECONDS", "86400")),
+        # Seconds after which the harvester refreshes a row; below max_age so rows are renewed before they expire
+        "refresh_after": float(os.getenv("SERVICE_CATALOGUE_REFRESH_AFTER_SECONDS", "43200")),
+        # Seconds between harvest passes in the server; 0 disables the background harvester
+        "harvest_interval": float(os.getenv("SERVICE_CATALOGUE_HARVEST_INTERVAL_SECONDS", "3600")),
+        # Datasets enriched at the same time while harvesting
+        "concurrency": int(os.getenv("SERVICE_CATALOGUE_CONCURRENCY", "4")),
+        # Pause after each dataset, to stay polite towards Geonorge and the WMS hosts
+        "request_delay": float(os.getenv("SERVICE_CATALOGUE_REQUEST_DELAY_SECONDS", "0.5")),
+        # WMS GetCapabilities timeout while harvesting; longer than at query time
+        "wms_timeout": int(os.getenv("SERVICE_CATALOGUE_WMS_TIMEOUT_SECONDS", "30")),
+        # Datasets written to the table per transaction
+        "batch_size": int(os.getenv("SERVICE_CATALOGUE_BATCH_SIZE", "50")),
+    },
+    "search": {
+        # Table holding the catalogue and its embeddings
+        "table": os.getenv("SEARCH_TABLE", "text_embedding_3_large"),
+        # Restrict dataset searches to datasets whose extent intersects the chat map view
+        "spatial_filter": os.getenv("SEARCH_SPATIAL_FILTER", "true").lower() == "true",
+        # Below this zoom level the view covers (most of) Norway and filtering is pointless
+        "spatial_min_zoom": int(os.getenv("SEARCH_SPATIAL_MIN_ZOOM", "7")),
+        # Retry without the filter if the map view leaves fewer results than this
+        "spatial_min_results": int(os.getenv("SEARCH_SPATIAL_MIN_RESULTS", "3")),
+        # Assumed size of the map in pixels when converting center/zoom to a bounding box
+        "viewport_width": int(os.getenv("SEARCH_VIEWPORT_WIDTH", "1280")),
+        "viewport_height": int(os.getenv("SEARCH_VIEWPORT_HEIGHT", "800")),
+        # Fuse full-text matches (title/keyword/abstract) with the vector ranking
+        "hybrid": os.getenv("SEARCH_HYBRID", "true").lower() == "true",
+        # Candidates fetched by each branch before reciprocal rank fusion
+        "vector_candidates": int(os.getenv("SEARCH_VECTOR_CANDIDATES", "30")),
+        "lexical_candidates": int(os.getenv("SEARCH_LEXICAL_CANDIDATES", "20")),
+        # RRF damping constant; 60 is the value from the original RRF paper
+        "rrf_k": int(os.getenv("SEARCH_RRF_K", "60")),
+        # Coarse search over the compact halfvec column, then rescoring with full vectors.
+        # compact_dimensions must match COMPACT_VECTOR_DIMENSIONS used by scripts/insert_csv.py
+        "compact_vectors": os.getenv("SEARCH_COMPACT_VECTORS", "true").lower() == "true",
+        "compact_dimensions": int(os.getenv("COMPACT_VECTOR_DIMENSIONS", "1024")),
+        "rescore_candidates": int(os.getenv("SEARCH_RESCORE_CANDIDATES", "100")),
+    },
+    "tracing": {
+        # Where per-turn latency spans go (see helpers/tracing.py): "none", "file" or "otlp"
+        "exporter": os.getenv("TRACING_EXPORTER", "none").lower(),
+        # OTLP/JSON lines, one trace per line
+        "file": os.getenv("TRACING_FILE", "logs/traces.jsonl"),
+        # OpenTelemetry collector accepting OTLP/HTTP; /v1/traces is appended
+        "otlp_endpoint": os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"),
+        "service_name": os.getenv("OTEL_SERVICE_NAME", "geogpt-backend"),
+    },
+}
@@ -0,0 +1,360 @@
+"""
+Admission control for chat turns that run the LLM pipeline.
+
+Every chat turn that is not answered from the response cache runs the
+supervisor, which makes several calls to the LLM endpoint. Without a limit a
+burst of users sends them all at once and the endpoint answers with 429s,
+which surface as failed workflows. ``AdmissionController`` sits in front of
+the supervisor:
+
+- At most ``limit`` turns run the pipeline at the same time in this worker.
+  Retrieval (embedding, vector search, download formats) happens before
+  admission and is not limited.
+- Waiting turns are queued per user and admitted round-robin, so a user with
+  several tabs open cannot hold back everyone else. Users are told their place
+  in the queue with ``queuePosition`` messages.
+- The limit adapts to the endpoint: every LLM call reported by the usage
+  callback (``llm/usage_callback.py``) raises it slowly, up to
+  ``max_concurrency``, while a call failing with 429, 503/529 or a timeout
+  multiplies it by ``backoff_factor``. The duration of successful calls is
+  not used: it covers the whole streamed generation and mostly reflects the
+  length of the answer rather than the load on the endpoint.
+- When the queue is longer than ``max_queue``, or a turn has waited
+  ``max_wait`` seconds, the turn is answered from retrieval alone: the best
+  matching datasets with links and abstracts, without calling the LLM.
+
+The limits apply per server process; with several workers (``launcher.py``)
+the endpoint sees up to ``max_concurrency`` × workers turns at once.
+"""
+import asyncio
+import ipaddress
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, List, Optional, Sequence
+
+from config import CONFIG
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of a waiting turn's place in the queue
+POSITION_UPDATE_SECONDS = 1.0
+# A burst of 429s from the same moment lowers the limit only once
+BACKOFF_COOLDOWN_SECONDS = 5.0
+# Status codes of an overloaded endpoint (429 Too Many Requests, 503 Service Unavailable, 529 Overloaded)
+OVERLOAD_STATUS_CODES = {429, 503, 529}
+# Datasets listed in a retrieval-only answer, and characters of each abstract
+RETRIEVAL_ONLY_DATASETS = 5
+RETRIEVAL_ONLY_ABSTRACT_CHARS = 200
+
+RETRIEVAL_ONLY_INTRO = (
+    "Det er mange som spør GeoGPT akkurat nå, så her er datasettene som passer best til spørsmålet ditt. "
+    "Prøv igjen om litt for et fullstendig svar."
+)
+RETRIEVAL_ONLY_EMPTY = (
+    "Det er mange som spør GeoGPT akkurat nå, og jeg fant ingen datasett som passer til spørsmålet ditt. "
+    "Prøv igjen om litt."
+)
+
+ADMISSIONS = metrics.Counter(
+    "geogpt_admission_total",
+    "Chat turns per admission outcome (admitted, queue_full, timeout)",
+    ["outcome"],
+)
+ADMISSION_WAIT_SECONDS = metrics.Histogram(
+    "geogpt_admission_wait_seconds",
+    "Time chat turns waited for admission to the LLM pipeline",
+)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Whether an LLM call failed with 429 Too Many Requests."""
+    return _status_code(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_overloaded(error: BaseException) -> bool:
+    """Whether an LLM call failed because the endpoint is overloaded: 429, 503, 529 or a timeout."""
+    return (is_rate_limited(error)
+            or _status_code(error) in OVERLOAD_STATUS_CODES
+            or isinstance(error, (TimeoutError, asyncio.TimeoutError))
+            or type(error).__name__ == "APITimeoutError")
+
+
+def parse_networks(proxies: Sequence[str]) -> List[Any]:
+    """Addresses and CIDR ranges as networks; invalid entries are logged and skipped."""
+    networks = []
+    for proxy in proxies:
+        try:
+            networks.append(ipaddress.ip_network(proxy, strict=False))
+        except ValueError:
+            logger.warning(f"Ignoring invalid trusted proxy '{proxy}'")
+    return networks
+
+
+TRUSTED_PROXIES = parse_networks(CONFIG["admission"]["trusted_proxies"])
+
+
+def _is_trusted(address: str, trusted_proxies: Sequence[Any]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_key(websocket: Any, trusted_proxies: Optional[Sequence[Any]] = None) -> str:
+    """
+    The user a WebSocket belongs to, for fair queueing.
+
+    Behind the reverse proxy all connections come from the proxy, so for
+    connections from a trusted proxy (``ADMISSION_TRUSTED_PROXIES``) the
+    X-Forwarded-For chain is walked from the right and the first address that
+    is not a trusted proxy is used. Anyone else could send any header, so
+    their own address is used.
+
+    Args:
+        websocket: The client connection
+        trusted_proxies: Networks of trusted proxies; defaults to the configured ones
+    """
+    trusted_proxies = TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    remote = getattr(websocket, "remote_address", None)
+    remote_host = str(remote[0]) if remote else None
+    if remote_host and _is_trusted(remote_host, trusted_proxies):
+        request = getattr(websocket, "request", None)
+        headers = getattr(request, "headers", None) or getattr(websocket, "request_headers", None)
+        forwarded = headers.get("X-Forwarded-For") if headers is not None else None
+        hops = [hop.strip() for hop in (forwarded or "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not _is_trusted(hop, trusted_proxies):
+                return hop
+        if hops:
+            return hops[0]
+    if remote_host:
+        return remote_host
+    return str(id(websocket))
+
+
+class AdmissionController:
+    """Limits the chat turns running the LLM pipeline and queues the rest fairly per user."""
+
+    def __init__(self):
+        admission_config = CONFIG["admission"]
+        self.enabled = admission_config["enabled"]
+        self.max_limit = max(1, admission_config["max_concurrency"])
+        self.min_limit = max(1, min(admission_config["min_concurrency"], self.max_limit))
+        self.max_queue = admission_config["max_queue"]
+        self.max_wait = admission_config["max_wait"]
+        self.backoff_factor = admission_config["backoff_factor"]
+        # Fractional so the additive increase can grow it by less than one turn per call
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        # user -> waiting turns, in the order users are served
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # The limit is adjusted from LLM callbacks, which may run in executor threads
+        self._lock = threading.Lock()
+        self._last_backoff = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _dispatch(self) -> None:
+        """Admit waiting turns round-robin over users while there is capacity."""
+        while self._queues and self.in_flight < self.capacity:
+            user, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if future.done():
+                continue
+            future.set_result(None)
+            self.in_flight += 1
+
+    def _remove(self, user: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(user)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user]
+
+    def _position(self, user: str, future: asyncio.Future) -> int:
+        """1-based place of a waiting turn in the round-robin order turns are admitted in."""
+        queue = self._queues.get(user)
+        if queue is None or future not in queue:
+            return 0
+        index = queue.index(future)
+        ahead = 0
+        served_first = True
+        for other_user, other_queue in self._queues.items():
+            if other_user == user:
+                served_first = False
+                ahead += index
+            else:
+                # Each round admits one turn per user; users ahead in the order also go first in this round
+                ahead += min(len(other_queue), index + 1 if served_first else index)
+        return ahead + 1
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    async def _acquire(self, user: str, websocket: Any) -> bool:
+        from helpers.websocket import send_websocket_message
+
+        started = time.monotonic()
+        self._loop = asyncio.get_running_loop()
+        if not self._queues and self.in_flight < self.capacity:
+            self.in_flight += 1
+            ADMISSIONS.inc(outcome="admitted")
+            ADMISSION_WAIT_SECONDS.observe(0)
+            return True
+        if self.queued >= self.max_queue:
+            logger.warning(f"Admission queue full ({self.queued} waiting), answering from retrieval alone")
+            ADMISSIONS.inc(outcome="queue_full")
+            return False
+
+        future = self._loop.create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        admitted = False
+        sent_position = None
+        try:
+            while not future.done():
+                waited = time.monotonic() - started
+                if waited >= self.max_wait:
+                    break
+                position = self._position(user, future)
+                if position != sent_position:
+                    sent_position = position
+                    await send_websocket_message("queuePosition", {"position": position}, websocket)
+                    continue
+                await asyncio.wait({future}, timeout=min(POSITION_UPDATE_SECONDS, self.max_wait - waited))
+            admitted = future.done() and not future.cancelled()
+        finally:
+            if not admitted:
+                if future.done() and not future.cancelled():
+                    # Admitted while the waiting turn was being cancelled
+                    self._release()
+                else:
+                    future.cancel()
+                    self._remove(user, future)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started)
+        ADMISSIONS.inc(outcome="admitted" if admitted else "timeout")
+        if not admitted:
+            logger.warning(f"Chat turn waited {self.max_wait}s for admission, answering from retrieval alone")
+        # Position 0: no longer waiting
+        await send_websocket_message("queuePosition", {"position": 0}, websocket)
+        return admitted
+
+    @asynccontextmanager
+    async def admit(self, user: str, websocket: Any) -> AsyncIterator[bool]:
+        """
+        Wait for a turn to run the LLM pipeline.
+
+        Args:
+            user: Key of the user the turn belongs to (see ``client_key``)
+            websocket: Connection that is told its place in the queue
+
+        Yields:
+            True once admitted; False if the pipeline is saturated and the turn
+            should be answered from retrieval alone
+        """
+        if not self.enabled:
+            yield True
+            return
+        admitted = await self._acquire(user, websocket)
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self._release()
+
+    def record_llm_call(self, overloaded: bool = False) -> None:
+        """
+        Adapt the limit to one finished or failed LLM call.
+
+        Args:
+            overloaded: Whether the call failed because the endpoint is overloaded (see ``is_overloaded``)
+        """
+        with self._lock:
+            before = self.capacity
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_backoff < BACKOFF_COOLDOWN_SECONDS:
+                    return
+                self._last_backoff = now
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_factor)
+                logger.warning(f"Lowering chat turn limit to {self.capacity} (LLM endpoint overloaded)")
+            else:
+                # Additive increase: about one more turn after `limit` fast calls
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            grew = self.capacity > before
+        if grew and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch)
+
+
+admission = AdmissionController()
+
+metrics.gauge_callback("geogpt_admission_limit", "Chat turns allowed to run the LLM pipeline at once",
+                       lambda: admission.capacity)
+metrics.gauge_callback("geogpt_admission_in_flight", "Chat turns running the LLM pipeline",
+                       lambda: admission.in_flight)
+metrics.gauge_callback("geogpt_admission_queued", "Chat turns waiting for admission",
+                       lambda: admission.queued)
+
+
+def retrieval_only_answer(vdb_response: Optional[List[tuple]]) -> str:
+    """Markdown listing the best matching datasets, for answers without the LLM."""
+    from rag.utils.dataset_utils import enrich_dataset_metadata
+
+    rows = [row for row in (vdb_response or []) if row and row[0] and row[1]][:RETRIEVAL_ONLY_DATASETS]
+    if not rows:
+        return RETRIEVAL_ONLY_EMPTY
+    lines = [RETRIEVAL_ONLY_INTRO, ""]
+    for row in rows:
+        dataset = enrich_dataset_metadata({"uuid": row[0], "title": row[1]})
+        abstract = " ".join(str(row[2] or "").split()) if len(row) > 2 else ""
+        if len(abstract) > RETRIEVAL_ONLY_ABSTRACT_CHARS:
+            abstract = abstract[:RETRIEVAL_ONLY_ABSTRACT_CHARS].rsplit(" ", 1)[0] + " …"
+        line = f"- **[{dataset['title']}]({dataset['source_url']})**"
+        lines.append(f"{line}: {abstract}" if abstract else line)
+    return "\n".join(lines)
+
+
+async def send_retrieval_only_answer(vdb_response: Optional[List[tuple]], websocket: Any) -> str:
+    """
+    Stream a retrieval-only answer to the client like a generated one.
+
+    The answer is kept out of the response cache, so the question gets a full
+    answer once the load has gone down.
+
+    Returns:
+        The answer's markdown
+    """
+    from helpers.response_cache import exclude_from_cache
+    from helpers.websocket import send_websocket_message, send_websocket_action
+
+    exclude_from_cache()
+    answer = retrieval_only_answer(vdb_response)
+    await send_websocket_message("chatStream", {"payload": "", "isNewMessage": True}, websocket)
+    await send_websocket_message("chatStream", {"payload": answer}, websocket)
+    await send_websocket_action("streamComplete", websocket)
+    await send_websocket_action("formatMarkdown", websocket)
+    return answer
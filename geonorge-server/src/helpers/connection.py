@@ -1,28 +1,83 @@
+import threading
+
 from psycopg2 import pool
 from config import CONFIG  # Ensure CONFIG is imported from config
+from helpers import metrics
 
 # Get database configuration
 db_config = CONFIG["db"]
 
-# Create a connection pool
-connection_pool = pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=10,
-    user=db_config['user'],
-    host=db_config['host'],
-    database=db_config['name'],
-    password=db_config['password'],
-    port=db_config['port']
-)
+# The pool is created on first use, so importing this module never opens a connection.
+# Queries run in asyncio.to_thread workers, several at once, so the pool must be thread-safe.
+connection_pool = None
+_pool_lock = threading.Lock()
+
+# ThreadedConnectionPool raises PoolError as soon as every connection is checked out;
+# this semaphore makes callers wait for one instead (at most pool_timeout seconds)
+_available = threading.BoundedSemaphore(db_config['pool_max_connections'])
+_stats_lock = threading.Lock()
+_checked_out = 0
+_waiting = 0
 
 connected = False
 
+def get_pool():
+    """Get the connection pool, creating it on first use"""
+    global connection_pool
+    if connection_pool is None:
+        with _pool_lock:
+            if connection_pool is None:
+                connection_pool = pool.ThreadedConnectionPool(
+                    minconn=db_config['pool_min_connections'],
+                    maxconn=db_config['pool_max_connections'],
+                    user=db_config['user'],
+                    host=db_config['host'],
+                    database=db_config['name'],
+                    password=db_config['password'],
+                    port=db_config['port']
+                )
+    return connection_pool
+
+def _acquire_slot():
+    """Wait for a free pool connection; raises PoolError after pool_timeout seconds."""
+    global _waiting
+    if _available.acquire(blocking=False):
+        return
+    with _stats_lock:
+        _waiting += 1
+    try:
+        if not _available.acquire(timeout=db_config['pool_timeout']):
+            raise pool.PoolError(
+                f"no database connection free after {db_config['pool_timeout']}s "
+                f"({db_config['pool_max_connections']} in use)"
+            )
+    finally:
+        with _stats_lock:
+            _waiting -= 1
+
+
+def _checked_out_delta(delta):
+    global _checked_out
+    with _stats_lock:
+        _checked_out += delta
+
+
 def get_connection():
-    """Get a connection from the pool"""
+    """Get a connection from the pool, waiting for one if all are in use"""
+    _acquire_slot()
+    try:
+        conn = _getconn()
+    except Exception:
+        _available.release()
+        raise
+    _checked_out_delta(1)
+    return conn
+
+def _getconn():
     global connected
     try:
         if not connected:
-            conn = connection_pool.getconn()
+            conn = get_pool().getconn()
             if conn:
                 print('Connected to postgres')
                 connected = True
@@ -33,15 +88,31 @@ def get_connection():
                 raise Exception("Failed to get database connection")
         else:
             print('Client is already connected.')
-            return connection_pool.getconn()
+            return get_pool().getconn()
     except Exception as e:
         print(f"Connection error: {str(e)}")
         raise
 
 def return_connection(conn):
     """Return a connection to the pool"""
-    connection_pool.putconn(conn)
+    get_pool().putconn(conn)
+    _checked_out_delta(-1)
+    _available.release()
+
+def pool_stats():
+    """Connections in use, callers waiting for one, and the pool size limit"""
+    if connection_pool is None:
+        return {}
+    with _stats_lock:
+        return {
+            "in_use": _checked_out,
+            "waiting": _waiting,
+            "max": db_config['pool_max_connections'],
+        }
+
+metrics.gauge_callback("geogpt_db_pool_connections", "PostgreSQL pool connections by state", pool_stats, ["state"])
 
 def close_all():
     """Close all connections in the pool"""
-    connection_pool.closeall()
\ No newline at end of file
+    if connection_pool is not None:
+        connection_pool.closeall()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import asyncio
 import aiohttp
+import functools
 import logging
 import time # Added time module
 from typing import Any, Dict, List, Optional
@@ -7,12 +8,21 @@ import re
 from xml.etree import ElementTree
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
+from helpers import service_catalogue
 from helpers.fetch_valid_download_api_data import get_wms
+from helpers.tracing import span, traced
+from helpers.upstream import SingleFlightCache, client_trace_configs, nedlasting_url, upstream_url
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Area data is requested for the chat datasets, the image card and the download endpoints
+_area_data_cache = SingleFlightCache("area_data")
+
+# Live enrichment results being written to the service catalogue
+_catalogue_writes = set()
+
 
 async def fetch_area_data(uuid: str) -> List[Dict[str, Any]]:
     """
@@ -20,13 +30,18 @@ async def fetch_area_data(uuid: str) -> List[Dict[str, Any]]:
     
     Calls: https://nedlasting.geonorge.no/api/codelists/area/{uuid}
     Returns a list (parsed JSON). If not valid, returns an empty list.
+    Results are shared between concurrent callers and cached for a few minutes.
     """
-    url = f"https://nedlasting.geonorge.no/api/codelists/area/{uuid}"
+    return await _area_data_cache.get(uuid, functools.partial(_fetch_area_data, uuid))
+
+
+async def _fetch_area_data(uuid: str) -> List[Dict[str, Any]]:
+    url = nedlasting_url(f"/api/codelists/area/{uuid}")
 
     timeout = aiohttp.ClientTimeout(total=10)
     
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=client_trace_configs()) as session:
             try:
                 async with session.get(url) as response:
                     # logger.info("Response status: %s, URL: %s", response.status, response.url)
@@ -176,9 +191,9 @@ async def get_download_url(metadata_uuid: str, download_formats: Dict[str, Any])
     }
 
     timeout = aiohttp.ClientTimeout(total=15)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    async with aiohttp.ClientSession(timeout=timeout, trace_configs=client_trace_configs()) as session:
         async with session.post(
-            "https://nedlasting.geonorge.no/api/order",
+            nedlasting_url("/api/order"),
             json=order_request
         ) as response:
             if not response.ok:
@@ -194,20 +209,27 @@ async def get_download_url(metadata_uuid: str, download_formats: Dict[str, Any])
             return None
 
 
+@traced("enrichment.download_formats")
 async def get_dataset_download_formats(vdb_search_response: List[tuple]) -> List[Dict[str, Any]]:
     """
     For each item in vdb_search_response, fetch only the download formats
     and return minimal dataset information.
     Returns a list of datasets with uuid, title and download formats.
+    Formats are read from the service catalogue; only datasets without a
+    fresh catalogue row are fetched from the download API.
     """
     # Convert tuples to dictionaries with only needed fields
     field_names = ['uuid', 'title', 'abstract', 'image', 'distance']
     dict_response = [dict(zip(field_names, row)) for row in vdb_search_response]
+    catalogue = await service_catalogue.lookup([ds["uuid"] for ds in dict_response if ds.get("uuid")])
 
     async def fetch_formats(dataset: Dict[str, Any]) -> Dict[str, Any]:
         try:
             uuid = dataset.get("uuid")
-            formats_api_response = await fetch_area_data(uuid)
+            if uuid in catalogue:
+                formats_api_response = catalogue[uuid]["downloadFormats"]
+            else:
+                formats_api_response = await fetch_area_data(uuid)
             
             return {
                 "uuid": dataset["uuid"],
@@ -238,6 +260,62 @@ async def get_dataset_download_formats(vdb_search_response: List[tuple]) -> List
     return valid_results
 
 # --- New WMS Capabilities Helper ---
+def parse_wms_capabilities(xml_content: bytes) -> Dict[str, Any]:
+    """
+    Parse a WMS GetCapabilities document into its named layers and GetMap formats.
+
+    Raises:
+        ElementTree.ParseError: If the document is not valid XML
+    """
+    root = ElementTree.fromstring(xml_content)
+    default_namespace = None
+    if '}' in root.tag:
+        default_namespace = root.tag.split('}')[0][1:] # Extract namespace URI
+
+    ns = {
+         "wms": "http://www.opengis.net/wms", 
+         "ows": "http://www.opengis.net/ows/1.1", # Common for exceptions/metadata
+         "xlink": "http://www.w3.org/1999/xlink" # Sometimes used
+    }
+    if default_namespace:
+        ns['defns'] = default_namespace
+        # Prepare path prefixes for findall if default namespace exists
+        wms_prefix = 'defns:' if default_namespace == ns["wms"] else 'wms:' 
+    else:
+         # Assume standard prefixes if no default namespace detected on root
+         wms_prefix = 'wms:'
+
+    layers = []
+    processed_layer_names = set() # Avoid duplicates if structure is odd
+
+    for layer in root.iterfind(f".//{wms_prefix}Layer", ns):
+        name_el = layer.find(f"{wms_prefix}Name", ns)
+        layer_name = name_el.text if name_el is not None else None
+
+        # Include layer if it has a name (essential for requests) and hasn't been seen
+        if layer_name and layer_name not in processed_layer_names:
+            title_el = layer.find(f"{wms_prefix}Title", ns)
+            # Title is desirable but not essential for listing; use Name if Title is missing
+            display_title = title_el.text if title_el is not None and title_el.text else layer_name
+            layers.append({"name": layer_name, "title": display_title})
+            processed_layer_names.add(layer_name)
+
+    # Find available formats for GetMap (usually within Capability section)
+    formats = []
+    getmap_formats = root.findall(f".//{wms_prefix}Capability//{wms_prefix}GetMap/{wms_prefix}Format", ns)
+    if not getmap_formats: # Fallback: search anywhere
+         getmap_formats = root.findall(f".//{wms_prefix}GetMap/{wms_prefix}Format", ns)
+
+    for fmt in getmap_formats:
+        if fmt.text and fmt.text not in formats:
+            formats.append(fmt.text)
+
+    return {
+        "available_layers": layers,
+        "available_formats": formats
+    }
+
+
 async def _fetch_wms_capabilities_async(wms_url: str, timeout_seconds: int = 5) -> Optional[Dict[str, Any]]:
     """ Fetches and parses WMS GetCapabilities using aiohttp. Returns dict or None on error. """
     if not wms_url:
@@ -274,11 +352,11 @@ async def _fetch_wms_capabilities_async(wms_url: str, timeout_seconds: int = 5)
     timeout = aiohttp.ClientTimeout(total=timeout_seconds)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=client_trace_configs()) as session:
             # Add common headers that might help with some servers
             headers = {'Accept': 'application/xml, text/xml, */*;q=0.01'}
             logger.debug(f"Fetching WMS capabilities from: {fetch_url}")
-            async with session.get(fetch_url, headers=headers) as response:
+            async with session.get(upstream_url(fetch_url), headers=headers) as response:
                 logger.debug(f"WMS Response Status for {fetch_url}: {response.status}")
                 response.raise_for_status() 
                 
@@ -294,62 +372,9 @@ async def _fetch_wms_capabilities_async(wms_url: str, timeout_seconds: int = 5)
                 
                 # Attempt to parse XML
                 try:
-                    root = ElementTree.fromstring(xml_content)
-                    default_namespace = None
-                    if '}' in root.tag:
-                        default_namespace = root.tag.split('}')[0][1:] # Extract namespace URI
-                        logger.debug(f"Detected default namespace: {default_namespace}")
-                    
-
-                    ns = {
-                         "wms": "http://www.opengis.net/wms", 
-                         "ows": "http://www.opengis.net/ows/1.1", # Common for exceptions/metadata
-                         "xlink": "http://www.w3.org/1999/xlink" # Sometimes used
-                    }
-                    if default_namespace:
-                        ns['defns'] = default_namespace
-                        # Prepare path prefixes for findall if default namespace exists
-                        wms_prefix = 'defns:' if default_namespace == ns["wms"] else 'wms:' 
-                    else:
-                         # Assume standard prefixes if no default namespace detected on root
-                         wms_prefix = 'wms:'
-
-                    layers = []
-                    processed_layer_names = set() # Avoid duplicates if structure is odd
-
-                    for layer in root.findall(f".//{wms_prefix}Layer", ns):
-                        name_el = layer.find(f"{wms_prefix}Name", ns)
-                        title_el = layer.find(f"{wms_prefix}Title", ns)
-                        
-                        layer_name = name_el.text if name_el is not None else None
-                        layer_title = title_el.text if title_el is not None else None
-
-                        # Include layer if it has a name (essential for requests) and hasn't been seen
-                        if layer_name and layer_name not in processed_layer_names:
-                            # Title is desirable but not essential for listing; use Name if Title is missing
-                            display_title = layer_title if layer_title else layer_name 
-                            layers.append({"name": layer_name, "title": display_title})
-                            processed_layer_names.add(layer_name)
-                            # logger.debug(f"Found layer: Name='{layer_name}', Title='{display_title}'")
-                        elif not layer_name:
-                             # Log layers without names for debugging, but don't include them
-                             pass # logger.debug(f"Skipping layer without Name (Title: '{layer_title}')")
-                             
-                    # Find available formats for GetMap (usually within Capability section)
-                    formats = []
-                    getmap_formats = root.findall(f".//{wms_prefix}Capability//{wms_prefix}GetMap/{wms_prefix}Format", ns)
-                    if not getmap_formats: # Fallback: search anywhere
-                         getmap_formats = root.findall(f".//{wms_prefix}GetMap/{wms_prefix}Format", ns)
-                         
-                    for fmt in getmap_formats:
-                        if fmt.text and fmt.text not in formats:
-                            formats.append(fmt.text)
-
-                    logger.info(f"Successfully parsed WMS for {wms_url}. Found {len(layers)} queryable layers and {len(formats)} formats.")
-                    return {
-                        "available_layers": layers,
-                        "available_formats": formats
-                    }
+                    capabilities = parse_wms_capabilities(xml_content)
+                    logger.info(f"Successfully parsed WMS for {wms_url}. Found {len(capabilities['available_layers'])} queryable layers and {len(capabilities['available_formats'])} formats.")
+                    return capabilities
 
                 except ElementTree.ParseError as e:
                      logger.warning(f"Failed to parse WMS XML for {wms_url}: {str(e)}")
@@ -380,44 +405,25 @@ async def _fetch_wms_capabilities_async(wms_url: str, timeout_seconds: int = 5)
         return None
 # --- End WMS Helper ---
 
-async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple]) -> List[Dict[str, Any]]:
+async def enrich_dataset(dataset: Dict[str, Any], wms_timeout_seconds: int = 5, cached: bool = True) -> Dict[str, Any]:
     """
-    For each item in vdb_search_response, fetch:
-      - The raw area data (downloadFormats)
-      - The WMS capabilities (if getcapabilitiesurl is present)
-      - A direct downloadUrl if the dataset supports it (using a default/first area/format).
-    Returns a list of enriched dataset dictionaries.
-    
-    Deduplicates results by keeping only one entry per base document title.
-    Uses getcapabilitiesurl from VDB results.
-    """
-    # Convert tuples to dictionaries. Now includes 'getcapabilitiesurl'.
-    # Ensure the order matches the SELECT statement in _vector_search.
-    field_names = ['uuid', 'title', 'getcapabilitiesurl', 'distance'] 
-    dict_response = [dict(zip(field_names, row)) for row in vdb_search_response]
-    
-    # --- Deduplication Logic (unchanged) ---
-    title_groups = {}
-    for dataset in dict_response:
-        title = dataset.get("title", "")
-        base_title = re.sub(r'\s+\([Dd]el\s+\d+\)$|\s+\([Pp]art\s+\d+\)$', '', title)
-        if base_title not in title_groups:
-            title_groups[base_title] = []
-        title_groups[base_title].append(dataset)
-    
-    deduplicated_response = []
-    for base_title, datasets in title_groups.items():
-        datasets.sort(key=lambda x: float(x.get('distance', float('inf'))))
-        deduplicated_response.append(datasets[0])
-    # --- End Deduplication ---
+    Look up the download formats, WMS capabilities and download URL of one dataset.
+
+    Args:
+        dataset: Search row with uuid, title and getcapabilitiesurl
+        wms_timeout_seconds: Timeout of the WMS GetCapabilities request
+        cached: Share area lookups through the upstream cache; the service
+            catalogue harvester bypasses it so it does not evict the entries of live requests
 
-    # --- New Enrich Dataset Helper ---
-    async def enrich_dataset(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    Returns:
+        The dataset as returned by get_dataset_download_and_wms_status
+    """
+    with span("enrich_dataset", **{"dataset.uuid": dataset.get("uuid")}):
         start_time = time.monotonic() # Start timer for this dataset
         uuid = dataset.get("uuid")
         title = dataset.get("title") # Title comes from VDB
         wms_capabilities_url = dataset.get("getcapabilitiesurl")
-        
+    
         # Store errors encountered during enrichment
         errors = []
 
@@ -425,13 +431,13 @@ async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple])
         tasks = {}
         # Task 1: Fetch WMS Capabilities (if URL exists)
         if wms_capabilities_url:
-            tasks["wms"] = asyncio.create_task(_fetch_wms_capabilities_async(wms_capabilities_url), name=f"wms_{uuid}") # Add name for clarity
+            tasks["wms"] = asyncio.create_task(_fetch_wms_capabilities_async(wms_capabilities_url, wms_timeout_seconds), name=f"wms_{uuid}") # Add name for clarity
         else:
             logger.debug(f"No getcapabilitiesurl found for dataset {uuid}")
-        
+    
         # Task 2: Fetch Area Data (download formats)
-        tasks["area"] = asyncio.create_task(fetch_area_data(uuid), name=f"area_{uuid}") # Add name for clarity
-        
+        tasks["area"] = asyncio.create_task((fetch_area_data if cached else _fetch_area_data)(uuid), name=f"area_{uuid}") # Add name for clarity
+    
         # --- Await concurrent tasks ---
         concurrent_fetch_start = time.monotonic()
         results = {}
@@ -469,7 +475,7 @@ async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple])
                  # Optionally add to errors list if frontend needs more info about initial failure
                  # errors.append("Initial WMS fetch timed out")
             # Else (no wms_capabilities_url), wms_info remains None
-        
+    
 
         # --- Process Area Data results ---
         formats_api_response = results.get("area", []) # Default to empty list if fetch failed or no task
@@ -527,14 +533,63 @@ async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple])
             "restricted": restricted, # Reflects restriction found during download order
             "error": "; ".join(errors) if errors else None # Combine error messages
         }
-        
+    
         total_enrich_duration = time.monotonic() - start_time
         logger.info(f"[{uuid}] TIMING: Total enrichment took {total_enrich_duration:.2f}s")
         return final_dataset
-    # --- End Enrich Dataset Helper ---
+
+
+@traced("enrichment.search_results")
+async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple]) -> List[Dict[str, Any]]:
+    """
+    For each item in vdb_search_response, fetch:
+      - The raw area data (downloadFormats)
+      - The WMS capabilities (if getcapabilitiesurl is present)
+      - A direct downloadUrl if the dataset supports it (using a default/first area/format).
+    Returns a list of enriched dataset dictionaries.
+    
+    Deduplicates results by keeping only one entry per base document title.
+    Uses getcapabilitiesurl from VDB results.
+
+    Datasets with a fresh row in the service catalogue are served from it;
+    the others are enriched live and written back to the catalogue.
+    """
+    # Convert tuples to dictionaries. Now includes 'getcapabilitiesurl'.
+    # Ensure the order matches the SELECT statement in _vector_search.
+    field_names = ['uuid', 'title', 'getcapabilitiesurl', 'distance'] 
+    dict_response = [dict(zip(field_names, row)) for row in vdb_search_response]
+    
+    # --- Deduplication Logic (unchanged) ---
+    title_groups = {}
+    for dataset in dict_response:
+        title = dataset.get("title", "")
+        base_title = re.sub(r'\s+\([Dd]el\s+\d+\)$|\s+\([Pp]art\s+\d+\)$', '', title)
+        if base_title not in title_groups:
+            title_groups[base_title] = []
+        title_groups[base_title].append(dataset)
+    
+    deduplicated_response = []
+    for base_title, datasets in title_groups.items():
+        datasets.sort(key=lambda x: float(x.get('distance', float('inf'))))
+        deduplicated_response.append(datasets[0])
+    # --- End Deduplication ---
+
+
+    catalogue = await service_catalogue.lookup([ds["uuid"] for ds in deduplicated_response if ds.get("uuid")])
+
+    async def catalogue_or_live(dataset: Dict[str, Any]) -> Dict[str, Any]:
+        entry = catalogue.get(dataset.get("uuid"))
+        if entry is None:
+            return await enrich_dataset(dataset)
+        return {
+            "uuid": dataset.get("uuid"),
+            "title": dataset.get("title"),
+            "getcapabilitiesurl": dataset.get("getcapabilitiesurl"),
+            **entry,
+        }
 
     # Use the deduplicated list for processing
-    tasks = [enrich_dataset(ds) for ds in deduplicated_response]
+    tasks = [catalogue_or_live(ds) for ds in deduplicated_response]
     
     # Allow individual tasks to fail without affecting others
     # gather already handles exceptions per task, enrich_dataset catches internal ones
@@ -542,8 +597,15 @@ async def get_dataset_download_and_wms_status(vdb_search_response: List[tuple])
     
     # Filter out any potential None results if enrich_dataset failed catastrophically (shouldn't happen)
     valid_results = [item for item in results if item is not None]
+
+    live_results = [item for item in valid_results if item["uuid"] not in catalogue]
+    if live_results:
+        write = asyncio.create_task(service_catalogue.store(live_results))
+        _catalogue_writes.add(write)
+        write.add_done_callback(_catalogue_writes.discard)
     
-    logger.info(f"Enriched {len(valid_results)} deduplicated datasets for search results.")
+    logger.info(f"Enriched {len(valid_results)} deduplicated datasets for search results "
+                f"({len(valid_results) - len(live_results)} from the service catalogue).")
     return valid_results
 
 async def check_download_api_connectivity() -> bool:
@@ -553,10 +615,10 @@ async def check_download_api_connectivity() -> bool:
     """
     try:
         # Test URL that should always be accessible
-        url = "https://nedlasting.geonorge.no/api/codelists/defaults"
+        url = nedlasting_url("/api/codelists/defaults")
         timeout = aiohttp.ClientTimeout(total=5)
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=client_trace_configs()) as session:
             try:
                 async with session.get(url) as response:
                     if response.ok:
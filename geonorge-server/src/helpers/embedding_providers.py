@@ -0,0 +1,104 @@
+"""
+Pluggable embedding backends behind ``fetch_openai_embeddings``.
+
+The backend is chosen with ``CONFIG["embedding"]["provider"]``:
+
+- ``azure``: text-embedding-3-large on Azure OpenAI (production)
+- ``local``: deterministic hashed bag-of-words vectors computed in-process, for
+  running ingestion, search and load tests without network access
+
+Ingestion (scripts/embedding_pipeline.py) reads the same EMBEDDING_PROVIDER
+setting, so a table loaded with one backend is searched with the same backend.
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Type
+
+import aiohttp
+
+from config import CONFIG
+from helpers import local_embeddings
+from helpers.token_tracker import token_tracker
+from helpers.upstream import client_trace_configs
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingProvider(ABC):
+    """Base class for embedding backends."""
+
+    name = "base"
+    model = ""
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            One vector per text, in the same order
+        """
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    """text-embedding-3-large served by Azure OpenAI."""
+
+    name = "azure"
+    model = "text-embedding-3-large"
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        headers = {
+            'Content-Type': 'application/json',
+            'api-key': CONFIG["api"]["azure_embedding_api_key"]
+        }
+        async with aiohttp.ClientSession(trace_configs=client_trace_configs()) as session:
+            async with session.post(
+                CONFIG["api"]["azure_embeddings_endpoint"],
+                headers=headers,
+                json={'input': texts}
+            ) as response:
+                if response.status != 200:
+                    error_data = await response.text()
+                    raise Exception(f'Azure OpenAI API error: {error_data}')
+                result = await response.json()
+        token_tracker.log_embedding_tokens(result.get('usage', {}).get('prompt_tokens', 0), self.model)
+        data = sorted(result['data'], key=lambda item: item.get('index', 0))
+        return [item['embedding'] for item in data]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Deterministic in-process embeddings (see helpers/local_embeddings.py)."""
+
+    name = "local"
+    model = "local-hashed-bow"
+
+    def __init__(self, dimensions: Optional[int] = None):
+        self.dimensions = dimensions or CONFIG["embedding"]["dimensions"]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        # CPU-bound; a large ingestion batch would otherwise stall the event loop
+        return await asyncio.to_thread(local_embeddings.embed_texts, texts, self.dimensions)
+
+
+PROVIDERS: Dict[str, Type[EmbeddingProvider]] = {
+    AzureEmbeddingProvider.name: AzureEmbeddingProvider,
+    LocalEmbeddingProvider.name: LocalEmbeddingProvider,
+}
+
+_provider: Optional[EmbeddingProvider] = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Get the configured embedding provider, created on first use."""
+    global _provider
+    if _provider is None:
+        name = CONFIG["embedding"]["provider"]
+        if name not in PROVIDERS:
+            raise ValueError(f"Unknown embedding provider '{name}', expected one of {sorted(PROVIDERS)}")
+        _provider = PROVIDERS[name]()
+        logger.info(f"Using embedding provider '{name}'")
+    return _provider
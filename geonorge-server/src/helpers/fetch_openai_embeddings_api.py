@@ -1,51 +1,62 @@
-import os
-import aiohttp
-import json
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
 from config import CONFIG
-from langsmith import Client, traceable
+from helpers import metrics
+from helpers.embedding_providers import get_embedding_provider
+from helpers.tracing import span
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Azure OpenAI embedding model name
-EMBEDDING_MODEL = "text-embedding-3-large"
+# (provider, model, text) -> embedding, least recently used first.
+# A chat turn embeds the question several times (response cache, search, retriever).
+_embedding_cache: "OrderedDict[Tuple[str, str, str], List[float]]" = OrderedDict()
+
+
+def _cached_embedding(key: Tuple[str, str, str]):
+    embedding = _embedding_cache.get(key)
+    if embedding is not None:
+        _embedding_cache.move_to_end(key)
+    metrics.record_cache("embedding", embedding is not None)
+    return embedding
+
+
+def _cache_embedding(key: Tuple[str, str, str], embedding: List[float]):
+    _embedding_cache[key] = embedding
+    _embedding_cache.move_to_end(key)
+    while len(_embedding_cache) > CONFIG["embedding"]["cache_size"]:
+        _embedding_cache.popitem(last=False)
 
-# Initialize LangSmith client if tracing is enabled
-langsmith_tracing = os.environ.get("LANGSMITH_TRACING", "false").lower() == "true"
-langsmith_client = None
-if langsmith_tracing:
-    try:
-        langsmith_client = Client()
-        logger.info("LangSmith tracing enabled for embeddings")
-    except Exception as e:
-        logger.error(f"Error initializing LangSmith for embeddings: {str(e)}")
-        langsmith_tracing = False
 
 async def fetch_openai_embeddings(text):
-    """Fetch embeddings from Azure OpenAI API for the given text"""
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'api-key': CONFIG["api"]["azure_embedding_api_key"] 
-    }
+    """
+    Fetch embeddings for the given text from the configured embedding provider.
 
-    data = {
-        'input': text
-    }
+    Recently embedded texts are served from an in-memory LRU cache, so only the
+    texts not seen before are sent to the provider.
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                CONFIG["api"]["azure_embeddings_endpoint"], 
-                headers=headers,
-                json=data
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result
-                else:
-                    error_data = await response.text()
-                    raise Exception(f'Azure OpenAI API error: {error_data}')
-    except Exception as e:
-        raise
\ No newline at end of file
+    Returns the OpenAI response shape, ``{"data": [{"embedding": [...], "index": 0}], "model": ...}``,
+    whichever provider is used.
+    """
+    provider = get_embedding_provider()
+    texts = text if isinstance(text, list) else [text]
+    keys = [(provider.name, provider.model, t) for t in texts]
+    embeddings = [_cached_embedding(key) for key in keys]
+    missing: Dict[Tuple[str, str, str], int] = {}
+    for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+        if embedding is None:
+            missing.setdefault(key, i)
+    if missing:
+        with span("embedding", **{"embedding.provider": provider.name, "embedding.model": provider.model,
+                                  "embedding.texts": len(missing)}):
+            fetched = dict(zip(missing, await provider.embed([texts[i] for i in missing.values()])))
+        for key, embedding in fetched.items():
+            _cache_embedding(key, embedding)
+        embeddings = [embedding if embedding is not None else fetched[key]
+                      for key, embedding in zip(keys, embeddings)]
+    return {
+        "data": [{"embedding": embedding, "index": i} for i, embedding in enumerate(embeddings)],
+        "model": provider.model,
+    }
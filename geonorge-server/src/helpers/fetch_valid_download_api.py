@@ -1,10 +1,12 @@
 import aiohttp
 import json
+from config import CONFIG
+from helpers.upstream import client_trace_configs, kartkatalog_url, upstream_url
 
 # API configuration
 API_URLS = {
-    'API_V1': 'https://nedlasting.geonorge.no/api/codelists/area/',
-    'API_V2': 'https://nedlasting.ngu.no/api/v2/codelists/area/'
+    'API_V1': f"{CONFIG['upstream']['nedlasting_url'].rstrip('/')}/api/codelists/area/",
+    'API_V2': f"{CONFIG['upstream']['nedlasting_ngu_url'].rstrip('/')}/api/v2/codelists/area/"
 }
 
 ERROR_MESSAGE = {
@@ -26,10 +28,10 @@ async def fetch_valid_download_data(api_url, uuid):
         print(ERROR_MESSAGE['NO_VALID_API'])
         return ERROR_MESSAGE['NO_VALID_API']
 
-    url = f"{api_url}{uuid}"
+    url = upstream_url(f"{api_url}{uuid}")
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=client_trace_configs()) as session:
             async with session.get(url) as response:
                 # Handle non-200 responses and possible redirection to login page
                 if response.status == 404:
@@ -79,10 +81,10 @@ async def fetch_get_data_api(uuid):
     Returns:
         dict/list: API response data or empty list on failure
     """
-    url = f"https://kartkatalog.geonorge.no/api/getdata/{uuid}"
+    url = kartkatalog_url(f"/api/getdata/{uuid}")
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(trace_configs=client_trace_configs()) as session:
             async with session.get(url) as response:
                 if response.status == 404:
                     return []
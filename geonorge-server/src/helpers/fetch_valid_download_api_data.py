@@ -1,16 +1,29 @@
 from helpers.fetch_valid_download_api import fetch_get_data_api
+from helpers.upstream import SingleFlightCache, client_trace_configs, upstream_url
 from xml.etree import ElementTree
 import aiohttp
+import functools
+
+# Error results are kept briefly only, so a slow WMS is retried on a later request
+_wms_cache = SingleFlightCache("wms", is_failure=lambda value: isinstance(value, dict) and "error" in value)
+
 
 async def get_wms(uuid: str) -> dict:
     """Get WMS capabilities information for a dataset.
 
+    Concurrent requests for the same dataset share one lookup, and results are
+    cached for a few minutes.
+
     Args:
         uuid (str): The dataset UUID
 
     Returns:
         dict: WMS capabilities information or error message
     """
+    return await _wms_cache.get(uuid, functools.partial(_get_wms, uuid))
+
+
+async def _get_wms(uuid: str) -> dict:
     try:
         raw = await fetch_get_data_api(uuid)
         if not raw:
@@ -27,8 +40,10 @@ async def get_wms(uuid: str) -> dict:
 
         dataset_title = raw.get('Title', '')
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(capabilities_url) as response:
+        # Bounded, since concurrent callers wait for the same lookup
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(timeout=timeout, trace_configs=client_trace_configs()) as session:
+            async with session.get(upstream_url(capabilities_url)) as response:
                 if not response.ok:
                     return {'error': f'HTTP error! status: {response.status}'}
                 
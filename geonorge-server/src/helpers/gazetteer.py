@@ -0,0 +1,322 @@
+"""
+Local gazetteer for resolving Norwegian place names to coordinates.
+
+Place names are loaded once from an offline dump (see scripts/build_gazetteer.py
+for converting the Kartverket SSR/Stedsnavn export) into an in-memory index:
+
+- an exact-match dictionary on normalised names,
+- a character trie used for prefix lookups ("Trondh" -> Trondheim), and
+- a bounded edit-distance walk over the same trie for typos ("Tromsoe", "Bergne").
+
+All lookups are pure in-memory operations and take microseconds, so the map
+workflow only has to fall back to the LLM for names that are not in the dump.
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Used when no place-name file is available, so the map still knows the largest cities
+BUILTIN_PLACES = [
+    # name, lat, lon, type, municipality
+    ("Oslo", 59.9139, 10.7522, "by", "Oslo"),
+    ("Bergen", 60.3913, 5.3221, "by", "Bergen"),
+    ("Trondheim", 63.4305, 10.3951, "by", "Trondheim"),
+    ("Stavanger", 58.9700, 5.7331, "by", "Stavanger"),
+    ("Tromsø", 69.6492, 18.9553, "by", "Tromsø"),
+    ("Kristiansand", 58.1599, 8.0182, "by", "Kristiansand"),
+    ("Drammen", 59.7440, 10.2045, "by", "Drammen"),
+    ("Fredrikstad", 59.2181, 10.9298, "by", "Fredrikstad"),
+    ("Sandnes", 58.8534, 5.7317, "by", "Sandnes"),
+    ("Bodø", 67.2804, 14.4051, "by", "Bodø"),
+]
+
+# Preferred place types when several places share a name (lower is better)
+TYPE_PRIORITY = {
+    "by": 0,
+    "tettsted": 1,
+    "kommune": 1,
+    "fylke": 2,
+    "bydel": 3,
+    "tettsteddel": 4,
+    "grend": 5,
+}
+DEFAULT_TYPE_PRIORITY = 10
+# Place types recognised in running text even when written in lower case ("flom i bergen")
+MAJOR_PLACE_TYPES = {"by", "kommune", "fylke"}
+# Longest place name, in words, looked for in running text ("Mo i Rana")
+MAX_MENTION_WORDS = 3
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*")
+
+_FOLD_MAP = str.maketrans({"æ": "ae", "ø": "o", "å": "a", "-": " ", "_": " "})
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalise a place name for indexing and lookup.
+
+    Lowercases, folds Norwegian letters and diacritics to ASCII and collapses
+    whitespace, so "Tromsø", "tromso" and " TROMSØ " share one key.
+    """
+    folded = name.lower().translate(_FOLD_MAP)
+    folded = unicodedata.normalize("NFKD", folded)
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return " ".join(folded.split())
+
+
+@dataclass
+class Place:
+    """A single named location from the gazetteer."""
+    name: str
+    lat: float
+    lon: float
+    type: str = ""
+    municipality: str = ""
+    population: int = 0
+
+    @property
+    def coordinates(self):
+        return (self.lat, self.lon)
+
+    def sort_key(self):
+        return (TYPE_PRIORITY.get(self.type.lower(), DEFAULT_TYPE_PRIORITY), -self.population, self.name)
+
+
+class _TrieNode:
+    __slots__ = ("children", "places")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.places: List[int] = []
+
+
+class Gazetteer:
+    """
+    In-memory place-name index with exact, prefix and fuzzy lookup.
+    """
+
+    def __init__(self, places: Optional[List[Place]] = None):
+        self.places: List[Place] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._root = _TrieNode()
+        for place in places or []:
+            self.add(place)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def add(self, place: Place) -> None:
+        """Add a place to the exact-match dictionary and the trie."""
+        key = normalize_name(place.name)
+        if not key:
+            return
+        place_id = len(self.places)
+        self.places.append(place)
+        self._exact.setdefault(key, []).append(place_id)
+
+        node = self._root
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+        node.places.append(place_id)
+
+    def _best(self, place_ids: List[int], municipality: Optional[str] = None) -> Optional[Place]:
+        candidates = [self.places[i] for i in place_ids]
+        if municipality:
+            wanted = normalize_name(municipality)
+            in_municipality = [p for p in candidates if normalize_name(p.municipality) == wanted]
+            candidates = in_municipality or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=Place.sort_key)
+
+    def mentions(self, text: str) -> List[str]:
+        """
+        Find the place names mentioned in a sentence.
+
+        Only exact names are matched, longest first. A name must be capitalised
+        in the text unless it is a city, municipality or county, so common words
+        that also name some farm or hamlet are not picked up.
+
+        Args:
+            text: Free text, e.g. a user's question
+
+        Returns:
+            Normalised names of the places found, sorted and without duplicates
+        """
+        words = _WORD_PATTERN.findall(text)
+        found = set()
+        i = 0
+        while i < len(words):
+            for length in range(min(MAX_MENTION_WORDS, len(words) - i), 0, -1):
+                key = normalize_name(" ".join(words[i:i + length]))
+                place_ids = self._exact.get(key)
+                if place_ids and (words[i][0].isupper()
+                                  or any(self.places[p].type.lower() in MAJOR_PLACE_TYPES for p in place_ids)):
+                    found.add(key)
+                    i += length
+                    break
+            else:
+                i += 1
+        return sorted(found)
+
+    def _ranked(self, place_ids: List[int]) -> List[int]:
+        return sorted(place_ids, key=lambda i: self.places[i].sort_key())
+
+    def _prefix_ids(self, key: str, limit: int) -> List[int]:
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+
+        found: List[int] = []
+        stack = [node]
+        # Collect more than needed before ranking so common names don't crowd out better types
+        while stack and len(found) < limit * 10:
+            current = stack.pop()
+            found.extend(current.places)
+            stack.extend(current.children.values())
+        return self._ranked(found)[:limit]
+
+    def prefix_search(self, prefix: str, limit: int = 10) -> List[Place]:
+        """Return up to ``limit`` places whose normalised name starts with ``prefix``."""
+        return [self.places[i] for i in self._prefix_ids(normalize_name(prefix), limit)]
+
+    def _fuzzy_ids(self, key: str, max_distance: Optional[int] = None) -> List[int]:
+        if not key:
+            return []
+        if max_distance is None:
+            max_distance = 1 if len(key) <= 5 else 2
+
+        matches: List[tuple] = []
+        first_row = list(range(len(key) + 1))
+
+        def walk(node: _TrieNode, ch: str, previous_row: List[int]) -> None:
+            row = [previous_row[0] + 1]
+            for col in range(1, len(key) + 1):
+                row.append(min(
+                    row[col - 1] + 1,
+                    previous_row[col] + 1,
+                    previous_row[col - 1] + (key[col - 1] != ch),
+                ))
+            if row[-1] <= max_distance and node.places:
+                matches.append((row[-1], node.places))
+            if min(row) <= max_distance:
+                for next_ch, child in node.children.items():
+                    walk(child, next_ch, row)
+
+        for ch, child in self._root.children.items():
+            walk(child, ch, first_row)
+
+        matches.sort(key=lambda match: match[0])
+        place_ids: List[int] = []
+        for _, ids in matches:
+            place_ids.extend(self._ranked(ids))
+        return place_ids
+
+    def fuzzy_search(self, name: str, max_distance: Optional[int] = None) -> List[Place]:
+        """
+        Find places within a bounded Levenshtein distance of ``name``, closest first.
+
+        Walks the trie while maintaining one row of the edit-distance matrix per
+        node and prunes branches whose minimum distance exceeds ``max_distance``,
+        so only a small part of the index is visited.
+        """
+        return [self.places[i] for i in self._fuzzy_ids(normalize_name(name), max_distance)]
+
+    def lookup(self, query: str) -> Optional[Place]:
+        """
+        Resolve a free-text location to the best matching place.
+
+        Supports an optional municipality qualifier after a comma, e.g.
+        "Bryggen, Bergen". Tries an exact match first, then a fuzzy match and
+        finally a prefix match.
+
+        Args:
+            query: Location name as written by the user or the LLM
+
+        Returns:
+            The best matching Place, or None if nothing is close enough
+        """
+        if not query:
+            return None
+        name, _, municipality = query.partition(",")
+        municipality = municipality.strip() or None
+        key = normalize_name(name)
+        if not key:
+            return None
+
+        if key in self._exact:
+            return self._best(self._exact[key], municipality)
+
+        # Typos are checked before prefixes so "Bergne" resolves to Bergen and not to
+        # some longer name; prefix matches are only trusted for reasonably long input
+        fuzzy_ids = self._fuzzy_ids(key)
+        if fuzzy_ids:
+            return self.places[fuzzy_ids[0]] if not municipality else self._best(fuzzy_ids, municipality)
+
+        if len(key) >= 4:
+            prefix_ids = self._prefix_ids(key, limit=5)
+            if prefix_ids:
+                return self._best(prefix_ids, municipality)
+        return None
+
+
+def load_places(path: str) -> List[Place]:
+    """
+    Load places from a ';'-separated file with a header row.
+
+    Expected columns: name, lat, lon and optionally type, municipality, population.
+    """
+    places = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f, delimiter=";")
+        for row in reader:
+            try:
+                places.append(Place(
+                    name=row["name"].strip(),
+                    lat=float(row["lat"]),
+                    lon=float(row["lon"]),
+                    type=(row.get("type") or "").strip(),
+                    municipality=(row.get("municipality") or "").strip(),
+                    population=int(row.get("population") or 0),
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping invalid gazetteer row {row}: {e}")
+    return places
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """Get the shared gazetteer, loading the place-name file on first use."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                path = CONFIG["gazetteer"]["path"]
+                gazetteer = Gazetteer([Place(*place) for place in BUILTIN_PLACES])
+                if path and os.path.exists(path):
+                    for place in load_places(path):
+                        gazetteer.add(place)
+                    logger.info(f"Loaded gazetteer with {len(gazetteer)} places from {path}")
+                else:
+                    logger.warning(f"Gazetteer file {path} not found, using {len(gazetteer)} built-in places")
+                _gazetteer = gazetteer
+    return _gazetteer
+
+
+def geocode(query: str) -> Optional[Place]:
+    """Resolve a location name with the shared gazetteer."""
+    return get_gazetteer().lookup(query)
@@ -0,0 +1,71 @@
+"""
+Deterministic local text embeddings for development, CI and load tests.
+
+Projects a bag of words and character trigrams into a fixed number of
+dimensions with the hashing trick (signed feature hashing) and L2-normalises
+the result. Texts sharing words or word fragments get similar vectors, which is
+enough to exercise ingestion, search and ranking end to end without network
+access. The vectors carry no real semantics and must not be mixed with vectors
+from a hosted model in the same table.
+
+Only the standard library is used, so scripts/ can import this module as well
+and ingestion and search always agree on the vectors.
+"""
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import List
+
+# Matches the vector(3072) columns used for text-embedding-3-large
+DEFAULT_DIMENSIONS = 3072
+TRIGRAM_WEIGHT = 0.5
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _features(text: str) -> Counter:
+    """Count word and padded character-trigram features of ``text``."""
+    features: Counter = Counter()
+    for word in _WORD_PATTERN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        features[f"w:{word}"] += 1.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            features[f"c:{padded[i:i + 3]}"] += TRIGRAM_WEIGHT
+    return features
+
+
+def _bucket(feature: str, dimensions: int):
+    # hashlib rather than hash(), which is randomised per process
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "big")
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+
+def embed_text(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """
+    Embed a single text.
+
+    Args:
+        text: Text to embed
+        dimensions: Length of the returned vector
+
+    Returns:
+        Unit-length vector, or all zeros for text without words
+    """
+    vector = [0.0] * dimensions
+    for feature, count in _features(text).items():
+        index, sign = _bucket(feature, dimensions)
+        # Sublinear term frequency so repeated words do not dominate
+        weight = 1.0 + math.log(count) if count > 1 else count
+        vector[index] += sign * weight
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        return vector
+    return [value / norm for value in vector]
+
+
+def embed_texts(texts: List[str], dimensions: int = DEFAULT_DIMENSIONS) -> List[List[float]]:
+    """Embed several texts, preserving order."""
+    return [embed_text(text, dimensions) for text in texts]
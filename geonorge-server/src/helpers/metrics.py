@@ -0,0 +1,221 @@
+"""
+Prometheus metrics for the backend, served at ``/metrics`` on the WebSocket port.
+
+Counters and histograms are updated where the work happens (upstream requests,
+LLM callbacks, caches); gauges such as open WebSockets or pool usage are read from
+callbacks at scrape time. ``render()`` produces the Prometheus text exposition
+format, so the ``prometheus_client`` package is not needed. All updates take a
+lock because they also come from executor threads and the Flask thread.
+"""
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import aiohttp
+
+_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+# Upstream and LLM latencies span a few ms (mock, cached) to tens of seconds (slow WMS, long answers)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests or tokens."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with _lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, e.g. latencies."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with _lock:
+            # Per-bucket counts, then sum and count
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with _lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(series[-1])}"
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter whose values are read from a callback at scrape time.
+
+    The callback returns a number, or a dict mapping label values (a tuple, or a
+    single string for one label) to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        try:
+            values = self.callback()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+def gauge_callback(name: str, documentation: str, callback: Callable[[], object],
+                   labelnames: Sequence[str] = ()) -> CallbackMetric:
+    """Register a gauge read from ``callback`` at scrape time."""
+    return CallbackMetric(name, documentation, callback, labelnames, kind="gauge")
+
+
+def counter_callback(name: str, documentation: str, callback: Callable[[], object],
+                     labelnames: Sequence[str] = ()) -> CallbackMetric:
+    """Register a counter kept elsewhere (e.g. TokenTracker) and read at scrape time."""
+    return CallbackMetric(name, documentation, callback, labelnames, kind="counter")
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    with _lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "geogpt_upstream_request_seconds",
+    "Duration of upstream HTTP requests (download API, kartkatalog, WMS, embeddings) per host",
+    ["host", "method", "status"],
+)
+# Recorded by the LLM callback handler (llm/usage_callback.py) for every model call
+LLM_CALL_SECONDS = Histogram(
+    "geogpt_llm_call_seconds",
+    "Duration of LLM calls per LangGraph node and chain",
+    ["node", "chain", "outcome"],
+)
+LLM_TOKENS = Counter(
+    "geogpt_llm_tokens_total",
+    "Tokens reported by the model per LangGraph node and chain",
+    ["node", "chain", "type"],
+)
+CACHE_REQUESTS = Counter(
+    "geogpt_cache_requests_total",
+    "Cache lookups per cache and result (hit or miss)",
+    ["cache", "result"],
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count a lookup in ``cache`` for the hit ratio."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+async def _on_request_start(session, context, params) -> None:
+    context.metrics_started = time.perf_counter()
+
+
+async def _on_request_end(session, context, params) -> None:
+    UPSTREAM_REQUEST_SECONDS.observe(
+        time.perf_counter() - context.metrics_started,
+        host=params.url.host or "", method=params.method, status=str(params.response.status),
+    )
+
+
+async def _on_request_exception(session, context, params) -> None:
+    UPSTREAM_REQUEST_SECONDS.observe(
+        time.perf_counter() - context.metrics_started,
+        host=params.url.host or "", method=params.method, status=type(params.exception).__name__,
+    )
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """aiohttp hooks recording every request in ``geogpt_upstream_request_seconds``."""
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_request_end.append(_on_request_end)
+    config.on_request_exception.append(_on_request_exception)
+    return config
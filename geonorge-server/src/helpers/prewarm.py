@@ -0,0 +1,192 @@
+"""
+Startup warm-up and the readiness state reported on ``/ready``.
+
+The server imports none of LangGraph and the LLM clients, and the database
+pool, the schema checks of the search table and the in-memory caches are
+empty until the first users pay for filling them. ``prewarm`` fills them
+before the server reports ready:
+
+- ``supervisor``: imports and builds the supervisor with its workflows, in a
+  thread so ``/ready`` and ``/metrics`` keep answering meanwhile.
+- ``gazetteer``: loads the place-name file used to resolve locations on the
+  map, which would otherwise be parsed by the first map question.
+- ``database``: opens the pool's ``pool_min_connections`` connections, which
+  stay open when returned, and checks which optional search columns (bbox,
+  search_tsv, combined_text_compact) exist.
+- ``embeddings``: embeds the most asked questions of the query log in one
+  batch, so they are served from the embedding cache.
+- ``search``: runs the catalogue search for those questions, which loads the
+  vector and full-text indexes into the database's buffer cache.
+- ``wms``: looks up the WMS capabilities of the top datasets of those
+  searches, the datasets most likely to end up on an image card.
+
+A step that fails is logged and reported on ``/ready`` but does not keep the
+server from becoming ready, and neither does a warm-up that takes longer than
+``timeout`` seconds.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List
+
+from config import CONFIG
+from helpers import metrics
+from helpers.connection import get_connection, return_connection
+from helpers.fetch_openai_embeddings_api import fetch_openai_embeddings
+from helpers.fetch_valid_download_api_data import get_wms
+from helpers.gazetteer import get_gazetteer
+from helpers.query_log import query_log
+from helpers.tracing import span
+from helpers.vector_database import _has_column, _use_compact_vectors, get_vdb_search_response
+
+logger = logging.getLogger(__name__)
+
+OPTIONAL_SEARCH_COLUMNS = ("bbox", "search_tsv", "combined_text_compact")
+# Warm-up searches run at the same time; each uses two pool connections (vector and full-text)
+SEARCH_CONCURRENCY = 2
+
+
+class Readiness:
+    """Whether the server has finished warming up, and how each step went."""
+
+    def __init__(self):
+        self.ready = False
+        self.started = time.monotonic()
+        # step -> {"status": "ok" | "failed", "seconds": ..., "detail": ...}
+        self.steps: Dict[str, Dict[str, Any]] = {}
+
+    def mark_ready(self) -> None:
+        self.ready = True
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.monotonic() - self.started, 1),
+            "steps": self.steps,
+        }
+
+    def response_body(self) -> bytes:
+        return json.dumps(self.report()).encode("utf-8")
+
+
+readiness = Readiness()
+
+metrics.gauge_callback("geogpt_ready", "1 once the startup warm-up has finished", lambda: int(readiness.ready))
+
+
+def _warm_database(connections: int) -> int:
+    """Open ``connections`` pool connections and run the search table's schema checks."""
+    opened = []
+    try:
+        for _ in range(max(1, connections)):
+            conn = get_connection()
+            opened.append(conn)
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.commit()
+        for column in OPTIONAL_SEARCH_COLUMNS:
+            _has_column(opened[0], column)
+        # Reports a compact column built with other dimensions than COMPACT_VECTOR_DIMENSIONS at startup
+        _use_compact_vectors(opened[0], True)
+        opened[0].commit()
+        return len(opened)
+    finally:
+        for conn in opened:
+            return_connection(conn)
+
+
+async def _step(name: str, coro) -> Any:
+    """Run one warm-up step, recording its outcome on ``readiness``."""
+    started = time.perf_counter()
+    with span(f"prewarm.{name}"):
+        try:
+            detail = await coro
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e}")
+            readiness.steps[name] = {"status": "failed", "seconds": round(time.perf_counter() - started, 2),
+                                     "detail": str(e)}
+            return None
+    # Only counts are reported; /ready must not expose logged questions
+    count = len(detail) if isinstance(detail, list) else detail
+    readiness.steps[name] = {"status": "ok", "seconds": round(time.perf_counter() - started, 2), "detail": count}
+    logger.info(f"Warm-up step {name} done in {readiness.steps[name]['seconds']}s: {count}")
+    return detail
+
+
+async def _warm_searches(questions: List[str]) -> List[str]:
+    """Search for each question and return the top dataset UUIDs, best first, without duplicates."""
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+    async def search(question: str) -> List[tuple]:
+        async with semaphore:
+            return await get_vdb_search_response(question)
+
+    results = await asyncio.gather(*(search(q) for q in questions), return_exceptions=True)
+    uuids: List[str] = []
+    for rows in results:
+        if isinstance(rows, Exception) or not rows:
+            continue
+        uuid = rows[0][0]
+        if uuid and uuid not in uuids:
+            uuids.append(uuid)
+    return uuids
+
+
+async def _warm_wms(uuids: List[str], concurrency: int) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(uuid: str) -> bool:
+        async with semaphore:
+            result = await get_wms(uuid)
+        return isinstance(result, dict) and "error" not in result
+
+    results = await asyncio.gather(*(warm(uuid) for uuid in uuids), return_exceptions=True)
+    return sum(1 for result in results if result is True)
+
+
+def _build_supervisor() -> str:
+    from rag import get_supervisor
+    return type(get_supervisor()).__name__
+
+
+async def _prewarm() -> None:
+    prewarm_config = CONFIG["prewarm"]
+    await _step("supervisor", asyncio.to_thread(_build_supervisor))
+    await _step("gazetteer", asyncio.to_thread(lambda: len(get_gazetteer())))
+    await _step("database", asyncio.to_thread(_warm_database, CONFIG["db"]["pool_min_connections"]))
+
+    questions = await _step("query_log", query_log.top_questions(prewarm_config["top_questions"])) or []
+    if not questions:
+        return
+
+    async def embed() -> int:
+        await fetch_openai_embeddings(questions)
+        return len(questions)
+
+    if await _step("embeddings", embed()) is None:
+        return
+    uuids = await _step("search", _warm_searches(questions)) or []
+    if uuids:
+        await _step("wms", _warm_wms(uuids[:prewarm_config["wms_datasets"]], prewarm_config["wms_concurrency"]))
+
+
+async def prewarm() -> None:
+    """
+    Warm the pool and caches, then mark the server ready.
+
+    Run as a background task once the server accepts connections, so ``/ready``
+    can answer 503 while it runs.
+    """
+    prewarm_config = CONFIG["prewarm"]
+    if prewarm_config["enabled"]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(_prewarm(), timeout=prewarm_config["timeout"])
+        except asyncio.TimeoutError:
+            logger.warning(f"Warm-up did not finish within {prewarm_config['timeout']}s, reporting ready anyway")
+            readiness.steps["timeout"] = {"status": "failed", "seconds": prewarm_config["timeout"]}
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.1f}s")
+    readiness.mark_ready()
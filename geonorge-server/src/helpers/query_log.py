@@ -0,0 +1,179 @@
+"""
+Log of the questions users ask, counted per normalised question.
+
+Chat questions and search queries are counted in memory and added to the
+``query_log`` table every ``flush_interval`` seconds, like the token counters of
+``TokenTracker``. The table is shared by all server processes, and the most
+frequent questions are used to warm the caches at startup (see
+``helpers/prewarm.py``).
+
+The questions are stored as typed, so rows not asked for ``retention`` seconds
+are deleted by the flush loop (at most every ``PRUNE_INTERVAL_SECONDS``).
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+from psycopg2.extras import execute_values
+
+from config import CONFIG
+from helpers.connection import get_connection, return_connection
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_TABLE = "query_log"
+# Longer questions are pasted text rather than something worth warming
+MAX_QUESTION_CHARS = 500
+# Seconds between deletes of rows older than the retention
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def normalise(question: str) -> str:
+    """Trim and collapse whitespace; case is kept since it is embedded as typed."""
+    return re.sub(r"\s+", " ", question).strip()
+
+
+class QueryLog:
+    """Counts questions in memory and adds them to ``query_log`` in the background."""
+
+    def __init__(self):
+        log_config = CONFIG["query_log"]
+        self.enabled = log_config["enabled"]
+        self.flush_interval = log_config["flush_interval"]
+        self.retention = log_config["retention"]
+        self._lock = threading.Lock()
+        self._pending: Counter = Counter()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._table_ready = False
+        self._pruned_at = 0.0
+
+    def record(self, question: str) -> None:
+        """Count one occurrence of ``question``"""
+        if not self.enabled or not isinstance(question, str):
+            return
+        question = normalise(question)
+        if not question or len(question) > MAX_QUESTION_CHARS:
+            return
+        with self._lock:
+            self._pending[question] += 1
+
+    def _ensure_table(self, conn) -> None:
+        if self._table_ready:
+            return
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {QUERY_LOG_TABLE} (
+                    question TEXT PRIMARY KEY,
+                    asked INTEGER NOT NULL DEFAULT 0,
+                    last_asked TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+        conn.commit()
+        # Only once committed; a rolled back CREATE would otherwise never be retried
+        self._table_ready = True
+
+    def _write(self, pending: Counter, prune: bool) -> None:
+        conn = get_connection()
+        try:
+            self._ensure_table(conn)
+            with conn.cursor() as cur:
+                if pending:
+                    execute_values(
+                        cur,
+                        f"""
+                        INSERT INTO {QUERY_LOG_TABLE} (question, asked) VALUES %s
+                        ON CONFLICT (question) DO UPDATE SET
+                            asked = {QUERY_LOG_TABLE}.asked + excluded.asked,
+                            last_asked = now()
+                        """,
+                        list(pending.items()),
+                    )
+                if prune:
+                    cur.execute(
+                        f"DELETE FROM {QUERY_LOG_TABLE} WHERE last_asked < now() - make_interval(secs => %s)",
+                        (self.retention,)
+                    )
+                    if cur.rowcount:
+                        logger.info(f"Deleted {cur.rowcount} questions older than the query log retention")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            return_connection(conn)
+
+    async def flush(self) -> None:
+        """Add the pending counts to the table and delete expired rows without blocking the event loop"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        prune = time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS
+        if not pending and not prune:
+            return
+        try:
+            await asyncio.to_thread(self._write, pending, prune)
+            if prune:
+                self._pruned_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Could not write the query log: {e}")
+            with self._lock:
+                self._pending.update(pending)
+
+    def _read_top(self, limit: int, max_age: float) -> List[str]:
+        conn = get_connection()
+        try:
+            self._ensure_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT question FROM {QUERY_LOG_TABLE}
+                    WHERE last_asked > now() - make_interval(secs => %s)
+                    ORDER BY asked DESC, last_asked DESC
+                    LIMIT %s
+                    """,
+                    (max_age, limit)
+                )
+                rows = cur.fetchall()
+            conn.commit()
+            return [row[0] for row in rows]
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            return_connection(conn)
+
+    async def top_questions(self, limit: int) -> List[str]:
+        """The ``limit`` most asked questions that were asked within ``max_age``"""
+        if not self.enabled or limit <= 0:
+            return []
+        return await asyncio.to_thread(self._read_top, limit, CONFIG["query_log"]["max_age"])
+
+    async def _flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+    def start(self):
+        """Start the periodic background flush; call from the running event loop"""
+        if self.enabled and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background flush after writing what is pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+
+query_log = QueryLog()
@@ -0,0 +1,392 @@
+"""
+Semantic cache of complete chat answers.
+
+Many users open with the same questions ("hva er FKB?", "hvilke datasett finnes
+for flom"), and each one runs the whole supervisor → agent → tool → grading →
+generation pipeline. This cache stores the finished answer of a turn (the
+streamed markdown and the ``insertImage`` and ``chatDatasets`` payloads) under
+the embedding of the question. A later question whose embedding has a cosine
+similarity of at least ``similarity_threshold`` is answered by replaying the
+stored messages over the WebSocket, the same way a live answer is streamed.
+
+Embeddings of "flom i Bergen" and "flom i Oslo" are nearly identical, so a hit
+also requires the same place names (found with the gazetteer) and the same
+map view, which restricts the dataset search (see ``cache_scope``).
+
+- Answers are captured with ``recording``, which collects what
+  ``send_websocket_message``/``send_websocket_action`` send during the turn.
+  Turns that send anything else, such as ``mapUpdate``, are not stored.
+  ``updateImageCard`` patches are merged into the stored card, including those
+  arriving after the turn has ended.
+- Only the first turn of a session is stored, because later answers may depend
+  on the conversation. Questions that look like follow-ups of earlier turns
+  bypass the cache (see ``is_follow_up``).
+- Question embeddings come from ``fetch_openai_embeddings``, whose LRU cache
+  serves the same embedding to the vector search later in the turn.
+- The search table is checked every ``version_check_interval`` seconds. When
+  it has been re-indexed (replaced, or rows inserted, updated or deleted) the
+  cache is emptied.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import CONFIG
+from helpers import metrics
+from helpers.connection import get_connection, return_connection
+from helpers.fetch_openai_embeddings_api import fetch_openai_embeddings
+from helpers.gazetteer import get_gazetteer
+from helpers.tracing import span
+from helpers.vector_database import TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+# Messages a stored answer may consist of; anything else makes the turn uncacheable
+CACHEABLE_ACTIONS = {"chatStream", "streamComplete", "formatMarkdown", "insertImage", "chatDatasets"}
+# Status messages that are not part of the answer and are not recorded
+UNRECORDED_ACTIONS = {"queuePosition"}
+
+# Words that refer back to earlier turns ("hva med den", "flere som dette", "and those?")
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(og|men|enn|hva med|hvordan med|and|what about)\b"
+    r"|\b(den|dette|denne|disse|dem|deres|samme|forrige|nevnte|ovenfor|også|flere|mer|"
+    r"it|this|that|these|those|them|same|previous|more)\b",
+    re.IGNORECASE,
+)
+
+# Words per chatStream message when an answer is replayed
+REPLAY_CHUNK_WORDS = 8
+# Decimals the map view is rounded to in the cache key (about 1 km)
+VIEW_BBOX_DECIMALS = 2
+
+# Place names in the question and the rounded map view; answers are only shared within one scope
+CacheScope = Tuple[Tuple[str, ...], Optional[Tuple[float, ...]]]
+
+
+@dataclass
+class CachedResponse:
+    """A finished answer as sent to the client."""
+    question: str
+    markdown: str
+    insert_image: Optional[Dict[str, Any]] = None
+    chat_datasets: Optional[List[Dict[str, Any]]] = None
+    created: float = 0.0
+    scope: Optional[CacheScope] = None
+
+
+class ResponseRecorder:
+    """Collects the messages sent to one WebSocket during a chat turn."""
+
+    def __init__(self, websocket: Any):
+        self.websocket = websocket
+        self.messages: List[Tuple[str, Any]] = []
+        # Copy of the insertImage payload; shared with the cache entry so late patches reach it
+        self.image_card: Optional[Dict[str, Any]] = None
+        # Cleared for answers that must not be replayed, e.g. retrieval-only answers under load
+        self.cacheable = True
+
+    def add(self, action: str, payload: Any) -> None:
+        if action in UNRECORDED_ACTIONS:
+            return
+        if action == "updateImageCard":
+            if self.image_card is not None and payload.get("datasetUuid") == self.image_card.get("datasetUuid"):
+                self.image_card.update(payload)
+            return
+        if action == "insertImage" and self.image_card is None:
+            self.image_card = dict(payload)
+        self.messages.append((action, payload))
+
+    def response(self, question: str) -> Optional[CachedResponse]:
+        """The recorded turn as a cache entry, or None if it cannot be replayed."""
+        if not self.cacheable:
+            return None
+        actions = [action for action, _ in self.messages]
+        if not set(actions) <= CACHEABLE_ACTIONS or actions.count("insertImage") > 1:
+            return None
+        streams = [payload for action, payload in self.messages if action == "chatStream"]
+        if not all(isinstance(payload, dict) for payload in streams):
+            return None
+        if sum(1 for payload in streams if payload.get("isNewMessage")) != 1:
+            return None
+        markdown = "".join(payload.get("payload") or "" for payload in streams)
+        if not markdown.strip():
+            return None
+        payloads = {action: payload for action, payload in self.messages}
+        return CachedResponse(
+            question=question,
+            markdown=markdown,
+            insert_image=self.image_card,
+            chat_datasets=payloads.get("chatDatasets"),
+        )
+
+
+_recorder: ContextVar[Optional[ResponseRecorder]] = ContextVar("response_recorder", default=None)
+
+
+@contextmanager
+def recording(websocket: Any) -> Iterator[ResponseRecorder]:
+    """Record what is sent to ``websocket`` by the code running inside the block."""
+    recorder = ResponseRecorder(websocket)
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def record_sent(action: str, payload: Any, websocket: Any) -> None:
+    """Called by the WebSocket send helpers for every message."""
+    recorder = _recorder.get()
+    if recorder is not None and recorder.websocket is websocket:
+        recorder.add(action, payload)
+
+
+def exclude_from_cache() -> None:
+    """Keep the answer of the running turn out of the cache."""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.cacheable = False
+
+
+def is_follow_up(question: str, has_history: bool) -> bool:
+    """
+    Guess whether ``question`` depends on earlier turns of the conversation.
+
+    Without history nothing can be a follow-up. With history, very short
+    questions ("og Bergen?") and questions referring back to something
+    ("hva med den andre?") are treated as follow-ups.
+    """
+    if not has_history:
+        return False
+    if len(question.split()) <= CONFIG["response_cache"]["followup_max_words"]:
+        return True
+    return FOLLOW_UP_PATTERN.search(question) is not None
+
+
+def cache_scope(question: str, view_bbox: Optional[Tuple[float, float, float, float]] = None) -> CacheScope:
+    """
+    The part of a question's cache key that embeddings do not capture.
+
+    Args:
+        question: The user's question
+        view_bbox: The client's map view (west, south, east, north), if the search is restricted to it
+
+    Returns:
+        The place names mentioned in the question and the rounded map view
+    """
+    places = tuple(get_gazetteer().mentions(question))
+    view = tuple(round(value, VIEW_BBOX_DECIMALS) for value in view_bbox) if view_bbox else None
+    return places, view
+
+
+def _index_signature() -> Optional[Tuple[int, int]]:
+    """
+    Identify the current contents of the search table.
+
+    The table's oid changes when insert_csv.py swaps in a new table, and the
+    statistics' insert/update/delete counters change when rows are
+    re-embedded in place (incremental_index.py, insert_pdf.py).
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.oid::bigint,
+                       COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0)
+                FROM pg_class c
+                LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                WHERE c.oid = to_regclass(%s)
+                """,
+                (TABLE_NAME,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return tuple(row) if row else None
+    finally:
+        return_connection(conn)
+
+
+class ResponseCache:
+    """
+    Answers keyed by normalised question embeddings.
+
+    Embeddings are kept in one preallocated matrix, so a lookup is a single
+    matrix-vector product over at most ``max_entries`` rows.
+    """
+
+    def __init__(self):
+        cache_config = CONFIG["response_cache"]
+        self.enabled = cache_config["enabled"]
+        self.threshold = cache_config["similarity_threshold"]
+        self.max_entries = cache_config["max_entries"]
+        self.ttl = cache_config["ttl"]
+        self.version_check_interval = cache_config["version_check_interval"]
+        self._vectors: Optional[np.ndarray] = None
+        # slot -> entry, least recently used first
+        self._entries: "OrderedDict[int, CachedResponse]" = OrderedDict()
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Drop every stored answer."""
+        self._entries.clear()
+        if self._vectors is not None:
+            self._vectors[:] = 0
+
+    async def _check_index_version(self) -> None:
+        """Empty the cache if the search table changed since the last check."""
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check_interval:
+            return
+        async with self._lock:
+            if now - self._checked_at < self.version_check_interval:
+                return
+            self._checked_at = now
+            try:
+                signature = await asyncio.to_thread(_index_signature)
+            except Exception as e:
+                logger.warning(f"Could not read the search table version: {e}")
+                return
+            if self._signature is not None and signature != self._signature and self._entries:
+                logger.info(f"Search table re-indexed, dropping {len(self._entries)} cached answers")
+                self.clear()
+            self._signature = signature
+
+    async def _embed(self, question: str) -> np.ndarray:
+        result = await fetch_openai_embeddings(question)
+        vector = np.asarray(result["data"][0]["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _free_slot(self, slot: int) -> None:
+        self._entries.pop(slot, None)
+        self._vectors[slot] = 0
+
+    async def lookup(self, question: str, has_history: bool = False,
+                     view_bbox: Optional[Tuple[float, float, float, float]] = None) -> Optional[CachedResponse]:
+        """
+        Find a stored answer for a question with (nearly) the same meaning.
+
+        Args:
+            question: The user's question
+            has_history: Whether the session has earlier turns
+            view_bbox: The client's map view, which restricts the dataset search
+
+        Returns:
+            The stored answer, or None on a miss or when the cache is bypassed
+        """
+        if not self.enabled or is_follow_up(question, has_history):
+            return None
+        with span("response_cache.lookup", **{"cache.entries": len(self._entries)}) as lookup_span:
+            await self._check_index_version()
+            entry = None
+            if self._entries:
+                try:
+                    vector = await self._embed(question)
+                    scope = await asyncio.to_thread(cache_scope, question, view_bbox)
+                except Exception as e:
+                    logger.warning(f"Response cache lookup failed: {e}")
+                    return None
+                scores = self._vectors @ vector
+                lookup_span.set_attribute("cache.similarity", float(scores.max()))
+                # Best match among the similar questions about the same places and view
+                for slot in np.flatnonzero(scores >= self.threshold)[np.argsort(-scores[scores >= self.threshold])]:
+                    slot = int(slot)
+                    candidate = self._entries.get(slot)
+                    if candidate is None or candidate.scope != scope:
+                        continue
+                    if time.time() - candidate.created > self.ttl:
+                        self._free_slot(slot)
+                        continue
+                    entry = candidate
+                    self._entries.move_to_end(slot)
+                    break
+            lookup_span.set_attribute("cache.hit", entry is not None)
+        metrics.record_cache("response", entry is not None)
+        return entry
+
+    async def store(self, recorder: ResponseRecorder, question: str, has_history: bool = False,
+                    view_bbox: Optional[Tuple[float, float, float, float]] = None) -> bool:
+        """
+        Store the answer recorded for ``question`` if it can be replayed later.
+
+        Args:
+            recorder: Messages sent during the turn
+            question: The user's question
+            has_history: Whether the session had earlier turns; such answers are not stored
+            view_bbox: The client's map view the answer was searched in
+
+        Returns:
+            Whether the answer was stored
+        """
+        if not self.enabled or has_history:
+            return False
+        entry = recorder.response(question)
+        if entry is None:
+            return False
+        await self._check_index_version()
+        try:
+            vector = await self._embed(question)
+            entry.scope = await asyncio.to_thread(cache_scope, question, view_bbox)
+        except Exception as e:
+            logger.warning(f"Could not store answer in the response cache: {e}")
+            return False
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        if len(self._entries) < self.max_entries:
+            used = set(self._entries)
+            slot = next(i for i in range(self.max_entries) if i not in used)
+        else:
+            slot = next(iter(self._entries))
+            self._free_slot(slot)
+        entry.created = time.time()
+        self._vectors[slot] = vector
+        self._entries[slot] = entry
+        return True
+
+
+def _replay_chunks(markdown: str) -> Iterator[str]:
+    """Split an answer into chatStream chunks of a few words, keeping all whitespace."""
+    tokens = re.findall(r"\s*\S+\s*", markdown) or [markdown]
+    for i in range(0, len(tokens), REPLAY_CHUNK_WORDS):
+        yield "".join(tokens[i:i + REPLAY_CHUNK_WORDS])
+
+
+async def replay_response(entry: CachedResponse, websocket: Any) -> str:
+    """
+    Send a stored answer to the client as if it were generated now.
+
+    Returns:
+        The answer's markdown
+    """
+    from helpers.websocket import send_websocket_message, send_websocket_action
+
+    await send_websocket_message("chatStream", {"payload": "", "isNewMessage": True}, websocket)
+    for chunk in _replay_chunks(entry.markdown):
+        await send_websocket_message("chatStream", {"payload": chunk}, websocket)
+    await send_websocket_action("streamComplete", websocket)
+    await send_websocket_action("formatMarkdown", websocket)
+    if entry.insert_image:
+        await send_websocket_message("insertImage", entry.insert_image, websocket)
+    if entry.chat_datasets:
+        await send_websocket_message("chatDatasets", entry.chat_datasets, websocket)
+    return entry.markdown
+
+
+response_cache = ResponseCache()
+
+metrics.gauge_callback("geogpt_response_cache_entries", "Answers stored in the semantic response cache",
+                       lambda: len(response_cache))
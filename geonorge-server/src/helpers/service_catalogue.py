@@ -0,0 +1,392 @@
+"""
+Local catalogue of the download and WMS services of every dataset.
+
+Search results and chat datasets are enriched with their download formats,
+a direct download URL, WMS layers and whether ordering is restricted. Looking
+these up live costs several Geonorge and WMS requests per dataset on every
+search. The service catalogue keeps the results in the
+``dataset_service_catalogue`` table instead:
+
+- A background harvester (``ServiceCatalogueHarvester``) walks the datasets of
+  the search table every ``harvest_interval`` seconds and enriches those whose
+  row is missing or older than ``refresh_after`` (less than ``max_age``, so
+  rows are renewed before they expire). It runs at most ``concurrency``
+  lookups at a time and waits ``request_delay`` seconds after each dataset, so
+  the upstream services are not flooded. Each batch of ``batch_size`` datasets
+  is selected, enriched and written in one transaction that holds a Postgres
+  advisory lock, so several server processes never harvest at the same time.
+- At query time ``lookup`` reads the rows of all result datasets with one
+  indexed join. Only datasets without a fresh row are enriched live, and
+  their results are written back with ``store``.
+
+The table is created on first use. A harvest pass can also be run by hand::
+
+    python -m helpers.service_catalogue
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import Json, execute_values
+
+from config import CONFIG
+from helpers import metrics
+from helpers.connection import get_connection, return_connection
+from helpers.vector_database import TABLE_NAME
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_TABLE = CONFIG["service_catalogue"]["table"]
+
+HARVESTED = metrics.Counter(
+    "geogpt_service_catalogue_harvested_total",
+    "Datasets enriched by the service catalogue harvester per outcome",
+    ["outcome"],
+)
+
+_table_ready = False
+
+
+def _ensure_table(conn) -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CATALOGUE_TABLE} (
+            uuid TEXT PRIMARY KEY,
+            download_formats JSONB NOT NULL DEFAULT '[]',
+            download_url TEXT,
+            restricted BOOLEAN NOT NULL DEFAULT FALSE,
+            wms JSONB,
+            wms_failed BOOLEAN NOT NULL DEFAULT FALSE,
+            harvested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """)
+    conn.commit()
+    # Only once committed; a rolled back CREATE would otherwise never be retried
+    _table_ready = True
+
+
+def wms_status(wms_url: Any) -> str:
+    """
+    State of the ``wmsUrl`` field of an enriched dataset.
+
+    Returns:
+        "pending" for the ``{"loading": True}`` placeholder of a WMS that did
+        not answer in time, "available" for resolved WMS details and "none"
+        otherwise
+    """
+    if isinstance(wms_url, dict) and wms_url.get("loading"):
+        return "pending"
+    return "available" if wms_url else "none"
+
+
+def _entry(row: Tuple) -> Dict[str, Any]:
+    """A catalogue row as the enrichment fields of a search result."""
+    _, download_formats, download_url, restricted, wms, wms_failed = row
+    wms_url = {"loading": True} if wms_failed else wms
+    return {
+        "downloadFormats": download_formats or [],
+        # A WMS that did not answer the harvester is retried by the client like a live timeout
+        "wmsUrl": wms_url,
+        "wmsStatus": wms_status(wms_url),
+        "downloadUrl": download_url,
+        "restricted": restricted,
+        "error": None,
+    }
+
+
+def _read(uuids: Sequence[str], max_age: float) -> Dict[str, Dict[str, Any]]:
+    conn = get_connection()
+    try:
+        _ensure_table(conn)
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT c.uuid, c.download_formats, c.download_url, c.restricted, c.wms, c.wms_failed
+                FROM unnest(%s::text[]) AS q(uuid)
+                JOIN {CATALOGUE_TABLE} c ON c.uuid = q.uuid
+                WHERE c.harvested_at > now() - make_interval(secs => %s)
+                """,
+                (list(uuids), max_age)
+            )
+            rows = cur.fetchall()
+        conn.commit()
+        return {row[0]: _entry(row) for row in rows}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        return_connection(conn)
+
+
+async def lookup(uuids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Read the fresh catalogue rows of ``uuids``.
+
+    Args:
+        uuids: Dataset UUIDs of a search result
+
+    Returns:
+        uuid -> downloadFormats, wmsUrl, wmsStatus (see ``wms_status``), downloadUrl, restricted and error, for
+        the datasets harvested within ``max_age``. Empty if the catalogue is
+        disabled or cannot be read.
+    """
+    catalogue_config = CONFIG["service_catalogue"]
+    if not catalogue_config["enabled"] or not uuids:
+        return {}
+    try:
+        entries = await asyncio.to_thread(_read, list(dict.fromkeys(uuids)), catalogue_config["max_age"])
+    except Exception as e:
+        logger.warning(f"Could not read the service catalogue: {e}")
+        return {}
+    for uuid in uuids:
+        metrics.record_cache("service_catalogue", uuid in entries)
+    return entries
+
+
+def _upsert(conn, datasets: List[Dict[str, Any]]) -> None:
+    """Insert or replace the catalogue rows of enriched datasets, without committing."""
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"""
+            INSERT INTO {CATALOGUE_TABLE}
+                (uuid, download_formats, download_url, restricted, wms, wms_failed, harvested_at)
+            VALUES %s
+            ON CONFLICT (uuid) DO UPDATE SET
+                download_formats = excluded.download_formats,
+                download_url = excluded.download_url,
+                restricted = excluded.restricted,
+                wms = excluded.wms,
+                wms_failed = excluded.wms_failed,
+                harvested_at = excluded.harvested_at
+            """,
+            [
+                (
+                    dataset["uuid"],
+                    Json(dataset.get("downloadFormats") or []),
+                    dataset.get("downloadUrl"),
+                    bool(dataset.get("restricted")),
+                    Json(dataset["wmsUrl"]) if wms_status(dataset.get("wmsUrl")) == "available" else None,
+                    wms_status(dataset.get("wmsUrl")) == "pending",
+                )
+                for dataset in datasets
+            ],
+            template="(%s, %s, %s, %s, %s, %s, now())",
+        )
+
+
+def _write(datasets: List[Dict[str, Any]]) -> None:
+    conn = get_connection()
+    try:
+        _ensure_table(conn)
+        _upsert(conn, datasets)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        return_connection(conn)
+
+
+def storable(dataset: Dict[str, Any]) -> bool:
+    """Whether an enriched dataset is complete enough to be served from the catalogue."""
+    return bool(dataset.get("uuid")) and not dataset.get("error")
+
+
+async def store(datasets: List[Dict[str, Any]]) -> None:
+    """
+    Write enriched datasets (as returned by ``enrich_dataset``) to the catalogue.
+
+    Datasets whose enrichment reported errors or whose WMS did not answer in
+    time are skipped; they are looked up live until the harvester, with its
+    longer timeout, has stored them.
+    """
+    datasets = [
+        dataset for dataset in datasets
+        if storable(dataset) and wms_status(dataset.get("wmsUrl")) != "pending"
+    ]
+    if not CONFIG["service_catalogue"]["enabled"] or not datasets:
+        return
+    try:
+        await asyncio.to_thread(_write, datasets)
+    except Exception as e:
+        logger.warning(f"Could not update the service catalogue: {e}")
+
+
+def _prune(conn) -> None:
+    """Delete the rows of datasets that are no longer in the search table, without committing."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM {CATALOGUE_TABLE} c
+            WHERE NOT EXISTS (SELECT 1 FROM {TABLE_NAME} t WHERE t.uuid = c.uuid)
+        """)
+
+
+def _claim_batch(conn, refresh_after: float, limit: int, skip: Sequence[str]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Open a harvest transaction on ``conn`` and select its datasets.
+
+    The advisory lock is taken with ``pg_try_advisory_xact_lock``, so it is held
+    until the caller commits or rolls back the batch.
+
+    Args:
+        conn: Connection the whole batch runs on
+        refresh_after: Seconds after which a row is stale
+        limit: Datasets in the batch
+        skip: Datasets already tried in this pass
+
+    Returns:
+        Datasets without a catalogue row younger than ``refresh_after``, oldest
+        first, or None (with the transaction rolled back) if another process
+        holds the lock
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (CATALOGUE_TABLE,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        # PDF chunks have no services and are skipped
+        cur.execute(
+            f"""
+            SELECT d.uuid, d.title, d.getcapabilitiesurl
+            FROM (
+                SELECT DISTINCT ON (uuid) uuid, title, getcapabilitiesurl
+                FROM {TABLE_NAME}
+                WHERE uuid IS NOT NULL AND schema IS DISTINCT FROM 'pdf'
+                ORDER BY uuid
+            ) d
+            LEFT JOIN {CATALOGUE_TABLE} c ON c.uuid = d.uuid
+            WHERE (c.uuid IS NULL OR c.harvested_at <= now() - make_interval(secs => %s))
+              AND d.uuid <> ALL(%s::text[])
+            ORDER BY c.harvested_at NULLS FIRST
+            LIMIT %s
+            """,
+            (refresh_after, list(skip), limit)
+        )
+        rows = cur.fetchall()
+    return [{"uuid": uuid, "title": title, "getcapabilitiesurl": url} for uuid, title, url in rows]
+
+
+class ServiceCatalogueHarvester:
+    """Periodically refreshes stale rows of the service catalogue in the background."""
+
+    def __init__(self):
+        catalogue_config = CONFIG["service_catalogue"]
+        self.interval = catalogue_config["harvest_interval"]
+        self.refresh_after = catalogue_config["refresh_after"]
+        self.concurrency = catalogue_config["concurrency"]
+        self.request_delay = catalogue_config["request_delay"]
+        self.wms_timeout = catalogue_config["wms_timeout"]
+        self.batch_size = catalogue_config["batch_size"]
+        self._task: Optional[asyncio.Task] = None
+
+    async def _enrich(self, dataset: Dict[str, Any], semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        from helpers.download import enrich_dataset
+
+        async with semaphore:
+            try:
+                enriched = await enrich_dataset(dataset, wms_timeout_seconds=self.wms_timeout, cached=False)
+            except Exception as e:
+                logger.warning(f"Harvesting services of {dataset['uuid']} failed: {e}")
+                enriched = None
+            finally:
+                await asyncio.sleep(self.request_delay)
+        HARVESTED.inc(outcome="ok" if enriched and storable(enriched) else "error")
+        return enriched
+
+    async def _harvest(self, conn) -> Optional[int]:
+        """Harvest batch by batch on ``conn`` until no stale dataset is left."""
+        await asyncio.to_thread(_ensure_table, conn)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        attempted: List[str] = []
+        harvested = 0
+        while True:
+            batch = await asyncio.to_thread(_claim_batch, conn, self.refresh_after, self.batch_size, attempted)
+            if batch is None:
+                if not attempted:
+                    logger.info("Service catalogue is being harvested by another process")
+                    return None
+                # Another process took over between two batches
+                break
+            try:
+                if not attempted:
+                    await asyncio.to_thread(_prune, conn)
+                if not batch:
+                    await asyncio.to_thread(conn.commit)
+                    break
+                if not attempted:
+                    logger.info(f"Harvesting stale service details into {CATALOGUE_TABLE}")
+                attempted.extend(dataset["uuid"] for dataset in batch)
+                results = await asyncio.gather(*(self._enrich(dataset, semaphore) for dataset in batch))
+                enriched = [result for result in results if result and storable(result)]
+                if enriched:
+                    await asyncio.to_thread(_upsert, conn, enriched)
+                # Commit the batch, which also releases the lock until the next one
+                await asyncio.to_thread(conn.commit)
+            except Exception:
+                # On cancellation return_connection rolls the open transaction back instead
+                await asyncio.to_thread(conn.rollback)
+                raise
+            harvested += len(enriched)
+        if attempted:
+            logger.info(f"Service catalogue harvest done: {harvested}/{len(attempted)} datasets stored")
+        return harvested
+
+    async def harvest_once(self) -> Optional[int]:
+        """
+        Enrich every dataset whose catalogue row is missing or stale.
+
+        Uses a single pool connection; each batch is one transaction holding
+        the advisory lock.
+
+        Returns:
+            Number of datasets stored, or None if another process is harvesting
+        """
+        conn = await asyncio.to_thread(get_connection)
+        try:
+            return await self._harvest(conn)
+        finally:
+            return_connection(conn)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.harvest_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Service catalogue harvest failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start harvesting in the background; call from the running event loop"""
+        if not CONFIG["service_catalogue"]["enabled"] or self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Stop the background harvest"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+harvester = ServiceCatalogueHarvester()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"🔄 Høster tjenester for datasett med utdaterte rader i {CATALOGUE_TABLE}...")
+    stored = asyncio.run(harvester.harvest_once())
+    if stored is None:
+        print("⏳ En annen prosess høster allerede katalogen")
+    else:
+        print(f"✅ Lagret {stored} datasett i {CATALOGUE_TABLE}")
@@ -0,0 +1,64 @@
+"""
+Helpers for turning the chat map view into a search area.
+
+Leaflet uses Web Mercator tiles of 256 pixels, so the geographic extent of a
+view follows from its center, zoom level and the size of the map in pixels.
+"""
+import math
+from typing import Optional, Tuple
+
+from config import CONFIG
+
+TILE_SIZE = 256
+# Web Mercator is undefined at the poles; Leaflet clamps to the same latitude
+MAX_LATITUDE = 85.0511287798
+
+BoundingBox = Tuple[float, float, float, float]
+
+
+def _project(lat: float, lon: float, zoom: float) -> Tuple[float, float]:
+    """Project lat/lon to global pixel coordinates at the given zoom level."""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lon + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def _unproject(x: float, y: float, zoom: float) -> Tuple[float, float]:
+    """Convert global pixel coordinates at the given zoom level back to lat/lon."""
+    scale = TILE_SIZE * 2 ** zoom
+    lon = x / scale * 360.0 - 180.0
+    n = math.pi - 2 * math.pi * y / scale
+    lat = math.degrees(math.atan(math.sinh(n)))
+    return lat, lon
+
+
+def map_view_bbox(
+    center: Tuple[float, float],
+    zoom: float,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+) -> BoundingBox:
+    """
+    Compute the area visible in a map view.
+
+    Args:
+        center: Map center as (lat, lon)
+        zoom: Leaflet zoom level
+        width: Map width in pixels, defaults to the configured viewport
+        height: Map height in pixels, defaults to the configured viewport
+
+    Returns:
+        Bounding box as (west, south, east, north) in degrees
+    """
+    search_config = CONFIG["search"]
+    width = width or search_config["viewport_width"]
+    height = height or search_config["viewport_height"]
+
+    lat, lon = center
+    x, y = _project(lat, lon, zoom)
+    north, west = _unproject(x - width / 2, y - height / 2, zoom)
+    south, east = _unproject(x + width / 2, y + height / 2, zoom)
+    return (max(west, -180.0), max(south, -90.0), min(east, 180.0), min(north, 90.0))
@@ -1,177 +1,291 @@
-import logging
-from typing import Dict, Optional
-import tiktoken
-from datetime import datetime, date
+import asyncio
+import atexit
 import json
+import logging
 import os
-from pathlib import Path
+import sqlite3
+import threading
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from config import CONFIG
+from helpers import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "embedding_tokens", "llm_calls", "embedding_calls")
+SUM_COLUMNS = ", ".join(f"COALESCE(SUM({field}), 0)" for field in USAGE_FIELDS)
+
+
+def _empty_usage() -> Dict[str, int]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def _usage_report(usage: Dict[str, int]) -> Dict:
+    """Usage counters in the shape returned by get_daily_usage/get_total_usage"""
+    return {
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+        "embedding_tokens": usage["embedding_tokens"],
+        "requests": {
+            "llm_calls": usage["llm_calls"],
+            "embedding_calls": usage["embedding_calls"],
+        },
+    }
+
+
 class TokenTracker:
-    def __init__(self, log_dir: str = "logs"):
+    """
+    Accumulates LLM and embedding token usage per day and model.
+
+    Logging a call only adds to counters in memory; nothing is tokenised and no
+    file is written on the request path. Token counts come from the usage fields
+    of the API responses. A background task (see ``start``) flushes the pending
+    counters to a SQLite table every ``flush_interval`` seconds, adding them to
+    the stored rows, and anything left is flushed at shutdown.
+    """
+
+    def __init__(self, log_dir: str = "logs", flush_interval: Optional[float] = None):
         """Initialize TokenTracker with configurable log directory
-        
+
         Args:
-            log_dir: Directory to store token usage logs (default: "logs")
+            log_dir: Directory holding the usage database (default: "logs")
+            flush_interval: Seconds between flushes; defaults to config
         """
         # Ensure absolute path
         self.log_dir = os.path.abspath(log_dir)
-        self.log_file = os.path.join(self.log_dir, "token_usage.log")
-        self.daily_usage: Dict[str, Dict[str, int]] = {}
-        
-        # Initialize tokenizers
-        try:
-            # Use encoding_for_model to get the correct encoding for text-embedding-3-large
-            self.embedding_encoder = tiktoken.encoding_for_model("text-embedding-3-large")
-            logger.info("Successfully initialized text-embedding-3-large tokenizer")
-        except Exception as e:
-            # Fallback to cl100k_base which is the correct base encoding for text-embedding-3-large
-            logger.warning(f"Could not load model-specific tokenizer: {str(e)}. Falling back to cl100k_base")
-            self.embedding_encoder = tiktoken.get_encoding("cl100k_base")
-        
-        # Ensure log directory exists
+        self.db_file = os.path.join(self.log_dir, "token_usage.sqlite3")
+        # Usage file written by earlier versions, imported once into the database
+        self.legacy_log_file = os.path.join(self.log_dir, "token_usage.log")
+        self.flush_interval = flush_interval or CONFIG["token_tracking"]["flush_interval"]
+
+        self._lock = threading.Lock()
+        # (day, model) -> counters not yet written to the database
+        self._pending: Dict[Tuple[str, str], Dict[str, int]] = {}
+        # All-time and today's counters, including pending ones, for cheap reads
+        self._totals = _empty_usage()
+        self._today_key = date.today().isoformat()
+        self._today = _empty_usage()
+        # Counters logged by this process only; _totals starts from the shared database, so
+        # summing it over workers would count the stored history once per worker
+        self._process = _empty_usage()
+        # All-time counters in the database as of the last flush, including other workers' flushes
+        self._stored = _empty_usage()
+        self._flush_task: Optional[asyncio.Task] = None
+
         os.makedirs(self.log_dir, exist_ok=True)
-        
-        # Initialize logging
-        self._setup_file_logging()
-        self.load_daily_usage()
-        logger.info(f"TokenTracker initialized. Logging to {self.log_file}")
-    
-    def _setup_file_logging(self):
-        """Setup file handler for logging"""
-        # Create a file handler
-        file_handler = logging.FileHandler(os.path.join(self.log_dir, "token_tracker.log"))
-        file_handler.setLevel(logging.INFO)
-        
-        # Create a formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        
-        # Add the handler to the logger
-        logger.addHandler(file_handler)
-        
-    def load_daily_usage(self):
-        """Load existing daily usage from log file if it exists"""
-        if os.path.exists(self.log_file):
-            try:
-                with open(self.log_file, 'r') as f:
-                    self.daily_usage = json.load(f)
-                logger.info(f"Loaded existing token usage data from {self.log_file}")
-            except json.JSONDecodeError:
-                logger.warning(f"Could not load token usage file {self.log_file}. Starting fresh.")
-                self.daily_usage = {}
-        else:
-            logger.info(f"No existing token usage file found at {self.log_file}. Starting fresh.")
-            self.daily_usage = {}
-
-    def save_daily_usage(self):
-        """Save daily usage to log file"""
+        self._init_db()
+        atexit.register(self.flush_sync)
+        logger.info(f"TokenTracker initialized. Storing usage in {self.db_file}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file, timeout=10)
+
+    def _init_db(self):
+        """Create the usage table, import the legacy JSON file and load the totals"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_usage (
+                    day TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    embedding_tokens INTEGER NOT NULL DEFAULT 0,
+                    llm_calls INTEGER NOT NULL DEFAULT 0,
+                    embedding_calls INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, model)
+                )
+            """)
+            if conn.execute("SELECT COUNT(*) FROM token_usage").fetchone()[0] == 0:
+                self._import_legacy_log(conn)
+            totals = conn.execute(f"SELECT {SUM_COLUMNS} FROM token_usage").fetchone()
+            today = conn.execute(
+                f"SELECT {SUM_COLUMNS} FROM token_usage WHERE day = ?",
+                (self._today_key,)
+            ).fetchone()
+        self._totals = dict(zip(USAGE_FIELDS, totals))
+        self._stored = dict(zip(USAGE_FIELDS, totals))
+        self._today = dict(zip(USAGE_FIELDS, today))
+
+    def _import_legacy_log(self, conn: sqlite3.Connection):
+        """Copy the per-day JSON file of earlier versions into the table"""
+        if not os.path.exists(self.legacy_log_file):
+            return
         try:
-            with open(self.log_file, 'w') as f:
-                json.dump(self.daily_usage, f, indent=2)
-            logger.debug(f"Token usage data saved to {self.log_file}")
-        except Exception as e:
-            logger.error(f"Error saving token usage data: {str(e)}")
+            with open(self.legacy_log_file, 'r') as f:
+                daily_usage = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not import legacy token usage file {self.legacy_log_file}: {e}")
+            return
+        for day, usage in daily_usage.items():
+            requests = usage.get("requests", {})
+            conn.execute(
+                "INSERT OR IGNORE INTO token_usage VALUES (?, 'unknown', ?, ?, ?, ?, ?)",
+                (day, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                 usage.get("embedding_tokens", 0), requests.get("llm_calls", 0), requests.get("embedding_calls", 0))
+            )
+        logger.info(f"Imported {len(daily_usage)} days of token usage from {self.legacy_log_file}")
 
-    def _get_today_key(self) -> str:
-        """Get today's date as string key"""
-        return date.today().isoformat()
-
-    def _ensure_today_exists(self):
-        """Ensure today's entry exists in daily usage"""
-        today = self._get_today_key()
-        if today not in self.daily_usage:
-            self.daily_usage[today] = {
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-                "embedding_tokens": 0,
-                "requests": {
-                    "llm_calls": 0,
-                    "embedding_calls": 0
-                }
-            }
+    def _add(self, model: str, **counts: int):
+        today = date.today().isoformat()
+        with self._lock:
+            if today != self._today_key:
+                self._today_key = today
+                self._today = _empty_usage()
+            pending = self._pending.setdefault((today, model), _empty_usage())
+            for field, value in counts.items():
+                pending[field] += value
+                self._totals[field] += value
+                self._today[field] += value
+                self._process[field] += value
 
     def log_llm_tokens(self, prompt_tokens: int, completion_tokens: int, model: str = "unknown"):
         """Log tokens used in an LLM call
-        
+
         Args:
-            prompt_tokens: Number of tokens in the prompt
-            completion_tokens: Number of tokens in the completion
+            prompt_tokens: Number of tokens in the prompt, from the response usage metadata
+            completion_tokens: Number of tokens in the completion, from the response usage metadata
             model: Name of the model used (default: "unknown")
         """
-        self._ensure_today_exists()
-        today = self._get_today_key()
-        
-        self.daily_usage[today]["prompt_tokens"] += prompt_tokens
-        self.daily_usage[today]["completion_tokens"] += completion_tokens
-        self.daily_usage[today]["total_tokens"] += (prompt_tokens + completion_tokens)
-        self.daily_usage[today]["requests"]["llm_calls"] += 1
-        
-        logger.info(
-            f"LLM Token usage - Model: {model}, "
-            f"Prompt: {prompt_tokens}, "
-            f"Completion: {completion_tokens}, "
-            f"Total: {prompt_tokens + completion_tokens}"
-        )
-        self.save_daily_usage()
-
-    def log_embedding_tokens(self, text: str, model: str = "unknown"):
+        self._add(model, prompt_tokens=prompt_tokens or 0, completion_tokens=completion_tokens or 0, llm_calls=1)
+        logger.debug(f"LLM Token usage - Model: {model}, Prompt: {prompt_tokens}, Completion: {completion_tokens}")
+
+    def log_embedding_tokens(self, tokens: int, model: str = "unknown"):
         """Log tokens used in an embedding call
-        
+
         Args:
-            text: Text being embedded
+            tokens: Number of input tokens, from the ``usage`` field of the embeddings response
             model: Name of the model used (default: "unknown")
         """
-        # Use the correct tokenizer for text-embedding-3-large (cl100k_base)
-        token_count = len(self.embedding_encoder.encode(text))
-        
-        self._ensure_today_exists()
-        today = self._get_today_key()
-        self.daily_usage[today]["embedding_tokens"] += token_count
-        self.daily_usage[today]["requests"]["embedding_calls"] += 1
-        
-        logger.info(f"Embedding Token usage - Model: {model}, Tokens: {token_count}")
-        self.save_daily_usage()
-
-    def get_daily_usage(self, day: Optional[str] = None) -> Dict[str, int]:
+        self._add(model, embedding_tokens=tokens or 0, embedding_calls=1)
+        logger.debug(f"Embedding Token usage - Model: {model}, Tokens: {tokens}")
+
+    def _take_pending(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore_pending(self, pending: Dict[Tuple[str, str], Dict[str, int]]):
+        with self._lock:
+            for key, counts in pending.items():
+                current = self._pending.setdefault(key, _empty_usage())
+                for field, value in counts.items():
+                    current[field] += value
+
+    def _write(self, pending: Dict[Tuple[str, str], Dict[str, int]]):
+        """Add pending counters to the stored rows in one transaction"""
+        with self._connect() as conn:
+            conn.executemany(
+                f"""
+                INSERT INTO token_usage (day, model, {', '.join(USAGE_FIELDS)})
+                VALUES (?, ?, {', '.join('?' for _ in USAGE_FIELDS)})
+                ON CONFLICT (day, model) DO UPDATE SET
+                    {', '.join(f'{field} = {field} + excluded.{field}' for field in USAGE_FIELDS)}
+                """,
+                [(day, model, *(counts[field] for field in USAGE_FIELDS)) for (day, model), counts in pending.items()]
+            )
+            stored = conn.execute(f"SELECT {SUM_COLUMNS} FROM token_usage").fetchone()
+        with self._lock:
+            self._stored = dict(zip(USAGE_FIELDS, stored))
+
+    def flush_sync(self):
+        """Write pending counters to the database from the calling thread"""
+        pending = self._take_pending()
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except Exception as e:
+            logger.error(f"Error saving token usage data: {str(e)}")
+            self._restore_pending(pending)
+
+    async def flush(self):
+        """Write pending counters to the database without blocking the event loop"""
+        pending = self._take_pending()
+        # Runs even with nothing pending, to pick up the stored totals other workers flushed
+        try:
+            await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            logger.error(f"Error saving token usage data: {str(e)}")
+            self._restore_pending(pending)
+
+    async def _flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+    def start(self):
+        """Start the periodic background flush; call from the running event loop"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background flush after writing what is pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+    def get_daily_usage(self, day: Optional[str] = None) -> Dict:
         """Get token usage for a specific day or today"""
-        if day is None:
-            day = self._get_today_key()
-        return self.daily_usage.get(day, {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-            "embedding_tokens": 0,
-            "requests": {
-                "llm_calls": 0,
-                "embedding_calls": 0
-            }
-        })
-
-    def get_total_usage(self) -> Dict[str, int]:
+        if day is None or day == self._today_key:
+            with self._lock:
+                return _usage_report(dict(self._today))
+        usage = _empty_usage()
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {SUM_COLUMNS} FROM token_usage WHERE day = ?",
+                (day,)
+            ).fetchone()
+        usage.update(zip(USAGE_FIELDS, row))
+        with self._lock:
+            for (pending_day, _), counts in self._pending.items():
+                if pending_day == day:
+                    for field, value in counts.items():
+                        usage[field] += value
+        return _usage_report(usage)
+
+    def get_total_usage(self) -> Dict:
         """Get total token usage across all days"""
-        total = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0,
-            "embedding_tokens": 0,
-            "requests": {
-                "llm_calls": 0,
-                "embedding_calls": 0
-            }
-        }
-        
-        for day_usage in self.daily_usage.values():
-            for key in ["prompt_tokens", "completion_tokens", "total_tokens", "embedding_tokens"]:
-                total[key] += day_usage.get(key, 0)
-            for req_type in ["llm_calls", "embedding_calls"]:
-                total["requests"][req_type] += day_usage.get("requests", {}).get(req_type, 0)
-        
-        return total
+        with self._lock:
+            return _usage_report(dict(self._totals))
+
+    def get_stored_usage(self) -> Dict:
+        """Get total token usage stored in the database as of the last flush"""
+        with self._lock:
+            return _usage_report(dict(self._stored))
+
+    def get_process_usage(self) -> Dict:
+        """Get token usage logged by this process since it started"""
+        with self._lock:
+            return _usage_report(dict(self._process))
 
 # Create a global instance with logs in the server directory
-token_tracker = TokenTracker(log_dir=os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")) 
\ No newline at end of file
+token_tracker = TokenTracker(log_dir=os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs"))
+
+
+def _tokens_by_type(usage: Dict) -> Dict[str, int]:
+    return {
+        "prompt": usage["prompt_tokens"],
+        "completion": usage["completion_tokens"],
+        "embedding": usage["embedding_tokens"],
+    }
+
+
+# Per-process increments, so summing the workers' counters counts every token once
+metrics.counter_callback("geogpt_tokens_total", "Tokens recorded by this worker by type",
+                         lambda: _tokens_by_type(token_tracker.get_process_usage()), ["type"])
+# All-time totals in the shared database, re-read on every flush. Unflushed tokens are left out,
+# so the workers agree up to one flush interval; aggregate with max() rather than sum()
+metrics.gauge_callback("geogpt_tokens_stored", "All-time tokens in the usage database by type, as of the last flush",
+                       lambda: _tokens_by_type(token_tracker.get_stored_usage()), ["type"])
@@ -0,0 +1,343 @@
+"""
+Per-request latency tracing for the chat pipeline.
+
+Spans follow the OpenTelemetry data model (trace and span IDs, parent links,
+attributes, status) and are exported as OTLP/JSON, so they can be loaded into
+any OpenTelemetry backend (Jaeger, Tempo, the collector's ``otlpjsonfile``
+receiver) without the OpenTelemetry SDK being installed.
+
+A chat turn or search is wrapped in ``start_trace``, which tags every span below
+it with the session and turn IDs. Code inside uses ``span`` or ``traced``; the
+current span is kept in a context variable, so nesting follows ``await``,
+``asyncio.create_task`` and ``asyncio.to_thread``. Upstream HTTP calls are traced
+by passing ``trace_configs()`` to ``aiohttp.ClientSession``.
+
+Spans are buffered per trace and exported when the root span ends, from a
+background thread, to ``CONFIG["tracing"]["exporter"]``:
+
+- ``file``: one OTLP/JSON ``ExportTraceServiceRequest`` per line in ``file``
+- ``otlp``: POST to ``{otlp_endpoint}/v1/traces`` (OTLP/HTTP with JSON encoding)
+- ``none``: tracing is off and ``span`` costs a context-variable lookup
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import aiohttp
+
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Traces whose root has not ended yet: trace_id -> finished spans
+_pending: Dict[str, List["Span"]] = {}
+_pending_lock = threading.Lock()
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-export")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def tracing_enabled() -> bool:
+    """Whether spans are recorded and exported."""
+    return CONFIG["tracing"]["exporter"] != "none"
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "is_root")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.is_root = parent is None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        # Session and turn IDs are inherited from the parent so every span can be filtered on them
+        self.attributes: Dict[str, Any] = {
+            key: value for key, value in (parent.attributes.items() if parent else ())
+            if key in ("session.id", "turn.id")
+        }
+        self.status = 0
+        self.status_message = ""
+        if attributes:
+            self.set_attributes(attributes)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, error: BaseException) -> None:
+        self.set_error(f"{type(error).__name__}: {error}")
+
+    @property
+    def duration(self) -> float:
+        """Duration in seconds (up to now if the span is still open)."""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def end(self) -> None:
+        """Finish the span; ending the root span exports the whole trace."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        with _pending_lock:
+            if self.is_root:
+                spans = _pending.pop(self.trace_id, [])
+                spans.append(self)
+            elif self.trace_id in _pending:
+                _pending[self.trace_id].append(self)
+                return
+            else:
+                # Background work that outlived its turn, e.g. a WMS retry
+                spans = [self]
+        _export_executor.submit(_export, spans)
+        if self.is_root:
+            logger.info(summarize(spans))
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status, **({"message": self.status_message} if self.status_message else {})},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is off."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def record_exception(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def current_span() -> Optional[Span]:
+    """The innermost open span in this context, if any."""
+    return _current_span.get()
+
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+    """
+    Start a child of the current span without making it current.
+
+    For operations that start and end in different callbacks (aiohttp tracing,
+    streamed LLM calls). Returns a no-op span outside a trace or with tracing off.
+    """
+    parent = _current_span.get()
+    if parent is None or not tracing_enabled():
+        return NOOP_SPAN
+    return Span(name, parent, kind, attributes)
+
+
+@contextmanager
+def _activate(span_obj) -> Iterator[Any]:
+    token = _current_span.set(span_obj) if isinstance(span_obj, Span) else None
+    try:
+        yield span_obj
+    except BaseException as error:
+        span_obj.record_exception(error)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        span_obj.end()
+
+
+@contextmanager
+def start_trace(name: str, session_id: Optional[str] = None, turn_id: Optional[Any] = None,
+                **attributes: Any) -> Iterator[Any]:
+    """
+    Open the root span of a new trace, e.g. one chat turn.
+
+    Args:
+        name: Span name, e.g. ``chat.turn``
+        session_id: Client session (the WebSocket ID), copied to every span in the trace
+        turn_id: Turn within the session, copied to every span in the trace
+        **attributes: Extra attributes for the root span
+    """
+    if not tracing_enabled():
+        yield NOOP_SPAN
+        return
+    root = Span(name, kind=SPAN_KIND_SERVER)
+    root.set_attributes({"session.id": session_id, "turn.id": turn_id, **attributes})
+    with _pending_lock:
+        _pending[root.trace_id] = []
+    with _activate(root) as active:
+        yield active
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Any]:
+    """
+    Time the enclosed block as a child of the current span.
+
+    Exceptions are recorded on the span and re-raised. Outside a trace the block
+    runs untraced.
+    """
+    with _activate(start_span(name, kind, **attributes)) as active:
+        yield active
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running a sync or async function inside ``span(name)``."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def _on_request_start(session, context, params) -> None:
+    context.span = start_span(
+        f"HTTP {params.method}",
+        kind=SPAN_KIND_CLIENT,
+        **{
+            "http.request.method": params.method,
+            "url.full": str(params.url),
+            "server.address": params.url.host,
+        },
+    )
+
+
+async def _on_request_end(session, context, params) -> None:
+    context.span.set_attribute("http.response.status_code", params.response.status)
+    if params.response.status >= 400:
+        context.span.set_error(f"HTTP {params.response.status}")
+    context.span.end()
+
+
+async def _on_request_exception(session, context, params) -> None:
+    context.span.record_exception(params.exception)
+    context.span.end()
+
+
+def trace_configs() -> List[aiohttp.TraceConfig]:
+    """``trace_configs`` for ``aiohttp.ClientSession`` giving each request a client span."""
+    if not tracing_enabled():
+        return []
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return [trace_config]
+
+
+def summarize(spans: List[Span]) -> str:
+    """One-line breakdown of a trace: total time and time per span name."""
+    root = next((s for s in spans if s.is_root), spans[0])
+    totals: Dict[str, float] = {}
+    for s in spans:
+        if s is not root:
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration
+    parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(totals.items(), key=lambda item: -item[1]))
+    return (f"Trace {root.trace_id} {root.name} session={root.attributes.get('session.id')} "
+            f"turn={root.attributes.get('turn.id')}: {root.duration:.2f}s ({parts})")
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """Wrap spans in an OTLP ``ExportTraceServiceRequest``."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", CONFIG["tracing"]["service_name"])]},
+            "scopeSpans": [{
+                "scope": {"name": "geogpt"},
+                "spans": [s.to_otlp() for s in spans],
+            }],
+        }]
+    }
+
+
+def _export(spans: List[Span]) -> None:
+    tracing_config = CONFIG["tracing"]
+    payload = json.dumps(to_otlp(spans), ensure_ascii=False)
+    try:
+        if tracing_config["exporter"] == "file":
+            path = tracing_config["file"]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(payload + "\n")
+        elif tracing_config["exporter"] == "otlp":
+            request = urllib.request.Request(
+                f"{tracing_config['otlp_endpoint'].rstrip('/')}/v1/traces",
+                data=payload.encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+    except Exception as e:
+        logger.warning(f"Could not export {len(spans)} spans: {e}")
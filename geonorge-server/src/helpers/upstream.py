@@ -0,0 +1,143 @@
+"""
+URLs of the upstream services we call: the Geonorge download API (nedlasting),
+kartkatalog and the WMS servers referenced by the catalogue.
+
+When ``CONFIG["upstream"]["mock_url"]`` is set, every upstream request is routed
+to the mock server in tests/mock_upstream.py instead. ``https://host/path?query``
+becomes ``{mock_url}/host/path?query``, so arbitrary WMS hosts are covered as
+well as the Geonorge APIs. Plain ``http://`` URLs get an ``/_http`` prefix, so
+the mock's record mode fetches them with the right scheme.
+
+Lookups that several code paths repeat for the same dataset (download areas,
+WMS capabilities) go through a ``SingleFlightCache``.
+"""
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import aiohttp
+
+from config import CONFIG
+from helpers import metrics, tracing
+
+
+def upstream_url(url: str) -> str:
+    """
+    Return the URL to request for an upstream resource.
+
+    Args:
+        url: Absolute URL of the real service
+
+    Returns:
+        The same URL, or its equivalent on the mock server when one is configured
+    """
+    mock_url = CONFIG["upstream"]["mock_url"]
+    if not mock_url or not url:
+        return url
+    parts = urlsplit(url)
+    mock = urlsplit(mock_url.rstrip("/"))
+    if not parts.netloc or parts.netloc == mock.netloc:
+        return url
+    scheme_prefix = "/_http" if parts.scheme == "http" else ""
+    return urlunsplit((mock.scheme, mock.netloc, f"{mock.path}{scheme_prefix}/{parts.netloc}{parts.path}",
+                       parts.query, ""))
+
+
+def nedlasting_url(path: str) -> str:
+    """URL of ``path`` on the Geonorge download API."""
+    return upstream_url(f"{CONFIG['upstream']['nedlasting_url'].rstrip('/')}{path}")
+
+
+def kartkatalog_url(path: str) -> str:
+    """URL of ``path`` on the kartkatalog API."""
+    return upstream_url(f"{CONFIG['upstream']['kartkatalog_url'].rstrip('/')}{path}")
+
+
+def client_trace_configs() -> List[aiohttp.TraceConfig]:
+    """``trace_configs`` for upstream ``aiohttp.ClientSession``s: latency metrics per host and tracing spans."""
+    return [metrics.trace_config(), *tracing.trace_configs()]
+
+
+class SingleFlightCache:
+    """
+    Short-lived cache of upstream lookups that also merges concurrent requests.
+
+    While a value is being fetched, other callers asking for the same key on
+    the same event loop await that fetch instead of sending their own request.
+    Values are kept for ``CONFIG["upstream"]["cache_ttl"]`` seconds, and
+    failures (as judged by ``is_failure``) only for ``cache_failure_ttl``, so
+    a timed-out service is retried soon. The Flask endpoints run their own
+    event loops in other threads, so the value store is guarded by a lock and
+    in-flight fetches are only shared within one loop.
+    """
+
+    def __init__(self, name: str, is_failure: Callable[[Any], bool] = lambda value: not value,
+                 max_entries: int = 1024):
+        self.name = name
+        self.is_failure = is_failure
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (expiry, value), least recently used first
+        self._values: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Task] = {}
+
+    def _cached(self, key: Any) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._values[key]
+                return False, None
+            self._values.move_to_end(key)
+            return True, entry[1]
+
+    def _store(self, key: Any, value: Any) -> None:
+        upstream_config = CONFIG["upstream"]
+        ttl = upstream_config["cache_failure_ttl"] if self.is_failure(value) else upstream_config["cache_ttl"]
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def _finished(self, inflight_key: Tuple[int, Any], key: Any, task: asyncio.Task) -> None:
+        self._inflight.pop(inflight_key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
+
+    async def get(self, key: Any, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the value for ``key``, calling ``fetch`` only if it is neither cached nor being fetched.
+
+        Args:
+            key: Cache key, e.g. the dataset UUID
+            fetch: Coroutine function fetching the value from the upstream service
+
+        Returns:
+            The cached or freshly fetched value
+        """
+        found, value = self._cached(key)
+        if found:
+            metrics.record_cache(self.name, True)
+            return value
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        task: Optional[asyncio.Task] = self._inflight.get(inflight_key)
+        # Joining a fetch in progress counts as a hit: no request is sent
+        metrics.record_cache(self.name, task is not None and task.get_loop() is loop)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fetch())
+            self._inflight[inflight_key] = task
+            task.add_done_callback(functools.partial(self._finished, inflight_key, key))
+        # Shielded, so a cancelled caller does not cancel the fetch other callers are waiting for
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        """Forget every cached value."""
+        with self._lock:
+            self._values.clear()
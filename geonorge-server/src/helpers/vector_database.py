@@ -1,4 +1,5 @@
 import asyncio
+import re
 import sys
 from pathlib import Path
 from functools import partial
@@ -10,89 +11,344 @@ from helpers.fetch_openai_embeddings_api import fetch_openai_embeddings
 sys.path.append(str(Path(__file__).parent.parent))
 
 from helpers.connection import get_connection, return_connection
+from helpers.tracing import span
+from config import CONFIG
 
+# Table searched by every query; benchmarks point this at synthetic tables
+TABLE_NAME = CONFIG["search"]["table"]
 
-def _vector_search(vector_array):
-    """Synchronous search for vectors in the database returning 20 results."""
-    conn = get_connection()
-    try:
+# Columns returned by the two search flavours; callers zip these with field names
+CATALOG_COLUMNS = "uuid, title, getcapabilitiesurl"
+RAG_COLUMNS = "uuid, title, abstract, image, metadatacreationdate"
+
+# Optional columns are checked once; older databases may not have them yet
+_available_columns = {}
+
+
+def _has_column(conn, column):
+    """Check once whether the search table has ``column``."""
+    key = (TABLE_NAME, column)
+    if key not in _available_columns:
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT 
-                    uuid, 
-                    title, 
-                    getcapabilitiesurl, 
-                    combined_text_vector <-> %s::vector AS distance 
-                FROM text_embedding_3_large 
-                ORDER BY combined_text_vector <-> %s::vector LIMIT 20
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = %s AND column_name = %s
                 """,
-                (vector_array, vector_array)
+                (TABLE_NAME, column)
             )
-            rows = cur.fetchall()
-        return rows
-    finally:
-        return_connection(conn)
+            _available_columns[key] = cur.fetchone() is not None
+        if not _available_columns[key]:
+            print(f"DEBUG: {TABLE_NAME} has no {column} column, related search features disabled")
+    return _available_columns[key]
 
 
-def _rag_vector_search(vector_array):
-    """Synchronous search function used for RAG returning 10 results."""
-    conn = get_connection()
-    try:
+def _spatial_filter(conn, view_bbox):
+    """
+    Build the condition restricting a search to datasets that overlap ``view_bbox``.
+
+    Datasets without a parsed extent are always kept. The ``&&`` test is served by
+    the GiST index on bbox, so the vector distance is only computed for the rows
+    that pass the filter.
+    """
+    if view_bbox is None or not _has_column(conn, "bbox"):
+        return "", ()
+    west, south, east, north = view_bbox
+    return (
+        "(bbox IS NULL OR bbox && box(point(%s, %s), point(%s, %s)))",
+        (west, south, east, north),
+    )
+
+
+def build_lexical_query(text):
+    """
+    Turn free text into an OR'ed tsquery string.
+
+    Questions are full sentences, so requiring every word (plainto_tsquery)
+    would rarely match; any shared term counts and ts_rank_cd orders the hits.
+    Only word characters are kept, so the result is always a valid tsquery.
+    """
+    terms = []
+    for term in re.findall(r"\w+", text.lower()):
+        if len(term) > 1 and term not in terms:
+            terms.append(term)
+    return " | ".join(terms)
+
+
+# Table -> whether combined_text_compact has the configured number of dimensions
+_compact_dimensions_ok = {}
+
+
+def _compact_dimensions_match(conn):
+    """
+    Check once that combined_text_compact is a halfvec of ``compact_dimensions``.
+
+    A table built with another COMPACT_VECTOR_DIMENSIONS would make every
+    two-stage query fail; it is searched exactly instead.
+    """
+    if TABLE_NAME not in _compact_dimensions_ok:
+        expected = CONFIG["search"]["compact_dimensions"]
         with conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT 
-                    uuid, 
-                    title, 
-                    abstract, 
-                    image, 
-                    metadatacreationdate,
-                    combined_text_vector <-> %s::vector AS distance 
-                FROM text_embedding_3_large 
-                ORDER BY combined_text_vector <-> %s::vector LIMIT 10
+                SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attname = 'combined_text_compact' AND NOT attisdropped
                 """,
-                (vector_array, vector_array)
+                (TABLE_NAME,)
             )
-            rows = cur.fetchall()
-        return rows
-    finally:
-        return_connection(conn)
+            row = cur.fetchone()
+        column_type = row[0] if row else None
+        _compact_dimensions_ok[TABLE_NAME] = column_type == f"halfvec({expected})"
+        if not _compact_dimensions_ok[TABLE_NAME]:
+            print(f"ERROR: {TABLE_NAME}.combined_text_compact is {column_type}, but COMPACT_VECTOR_DIMENSIONS "
+                  f"is {expected}; two-stage search disabled")
+    return _compact_dimensions_ok[TABLE_NAME]
 
 
-async def vector_search(vector_array):
+def _use_compact_vectors(conn, two_stage):
+    if two_stage is None:
+        two_stage = CONFIG["search"]["compact_vectors"]
+    return two_stage and _has_column(conn, "combined_text_compact") and _compact_dimensions_match(conn)
+
+
+def _run_vector_query(columns, vector_array, view_bbox, limit, two_stage=None, candidates=None):
     """
-    Asynchronously search for vectors in the database by offloading
-    the synchronous query to a separate thread.
+    Rank datasets by embedding distance, optionally within a map view.
+
+    When the table has the compact ``combined_text_compact`` column (the first
+    N dimensions of the embedding, re-normalised and stored as halfvec with an
+    HNSW index), the search runs in two stages: a coarse scan over the compact
+    vectors picks ``candidates`` rows, which are then rescored with the full
+    3072-dimensional vectors. Otherwise every row is compared exactly.
+
+    Args:
+        columns: Columns to select
+        vector_array: Query embedding
+        view_bbox: Optional (west, south, east, north) map view
+        limit: Number of rows to return
+        two_stage: Force the compact two-stage search on or off; defaults to config
+        candidates: Rows kept from the coarse stage; defaults to config
     """
-    return await asyncio.to_thread(_vector_search, vector_array)
+    with span("pgvector.vector_query", **{"db.system": "postgresql", "db.sql.table": TABLE_NAME,
+                                          "search.limit": limit, "search.view_bbox": view_bbox is not None}) as query_span:
+        conn = get_connection()
+        try:
+            condition, condition_params = _spatial_filter(conn, view_bbox)
+            where_clause = f"WHERE {condition}" if condition else ""
+            compact = _use_compact_vectors(conn, two_stage)
+            query_span.set_attribute("search.two_stage", compact)
+            if compact:
+                search_config = CONFIG["search"]
+                candidates = max(limit, candidates or search_config["rescore_candidates"])
+                query_span.set_attribute("search.candidates", candidates)
+                with conn.cursor() as cur:
+                    # HNSW returns at most ef_search rows, so it must cover the candidate count.
+                    # LOCAL: the pooled connection goes back to the default when the transaction ends
+                    cur.execute("SET LOCAL hnsw.ef_search = %s", (max(40, candidates),))
+                    cur.execute(
+                        f"""
+                        WITH candidates AS (
+                            SELECT {columns}, combined_text_vector
+                            FROM {TABLE_NAME}
+                            {where_clause}
+                            ORDER BY combined_text_compact <-> l2_normalize(subvector(%s::vector, 1, %s))::halfvec
+                            LIMIT %s
+                        )
+                        SELECT {columns}, combined_text_vector <-> %s::vector AS distance
+                        FROM candidates
+                        ORDER BY distance LIMIT %s
+                        """,
+                        (*condition_params, vector_array, search_config["compact_dimensions"],
+                         candidates, vector_array, limit)
+                    )
+                    rows = cur.fetchall()
+                query_span.set_attribute("db.rows", len(rows))
+                return rows
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT 
+                        {columns}, 
+                        combined_text_vector <-> %s::vector AS distance 
+                    FROM {TABLE_NAME} 
+                    {where_clause}
+                    ORDER BY combined_text_vector <-> %s::vector LIMIT %s
+                    """,
+                    (vector_array, *condition_params, vector_array, limit)
+                )
+                rows = cur.fetchall()
+            query_span.set_attribute("db.rows", len(rows))
+            return rows
+        finally:
+            return_connection(conn)
+
+
+def _run_lexical_query(columns, query_text, vector_array, view_bbox, limit):
+    """
+    Rank datasets by full-text match on title, keywords and abstract.
+
+    Uses the GIN-indexed ``search_tsv`` column (Norwegian configuration, title
+    weighted highest), which catches acronyms such as FKB, N50 or DTM10 that
+    embed poorly. The vector distance is selected too, so rows have the same
+    shape as the vector branch.
+    """
+    tsquery = build_lexical_query(query_text)
+    if not tsquery:
+        return []
+
+    with span("pgvector.lexical_query", **{"db.system": "postgresql", "db.sql.table": TABLE_NAME,
+                                           "search.limit": limit}) as query_span:
+        conn = get_connection()
+        try:
+            if not _has_column(conn, "search_tsv"):
+                return []
+            condition, condition_params = _spatial_filter(conn, view_bbox)
+            extra_condition = f"AND {condition}" if condition else ""
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT 
+                        {columns}, 
+                        combined_text_vector <-> %s::vector AS distance 
+                    FROM {TABLE_NAME}, to_tsquery('norwegian', %s) AS query
+                    WHERE search_tsv @@ query {extra_condition}
+                    ORDER BY ts_rank_cd(search_tsv, query) DESC LIMIT %s
+                    """,
+                    (vector_array, tsquery, *condition_params, limit)
+                )
+                rows = cur.fetchall()
+            query_span.set_attribute("db.rows", len(rows))
+            return rows
+        finally:
+            return_connection(conn)
 
 
-async def rag_vector_search(vector_array):
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
     """
-    Asynchronously search for vectors used for RAG by offloading
-    the synchronous query to a separate thread.
+    Fuse several ranked result lists with reciprocal rank fusion.
+
+    Each row scores ``sum(1 / (k + rank))`` over the lists it appears in, so
+    rows found by both branches rise to the top while rows found by only one
+    branch are still kept. Rows are identified by (uuid, title), which keeps
+    separate chunks of the same dataset apart.
+
+    Args:
+        rankings: Lists of result rows, best first
+        k: Damping constant; larger values flatten the contribution of top ranks
+        limit: Maximum number of rows to return
+
+    Returns:
+        Fused rows, best first
+    """
+    scores = {}
+    rows = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            key = (row[0], row[1])
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            rows.setdefault(key, row)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    if limit is not None:
+        fused = fused[:limit]
+    return [rows[key] for key in fused]
+
+
+async def _hybrid_search(columns, query_text, vector_array, view_bbox, limit):
+    """
+    Run the vector and lexical branches concurrently and fuse them with RRF.
+
+    Falls back to plain vector ranking when hybrid search is disabled or there
+    is no query text.
+    """
+    search_config = CONFIG["search"]
+    if not search_config["hybrid"] or not query_text:
+        return await asyncio.to_thread(_run_vector_query, columns, vector_array, view_bbox, limit)
+
+    vector_rows, lexical_rows = await asyncio.gather(
+        asyncio.to_thread(
+            _run_vector_query, columns, vector_array, view_bbox,
+            max(limit, search_config["vector_candidates"])
+        ),
+        asyncio.to_thread(
+            _run_lexical_query, columns, query_text, vector_array, view_bbox,
+            search_config["lexical_candidates"]
+        ),
+    )
+    return reciprocal_rank_fusion(
+        [vector_rows, lexical_rows], k=search_config["rrf_k"], limit=limit
+    )
+
+
+async def _search(columns, query_text, vector_array, view_bbox, limit):
+    """
+    Search restricted to the map view, falling back to the whole catalogue
+    when the view leaves too few datasets.
+    """
+    search_config = CONFIG["search"]
+    if view_bbox is None or not search_config["spatial_filter"]:
+        return await _hybrid_search(columns, query_text, vector_array, None, limit)
+
+    rows = await _hybrid_search(columns, query_text, vector_array, view_bbox, limit)
+    if len(rows) < search_config["spatial_min_results"]:
+        print(f"DEBUG: Map view {view_bbox} matched {len(rows)} datasets, searching without spatial filter")
+        rows = await _hybrid_search(columns, query_text, vector_array, None, limit)
+    return rows
+
+
+def _vector_search(vector_array, view_bbox=None):
+    """Synchronous search for vectors in the database returning 20 results."""
+    return _run_vector_query(CATALOG_COLUMNS, vector_array, view_bbox, 20)
+
+
+def _rag_vector_search(vector_array, view_bbox=None):
+    """Synchronous search function used for RAG returning 10 results."""
+    return _run_vector_query(RAG_COLUMNS, vector_array, view_bbox, 10)
+
+
+async def vector_search(vector_array, view_bbox=None, query_text=None):
+    """
+    Asynchronously search the catalogue (20 results), offloading the
+    synchronous queries to separate threads.
+
+    Args:
+        vector_array: Query embedding
+        view_bbox: Optional (west, south, east, north) map view to restrict the search to
+        query_text: Original query; enables the lexical branch of hybrid search
+    """
+    return await _search(CATALOG_COLUMNS, query_text, vector_array, view_bbox, 20)
+
+
+async def rag_vector_search(vector_array, view_bbox=None, query_text=None):
+    """
+    Asynchronously search for datasets used for RAG (10 results), offloading
+    the synchronous queries to separate threads.
+
+    Args:
+        vector_array: Query embedding
+        view_bbox: Optional (west, south, east, north) map view to restrict the search to
+        query_text: Original query; enables the lexical branch of hybrid search
     """
-    return await asyncio.to_thread(_rag_vector_search, vector_array)
+    return await _search(RAG_COLUMNS, query_text, vector_array, view_bbox, 10)
 
 
-async def get_vdb_response(user_question):
+async def get_vdb_response(user_question, view_bbox=None):
     """
     Get the vector database response for a user question. This is used in RAG
     and limits results to 10 datasets.
     """
     json_input = await fetch_openai_embeddings(user_question)
     vectorized_input = json_input['data'][0]['embedding']
-    vdb_response = await rag_vector_search(vectorized_input)
+    vdb_response = await rag_vector_search(vectorized_input, view_bbox, query_text=user_question)
     return vdb_response
 
 
-async def get_vdb_search_response(query):
+async def get_vdb_search_response(query, view_bbox=None):
     """
     Get the vector database response for a search query. This is used to build
     the 'kartkatalogen' (catalog) with 20 elements.
     """
     json_input = await fetch_openai_embeddings(query)
     vectorized_input = json_input['data'][0]['embedding']
-    vdb_response = await vector_search(vectorized_input)
+    vdb_response = await vector_search(vectorized_input, view_bbox, query_text=query)
     return vdb_response
@@ -1,6 +1,8 @@
 import json
 from typing import Any, Dict
 
+from helpers.response_cache import record_sent
+
 
 async def send_websocket_message(action, payload, websocket) -> None:
     """Send a WebSocket message with the specified action and payload"""
@@ -11,6 +13,7 @@ async def send_websocket_message(action, payload, websocket) -> None:
     if websocket is None:
         print(f"Warning: Attempted to send message with action '{action}' to None websocket")
         return
+    record_sent(action, payload, websocket)
     
     try:
         message_str = json.dumps(message)
@@ -28,6 +31,7 @@ async def send_websocket_action(action, websocket):
     if websocket is None:
         print(f"Warning: Attempted to send action '{action}' to None websocket")
         return
+    record_sent(action, None, websocket)
         
     try:
         message = {'action': action}
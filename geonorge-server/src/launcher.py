@@ -0,0 +1,251 @@
+"""
+Run several server worker processes on the same ports.
+
+Each worker is a separate ``server.py`` process with its own event loop,
+database pool and in-memory caches; nothing is shared between them except
+Postgres. All workers bind the WebSocket and HTTP ports with SO_REUSEPORT and
+the kernel spreads new connections over them. A conversation lives on the
+WebSocket connection, so every message of a session reaches the worker that
+holds its history without any routing.
+
+Workers are started as fresh interpreters rather than forked from the
+launcher, so the thread pools and clients created at import time are never
+copied into a child. A worker reports ready through a pipe once its warm-up
+(``helpers/prewarm.py``) is done.
+
+Signals:
+
+- SIGHUP: rolling restart. For one slot at a time a new worker is started and,
+  once it is ready, the old one gets SIGTERM. The old worker stops accepting
+  connections, lets its running chat turns finish (at most ``drain_timeout``
+  seconds) and closes the remaining connections with 1012 so clients reconnect
+  to another worker. A new worker that does not become ready aborts the restart
+  and the old workers keep serving.
+- SIGTERM / SIGINT: drain and stop all workers.
+
+A worker that exits on its own is restarted, with a growing delay if it keeps
+crashing::
+
+    SERVER_WORKERS=4 python src/launcher.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from config import CONFIG
+
+logger = logging.getLogger("launcher")
+
+SERVER_SCRIPT = Path(__file__).resolve().parent / "server.py"
+# Seconds a worker may take to exit after its drain before it is killed
+STOP_GRACE_SECONDS = 10
+# Restart delays of a crashing worker double up to this many seconds
+MAX_RESTART_DELAY_SECONDS = 60
+
+
+class Launcher:
+    """Starts, restarts and stops the worker processes."""
+
+    def __init__(self, workers: int):
+        server_config = CONFIG["server"]
+        self.worker_count = workers
+        self.ready_timeout = server_config["ready_timeout"]
+        self.stop_timeout = server_config["drain_timeout"] + STOP_GRACE_SECONDS
+        self.metrics_port_base = server_config["metrics_port_base"]
+        # slot -> the worker currently serving it
+        self.workers: Dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = False
+        self._restart_task: Optional[asyncio.Task] = None
+        self._retiring: Set[asyncio.Task] = set()
+        # Workers started but not yet ready
+        self._starting: Set[asyncio.subprocess.Process] = set()
+        # Held while a worker is started for a slot and put into it, so the supervisor
+        # and a rolling restart never both fill the same slot
+        self._slot_locks: Dict[int, asyncio.Lock] = {slot: asyncio.Lock() for slot in range(workers)}
+
+    async def _wait_ready(self, read_fd: int) -> bool:
+        """
+        Wait for the worker to write to its readiness pipe; an empty read means it exited.
+
+        The pipe is watched by the event loop, so once this returns nothing reads
+        ``read_fd`` any more and the caller can close it.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def on_readable() -> None:
+            if not ready.done():
+                ready.set_result(bool(os.read(read_fd, 64)))
+
+        loop.add_reader(read_fd, on_readable)
+        try:
+            return await asyncio.wait_for(ready, self.ready_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(read_fd)
+
+    async def start_worker(self, slot: int) -> Optional[asyncio.subprocess.Process]:
+        """
+        Start a worker for ``slot`` and wait until it has warmed up.
+
+        Returns:
+            The ready worker, or None if it exited or did not become ready within ``ready_timeout``
+        """
+        read_fd, write_fd = os.pipe()
+        env = {
+            **os.environ,
+            "SERVER_REUSE_PORT": "true",
+            "GEOGPT_WORKER_ID": str(slot),
+            "GEOGPT_READY_FD": str(write_fd),
+        }
+        if self.metrics_port_base:
+            env["SERVER_METRICS_PORT"] = str(self.metrics_port_base + slot)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, str(SERVER_SCRIPT), env=env, pass_fds=(write_fd,)
+            )
+        finally:
+            os.close(write_fd)
+        logger.info(f"Worker {slot} started with pid {process.pid}")
+        self._starting.add(process)
+        try:
+            ready = await self._wait_ready(read_fd)
+            if ready:
+                logger.info(f"Worker {slot} (pid {process.pid}) is ready")
+                return process
+            logger.error(f"Worker {slot} (pid {process.pid}) did not become ready")
+            await self.stop_worker(process)
+            return None
+        finally:
+            self._starting.discard(process)
+            os.close(read_fd)
+
+    async def stop_worker(self, process: asyncio.subprocess.Process) -> None:
+        """Ask a worker to drain and exit; kill it if it has not exited after the drain timeout."""
+        if process.returncode is not None:
+            return
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker pid {process.pid} did not stop in {self.stop_timeout}s, killing it")
+            process.kill()
+            await process.wait()
+        logger.info(f"Worker pid {process.pid} exited with {process.returncode}")
+
+    def _retire(self, process: asyncio.subprocess.Process) -> None:
+        """Drain a replaced worker in the background."""
+        task = asyncio.create_task(self.stop_worker(process))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _supervise(self, slot: int) -> None:
+        """Restart the worker of ``slot`` when it exits on its own."""
+        failures = 0
+        while not self._stopping:
+            process = self.workers.get(slot)
+            if process is None:
+                await asyncio.sleep(min(2 ** failures, MAX_RESTART_DELAY_SECONDS))
+            else:
+                started = time.monotonic()
+                await process.wait()
+                if self._stopping or self.workers.get(slot) is not process:
+                    # Replaced by a rolling restart; watch the new worker
+                    continue
+                logger.error(f"Worker {slot} (pid {process.pid}) exited with {process.returncode}")
+                failures = 0 if time.monotonic() - started > MAX_RESTART_DELAY_SECONDS else failures + 1
+                del self.workers[slot]
+                await asyncio.sleep(min(2 ** failures, MAX_RESTART_DELAY_SECONDS))
+            async with self._slot_locks[slot]:
+                if self._stopping or slot in self.workers:
+                    # Filled by a rolling restart in the meantime
+                    continue
+                replacement = await self.start_worker(slot)
+                if replacement is None:
+                    failures += 1
+                elif self._stopping:
+                    await self.stop_worker(replacement)
+                else:
+                    self.workers[slot] = replacement
+
+    async def rolling_restart(self) -> None:
+        """Replace the workers one slot at a time, each only once its successor is ready."""
+        logger.info(f"Rolling restart of {len(self.workers)} workers")
+        for slot in range(self.worker_count):
+            if self._stopping:
+                return
+            async with self._slot_locks[slot]:
+                if slot not in self.workers:
+                    # Being restarted by its supervisor
+                    continue
+                replacement = await self.start_worker(slot)
+                if replacement is None:
+                    logger.error(f"Rolling restart aborted at worker {slot}; the remaining workers keep running")
+                    return
+                if self._stopping:
+                    await self.stop_worker(replacement)
+                    return
+                # The old worker may have exited during the start; its supervisor then waits for this lock
+                previous = self.workers.get(slot)
+                self.workers[slot] = replacement
+                if previous is not None:
+                    self._retire(previous)
+        logger.info("Rolling restart done")
+
+    def request_restart(self) -> None:
+        if self._restart_task is not None and not self._restart_task.done():
+            logger.info("Rolling restart already in progress")
+            return
+        self._restart_task = asyncio.create_task(self.rolling_restart())
+
+    async def run(self) -> None:
+        """Start the workers and supervise them until SIGTERM or SIGINT."""
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        loop.add_signal_handler(signal.SIGHUP, self.request_restart)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
+
+        started = await asyncio.gather(*(self.start_worker(slot) for slot in range(self.worker_count)))
+        for slot, process in enumerate(started):
+            if process is not None:
+                self.workers[slot] = process
+        logger.info(f"{len(self.workers)}/{self.worker_count} workers ready")
+        supervisors = [asyncio.create_task(self._supervise(slot)) for slot in range(self.worker_count)]
+
+        await stopping.wait()
+        logger.info("Stopping all workers")
+        self._stopping = True
+        if self._restart_task is not None:
+            self._restart_task.cancel()
+        for task in supervisors:
+            task.cancel()
+        processes = [*self.workers.values(), *self._starting]
+        await asyncio.gather(*(self.stop_worker(process) for process in processes),
+                             *self._retiring, return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run several GeoGPT server workers on the same ports")
+    parser.add_argument("--workers", type=int, default=CONFIG["server"]["workers"],
+                        help="Number of worker processes (default: SERVER_WORKERS)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("several workers need SO_REUSEPORT, which this platform does not support")
+    asyncio.run(Launcher(args.workers).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,37 @@
 """
 LLM module for managing language model instances and related functionality.
-"""
 
-from .llmManager import LLMManager
-from langsmith import traceable
+Exports are imported on first access, so importing ``chain_registry`` (e.g. for
+its stats) does not load the OpenAI and LangSmith clients.
+"""
 import contextlib
+import importlib
 import os
 
-# Initialize LLM manager singleton
-llm_manager = LLMManager()
+_EXPORTS = {
+    'LLMManager': '.llmManager',
+    'ChainRegistry': '.chain_registry',
+    'chain_registry': '.chain_registry',
+}
+
+# Shortcuts on the LLMManager singleton
+_MANAGER_EXPORTS = {
+    'llm_manager': lambda manager: manager,
+    'get_main_llm': lambda manager: manager.get_main_llm,
+    'get_rewrite_llm': lambda manager: manager.get_rewrite_llm,
+}
+
+
+def __getattr__(name):
+    if name in _MANAGER_EXPORTS:
+        value = _MANAGER_EXPORTS[name](__getattr__('LLMManager')())
+    elif name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
-# Export functions to get LLM instances
-get_main_llm = llm_manager.get_main_llm
-get_rewrite_llm = llm_manager.get_rewrite_llm
 
 # Helper for LangSmith tracing
 @contextlib.contextmanager
@@ -57,4 +76,4 @@ def langsmith_tracing(name, tags=None, metadata=None):
     else:
         yield None
 
-__all__ = ["LLMManager", "llm_manager", "get_main_llm", "get_rewrite_llm", "langsmith_tracing"] 
\ No newline at end of file
+__all__ = ["LLMManager", "llm_manager", "get_main_llm", "get_rewrite_llm", "langsmith_tracing", "ChainRegistry", "chain_registry"] 
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Registry of prebuilt LLM chains with per-chain latency and token counters.
+
+Prompt templates and ``prompt | llm`` runnables are built once, when a chain is
+registered, instead of on every node invocation. Every call made through the
+registry is timed and its token usage (from the model's ``usage_metadata``) is
+recorded under the chain name, and each call is a ``llm.<chain>`` tracing span.
+The chain name is also passed to the model callbacks as ``llm_chain`` metadata,
+so the Prometheus metrics and TokenTracker (see ``usage_callback``) see it too.
+"""
+import time
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional
+
+from helpers.tracing import span, start_span
+
+if TYPE_CHECKING:
+    # Imported lazily: the registry is imported by the server for its stats only
+    from langchain_core.runnables import Runnable
+
+
+@dataclass
+class ChainStats:
+    """Counters for a single registered chain."""
+    calls: int = 0
+    errors: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        stats = asdict(self)
+        stats["avg_latency"] = self.total_latency / self.calls if self.calls else 0.0
+        stats["total_tokens"] = self.prompt_tokens + self.completion_tokens
+        return stats
+
+
+def _usage_attributes(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Token usage as OpenTelemetry GenAI span attributes."""
+    if not usage:
+        return {}
+    return {
+        "gen_ai.usage.input_tokens": usage.get("input_tokens"),
+        "gen_ai.usage.output_tokens": usage.get("output_tokens"),
+    }
+
+
+def _message_text(message: Any) -> str:
+    """Return the text content of a model response (StrOutputParser semantics)."""
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return str(content)
+
+
+class ChainRegistry:
+    """
+    Holds named runnables that are built once and reused.
+
+    Chains are registered with a prompt and an optional LLM (the main LLM by
+    default). ``register`` is idempotent, so modules can register their chains
+    lazily at first use as well as eagerly at startup.
+    """
+
+    def __init__(self):
+        self._chains: Dict[str, "Runnable"] = {}
+        self._stats: Dict[str, ChainStats] = {}
+
+    def register(self, name: str, prompt: Optional["Runnable"] = None, llm: Optional["Runnable"] = None) -> "Runnable":
+        """
+        Build and store the runnable for ``name`` unless it already exists.
+
+        Args:
+            name: Chain name used for lookups and counters
+            prompt: Prompt template to pipe into the LLM; ``None`` registers the LLM itself
+                (e.g. a model with tools bound)
+            llm: LLM or runnable to use, defaults to the main LLM
+
+        Returns:
+            The registered runnable
+        """
+        if name not in self._chains:
+            if llm is None:
+                from .llmManager import LLMManager
+                llm = LLMManager().get_main_llm()
+            self._chains[name] = prompt | llm if prompt is not None else llm
+            self._stats[name] = ChainStats()
+        return self._chains[name]
+
+    def get(self, name: str) -> "Runnable":
+        """Get a registered runnable by name."""
+        try:
+            return self._chains[name]
+        except KeyError:
+            raise KeyError(f"Chain '{name}' is not registered") from None
+
+    def _record(self, name: str, started: float, usage: Optional[Dict[str, Any]], failed: bool) -> None:
+        stats = self._stats.setdefault(name, ChainStats())
+        latency = time.perf_counter() - started
+        stats.calls += 1
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+        if failed:
+            stats.errors += 1
+        if usage:
+            stats.prompt_tokens += usage.get("input_tokens", 0) or 0
+            stats.completion_tokens += usage.get("output_tokens", 0) or 0
+
+    @staticmethod
+    def _config(name: str, config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Caller's runnable config with the chain name added to its metadata."""
+        config = dict(config or {})
+        config["metadata"] = {**config.get("metadata", {}), "llm_chain": name}
+        return config
+
+    async def ainvoke_message(self, name: str, inputs: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """Invoke a chain and return the raw model message."""
+        chain = self.get(name)
+        config = self._config(name, config)
+        started = time.perf_counter()
+        with span(f"llm.{name}", **{"llm.chain": name}) as llm_span:
+            try:
+                message = await chain.ainvoke(inputs, config, **kwargs)
+            except Exception:
+                self._record(name, started, None, failed=True)
+                raise
+            usage = getattr(message, "usage_metadata", None)
+            llm_span.set_attributes(_usage_attributes(usage))
+        self._record(name, started, usage, failed=False)
+        return message
+
+    async def ainvoke(self, name: str, inputs: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+        """Invoke a chain and return the response text."""
+        return _message_text(await self.ainvoke_message(name, inputs, config, **kwargs))
+
+    async def astream(self, name: str, inputs: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Stream a chain, yielding the model's message chunks.
+
+        Latency is measured until the stream is exhausted, or until the caller
+        stops reading it (closed or cancelled, e.g. when the client disconnects);
+        token usage is taken from the chunk carrying ``usage_metadata`` (usually
+        the last one). The span records the time to the first chunk as well.
+        """
+        chain = self.get(name)
+        config = self._config(name, config)
+        started = time.perf_counter()
+        usage = None
+        first_chunk = True
+        failed = False
+        completed = False
+        # Not made current: the generator is suspended while the caller handles each chunk
+        llm_span = start_span(f"llm.{name}", **{"llm.chain": name, "llm.streaming": True})
+        try:
+            async for chunk in chain.astream(inputs, config, **kwargs):
+                if first_chunk:
+                    llm_span.set_attribute("llm.time_to_first_chunk_ms", round((time.perf_counter() - started) * 1000, 1))
+                    first_chunk = False
+                chunk_usage = getattr(chunk, "usage_metadata", None)
+                if chunk_usage:
+                    usage = chunk_usage
+                yield chunk
+            completed = True
+        except Exception as error:
+            failed = True
+            llm_span.record_exception(error)
+            raise
+        finally:
+            # Also runs on aclose() and cancellation, which skip the code after the loop
+            if not completed and not failed:
+                llm_span.set_attribute("llm.stream_abandoned", True)
+            llm_span.set_attributes(_usage_attributes(usage))
+            llm_span.end()
+            self._record(name, started, usage, failed=failed)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get a snapshot of the counters for every registered chain."""
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+chain_registry = ChainRegistry()
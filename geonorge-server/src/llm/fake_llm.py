@@ -0,0 +1,178 @@
+"""
+Deterministic stand-in for the chat model, used with LLM_PROVIDER=fake.
+
+Load tests and CI need the whole chat pipeline (supervisor, RAG and map
+workflows, streaming over the WebSocket) without calling Gemini. The fake model
+answers each registered chain with a reply its parser accepts, recognised from
+the prompt text, and streams plain answers word by word with a configurable
+time to first token and delay per token, so latency measurements exercise the
+same code paths as production.
+"""
+import asyncio
+import json
+import re
+import time
+import uuid
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+MAP_QUERY_PATTERN = re.compile(r"\b(flytt|zoom|panorer|marker|markør|kartlag|min posisjon|ta meg til)\w*", re.IGNORECASE)
+KNOWN_PLACES = {
+    "oslo": [59.9139, 10.7522],
+    "bergen": [60.3913, 5.3221],
+    "trondheim": [63.4305, 10.3951],
+    "stavanger": [58.9700, 5.7331],
+    "tromsø": [69.6492, 18.9553],
+}
+
+ANSWER_TEMPLATE = (
+    "Her er en oversikt over datasett som kan være relevante for spørsmålet ditt om {topic}. "
+    "Kartverket og Geonorge tilbyr flere datasett innen dette temaet, blant annet FKB, N50 Kartdata "
+    "og tematiske datasett fra fagetatene. Du kan se datasettene i kartet og laste dem ned i formater "
+    "som FGDB, GML og SOSI. Si gjerne fra hvis du vil vite mer om et bestemt datasett."
+)
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+def _last_human_text(messages: Sequence[BaseMessage]) -> str:
+    return next((_text(m) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+
+def _place_in(text: str) -> str:
+    lowered = text.lower()
+    return next((place.capitalize() for place in KNOWN_PLACES if place in lowered), "Oslo")
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that returns canned, parser-compatible replies without network access."""
+
+    first_token_ms: float = 300.0
+    token_ms: float = 20.0
+    tools: List[Dict[str, Any]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeChatModel":
+        """Return a copy that calls the first bound tool once per question."""
+        return self.model_copy(update={"tools": [convert_to_openai_tool(tool) for tool in tools]})
+
+    def _tool_call(self, messages: Sequence[BaseMessage]) -> Optional[Dict[str, Any]]:
+        if not self.tools or any(isinstance(m, ToolMessage) for m in messages):
+            return None
+        function = self.tools[0]["function"]
+        argument = next(iter(function.get("parameters", {}).get("properties", {})), "query")
+        return {
+            "name": function["name"],
+            "args": {argument: _last_human_text(messages)},
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+        }
+
+    def _reply(self, messages: Sequence[BaseMessage]) -> str:
+        """Pick a reply the calling chain can parse, based on its prompt."""
+        prompt = " ".join(_text(m) for m in messages).lower()
+        question = _last_human_text(messages)
+        if "'yes' eller 'no'" in prompt:
+            return "yes"
+        if '"map", "rag", eller "mixed"' in prompt:
+            return "map" if MAP_QUERY_PATTERN.search(question) else "rag"
+        # EVALUATION_PROMPT in rag/utils/document_grading.py; the prompt is lowercased above
+        if "vurder hvert datasett" in prompt:
+            ids = sorted({int(i) for i in re.findall(r"\bid: (\d+)", prompt)})
+            return json.dumps([{"id": i, "is_relevant": True, "relevance_score": 80} for i in ids])
+        if "karthandlinger" in prompt:
+            return json.dumps([{"tool": "PanMap", "params": {"location": _place_in(question)}}])
+        if "[breddegrad, lengdegrad]" in prompt:
+            return json.dumps(KNOWN_PLACES[_place_in(question).lower()])
+        if "single sentence" in prompt or "omformuler" in prompt:
+            return question
+        return ANSWER_TEMPLATE.format(topic=question.strip().rstrip("?") or "geografiske data")
+
+    def _message(self, messages: Sequence[BaseMessage]) -> AIMessage:
+        tool_call = self._tool_call(messages)
+        content = "" if tool_call else self._reply(messages)
+        input_tokens = sum(len(_text(m).split()) for m in messages)
+        return AIMessage(
+            content=content,
+            tool_calls=[tool_call] if tool_call else [],
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": len(content.split()),
+                "total_tokens": input_tokens + len(content.split()),
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.first_token_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.first_token_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+                usage_metadata=message.usage_metadata,
+            )
+            return
+        words = message.content.split(" ")
+        for index, word in enumerate(words):
+            last = index == len(words) - 1
+            yield AIMessageChunk(
+                content=word if last else f"{word} ",
+                usage_metadata=message.usage_metadata if last else None,
+            )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_ms / 1000)
+        for index, chunk in enumerate(self._chunks(self._message(messages))):
+            if index:
+                time.sleep(self.token_ms / 1000)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for index, chunk in enumerate(self._chunks(self._message(messages))):
+            if index:
+                await asyncio.sleep(self.token_ms / 1000)
+            yield ChatGenerationChunk(message=chunk)
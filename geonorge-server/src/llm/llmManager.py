@@ -1,14 +1,13 @@
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 from config import CONFIG
 
-from typing import Any, Dict, Optional
-from langchain.callbacks.base import BaseCallbackHandler
-import tiktoken
 import logging
 from langsmith import Client
 from langsmith.wrappers import wrap_openai
 import os
 
+from .usage_callback import usage_callback
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -29,6 +28,8 @@ class LLMManager:
     """
     Manager class for handling different LLM instances.
     Uses a singleton pattern to ensure only one instance of each LLM type exists.
+    Every instance carries the usage callback, which records tokens and latency
+    per LangGraph node for all chains built on it.
     """
     _instance = None
     _llm = None
@@ -41,18 +42,37 @@ class LLMManager:
             cls._instance = super(LLMManager, cls).__new__(cls)
         return cls._instance
 
+    @staticmethod
+    def _use_fake_llm() -> bool:
+        return CONFIG["llm"]["provider"] == "fake"
+
+    @staticmethod
+    def _create_fake_llm():
+        from .fake_llm import FakeChatModel
+        return FakeChatModel(
+            first_token_ms=CONFIG["llm"]["fake_first_token_ms"],
+            token_ms=CONFIG["llm"]["fake_token_ms"],
+            callbacks=[usage_callback],
+        )
+
     def get_main_llm(self) -> ChatOpenAI:
         """
         Returns the main LLM instance with streaming enabled
         """
+        if self._llm is None and self._use_fake_llm():
+            logger.info("Using fake LLM (LLM_PROVIDER=fake)")
+            self._llm = self._create_fake_llm()
         if self._llm is None:
             self._llm = ChatOpenAI(
                 model_name=self.MODEL_NAME,
                 openai_api_key=CONFIG["api"]["gemini_api_key"],
                 openai_api_base=CONFIG["api"]["gemini_base_endpoint"],
                 streaming=True,
+                # Report token usage on the final streamed chunk so per-chain counters work
+                stream_usage=True,
                 temperature=0.3,
                 tags=["main_llm", "streaming"],
+                callbacks=[usage_callback],
             )
         return self._llm
 
@@ -60,6 +80,8 @@ class LLMManager:
         """
         Returns the rewrite LLM instance with streaming disabled and zero temperature
         """
+        if self._rewrite_llm is None and self._use_fake_llm():
+            self._rewrite_llm = self._create_fake_llm()
         if self._rewrite_llm is None:
             self._rewrite_llm = ChatOpenAI(
                 model_name=self.MODEL_NAME,
@@ -68,5 +90,6 @@ class LLMManager:
                 streaming=False,
                 temperature=0,
                 tags=["rewrite_llm", "non_streaming"],
+                callbacks=[usage_callback],
             )
         return self._rewrite_llm 
\ No newline at end of file
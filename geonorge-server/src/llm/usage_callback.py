@@ -0,0 +1,97 @@
+"""
+Callback handler recording token usage and latency of every LLM call.
+
+It is attached to the models built by ``LLMManager``, so every chain and node
+using them is covered without changes at the call sites. Each call is
+attributed to the LangGraph node that made it. Nodes of nested workflows are
+named by their path, e.g. ``run_rag/agent`` or ``run_map/agent``, using the
+``langgraph_checkpoint_ns`` metadata that LangGraph puts on every run. Each
+call is also attributed to the ``chain_registry`` chain, which covers calls
+made outside a node such as the ``assess_relevance`` edge.
+
+Usage comes from the model's ``usage_metadata`` (or ``token_usage`` in
+``llm_output``). It is fed into the TokenTracker and into the
+``geogpt_llm_call_seconds`` and ``geogpt_llm_tokens_total`` metrics. Every
+call, and whether it failed because the endpoint is overloaded, also adapts
+the chat turn limit of the admission controller (``helpers/admission.py``).
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from helpers import metrics
+from helpers.admission import admission, is_overloaded, is_rate_limited
+from helpers.token_tracker import token_tracker
+
+NO_NODE = "none"
+
+
+def node_name(metadata: Optional[Dict[str, Any]]) -> str:
+    """Path of the LangGraph node running an LLM call, e.g. ``run_rag/agent``."""
+    metadata = metadata or {}
+    namespace = metadata.get("langgraph_checkpoint_ns")
+    if namespace:
+        return "/".join(part.split(":", 1)[0] for part in namespace.split("|") if part)
+    return metadata.get("langgraph_node") or NO_NODE
+
+
+def _usage(response: LLMResult) -> Tuple[int, int]:
+    """Prompt and completion tokens of a finished call."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0) or 0, usage.get("output_tokens", 0) or 0
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0) or 0, token_usage.get("completion_tokens", 0) or 0
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Records tokens and latency per node for every chat model call."""
+
+    # Only updates counters, so it runs inline instead of in an executor
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (start time, node, chain, model)
+        self._runs: Dict[UUID, Tuple[float, str, str, str]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        self._runs[run_id] = (
+            time.perf_counter(),
+            node_name(metadata),
+            metadata.get("llm_chain", ""),
+            metadata.get("ls_model_name") or "unknown",
+        )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        started, node, chain, model = run
+        prompt_tokens, completion_tokens = _usage(response)
+        seconds = time.perf_counter() - started
+        metrics.LLM_CALL_SECONDS.observe(seconds, node=node, chain=chain, outcome="ok")
+        admission.record_llm_call()
+        metrics.LLM_TOKENS.inc(prompt_tokens, node=node, chain=chain, type="prompt")
+        metrics.LLM_TOKENS.inc(completion_tokens, node=node, chain=chain, type="completion")
+        token_tracker.log_llm_tokens(prompt_tokens, completion_tokens, model)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        started, node, chain, _ = run
+        seconds = time.perf_counter() - started
+        rate_limited = is_rate_limited(error)
+        metrics.LLM_CALL_SECONDS.observe(seconds, node=node, chain=chain,
+                                         outcome="rate_limited" if rate_limited else "error")
+        admission.record_llm_call(overloaded=is_overloaded(error))
+
+
+usage_callback = UsageCallbackHandler()
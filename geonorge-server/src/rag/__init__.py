@@ -1,18 +1,30 @@
 """
 Retrieval Augmented Generation (RAG) module for GeoNorge.
+
+Exports are imported on first access, so importing a submodule such as
+``rag.utils.common`` does not build the workflows and LLM clients.
 """
+import importlib
+
+_EXPORTS = {
+    'EnhancedGeoNorgeRAGChain': '.chain',
+    'get_rag_response': '.response_handlers',
+    'record_cached_exchange': '.response_handlers',
+    'get_rag_context': '.response_handlers',
+    'get_supervisor': '.response_handlers',
+    'get_supervisor_async': '.response_handlers',
+    'GeoNorgeSupervisor': '.supervisor',
+    'GeoNorgeRAGWorkflow': '.rag_workflow',
+    'LeafletMapWorkflow': '.map_workflow',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
 
-from .chain import EnhancedGeoNorgeRAGChain
-from .response_handlers import get_rag_response, get_rag_context
-from .supervisor import GeoNorgeSupervisor
-from .rag_workflow import GeoNorgeRAGWorkflow
-from .map_workflow import LeafletMapWorkflow
 
-__all__ = [
-    'EnhancedGeoNorgeRAGChain',
-    'get_rag_response',
-    'get_rag_context',
-    'GeoNorgeSupervisor',
-    'GeoNorgeRAGWorkflow',
-    'LeafletMapWorkflow'
-] 
\ No newline at end of file
+__all__ = list(_EXPORTS)
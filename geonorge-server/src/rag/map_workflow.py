@@ -7,22 +7,101 @@ from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, END, StateGraph
 from langgraph.types import Command
 
-from llm import LLMManager
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
+from llm import LLMManager, chain_registry
+from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from langchain.tools import StructuredTool
 from langchain.schema.messages import ToolMessage
 from helpers.websocket import send_websocket_message
+from helpers.gazetteer import geocode
 from langchain_core.messages import BaseMessage
 from .utils.common import register_websockets_dict, format_history, get_websocket, active_websockets
 from .utils.tool_utils import ToolExecutor, ToolInvocation 
+from .utils.map_state import persistent_map_states, get_map_view_bbox
+import asyncio
 import json
+import re
 
 # Initialize LLM
 llm_manager = LLMManager()
 llm = llm_manager.get_main_llm()
 
+PAN_TO_LOCATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Ekstraher stedsinformasjon fra brukerens spørsmål.
+    For kjente norske byer, returner koordinater i følgende format: [breddegrad, lengdegrad]
+    
+    Eksempler:
+    - Oslo: [59.9139, 10.7522]
+    - Bergen: [60.3913, 5.3221]
+    - Trondheim: [63.4305, 10.3951]
+    - Stavanger: [58.9700, 5.7331]
+    - Tromsø: [69.6492, 18.9553]
+    
+    For mindre kjente steder eller steder utenfor Norge, gjør ditt beste for å gi omtrentlige koordinater.
+    Returner resultatet som et array med to tall: [breddegrad, lengdegrad]
+    """),
+    ("human", "{location}")
+])
+
+MAP_TOOL_CALLING_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Du er en kartassistent som hjelper brukere med å navigere kart.
+    
+    Basert på brukerens forespørsel, bestem hvilke karthandlinger som skal utføres og returner dem i JSON-format.
+    
+    Tilgjengelige verktøy:
+    1. "PanMap" - Flytter kartet til en spesifisert lokasjon
+       Format: {{"tool": "PanMap", "params": {{"location": "stedsnavnet"}}}}
+       
+    2. "ZoomMap" - Setter zoom-nivået på kartet (1-18)
+       Format: {{"tool": "ZoomMap", "params": {{"level": zoom_level}}}}
+       VIKTIG: "level" må være et heltall mellom 1 og 18, IKKE en streng som "increase" eller "decrease".
+       
+    3. "ToggleLayers" - Viser eller skjuler kartlag
+       Format: {{"tool": "ToggleLayers", "params": {{"layers": ["lag1", "lag2"], "action": "show/hide/clear"}}}}
+       
+    4. "AddMarkers" - Legger til markører på kartet
+       Format: {{"tool": "AddMarkers", "params": {{"locations": ["sted1", "sted2"], "clear": true/false}}}}
+       
+    5. "FindMyLocation" - Finner brukerens nåværende posisjon og sentrerer kartet på den
+       Format: {{"tool": "FindMyLocation", "params": {{"zoom_level": 14, "add_marker": true/false}}}}
+       Du kan også bruke add_marker parameteren for å legge til en markør på brukerens posisjon.
+    
+    Analyser brukerens forespørsel og returner en JSON-array med verktøykall som skal utføres.
+    Eksempel: [{{"tool": "PanMap", "params": {{"location": "Oslo"}}}}, {{"tool": "ZoomMap", "params": {{"level": 14}}}}]
+    
+    Du kan kjenne igjen disse handlingene:
+    - Panorering: Når brukeren vil se et spesifikt sted (f.eks. "vis meg Oslo", "ta meg til Bergen")
+    - Zooming: Når brukeren vil zoome inn eller ut (f.eks. "zoom til nivå 16", "zoom inn")
+    - Kartlag: Når brukeren vil endre kartlag (f.eks. "vis satelittbilde", "skjul administrative grenser")
+    - Markører: Når brukeren vil markere steder (f.eks. "marker Oslo og Bergen", "fjern alle markører")
+    - Min posisjon: 
+      * Når brukeren vil finne sin egen posisjon (f.eks. "finn min posisjon", "vis hvor jeg er")
+      * Når brukeren vil legge til en markør på sin posisjon (f.eks. "sett markør på min lokasjon", "marker hvor jeg er")
+    """),
+    ("human", "{query}")
+])
+
+MAP_RESPONSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Du er en kartassistent. Generer et svar som forklarer hvilke endringer som ble gjort med kartet.
+    
+    Handlinger utført: {actions}
+    Kartsentrum: {map_center}
+    Lokasjon: {location}
+    Zoom-nivå: {zoom_level}
+    Synlige lag: {visible_layers}
+    Markører: {markers}
+    
+    Hold svaret kort og konsist, men naturlig og hjelpsomt. Unngå tekniske detaljer med mindre brukeren spør spesifikt om det.
+    Det er VELDIG viktig at du nevner den korrekte lokasjonen som kartet nå er sentrert på.
+    """),
+    ("human", "{query}")
+])
+
+# Build the map chains once at import instead of on every tool call
+chain_registry.register("pan_to_location", PAN_TO_LOCATION_PROMPT, llm)
+chain_registry.register("map_call_model", MAP_TOOL_CALLING_PROMPT, llm)
+chain_registry.register("map_generate_response", MAP_RESPONSE_PROMPT, llm)
+
 # Define a state class for map interactions
 class MapState(TypedDict, total=False):
     """
@@ -39,8 +118,7 @@ class MapState(TypedDict, total=False):
     add_marker_at_location: bool
     in_merged_workflow: bool
 
-# Added global persistent state storage
-persistent_map_states = {}
+# Persistent state storage lives in utils.map_state so the server can read it cheaply
 
 # Create wrapper function that handles state conversion, merging with persistent state.
 def with_map_state_handling(node_func):
@@ -167,48 +245,16 @@ class MyLocationInput(BaseModel):
 # Define tool implementations
 async def pan_to_location(location: str) -> Tuple[float, float]:
     """Pan the map to a specified location."""
-    # Common Norwegian cities with coordinates
-    city_coordinates = {
-        "oslo": (59.9139, 10.7522),
-        "bergen": (60.3913, 5.3221),
-        "trondheim": (63.4305, 10.3951),
-        "stavanger": (58.9700, 5.7331),
-        "tromsø": (69.6492, 18.9553),
-        "kristiansand": (58.1599, 8.0182),
-        "drammen": (59.7440, 10.2045),
-        "fredrikstad": (59.2181, 10.9298),
-        "sandnes": (58.8534, 5.7317),
-        "bodø": (67.2804, 14.4051)
-    }
-    
-    # Check if the location is a known city (case insensitive)
-    normalized_location = location.lower().strip()
-    if normalized_location in city_coordinates:
-        coords = city_coordinates[normalized_location]
-        print(f"Using hardcoded coordinates for {location}: {coords}")
-        return coords
-    
-    # If not a known city, use LLM to extract location information
+    # Resolve the name against the local place-name index first; off the event loop,
+    # since the first lookup loads the place-name file if the warm-up has not
+    place = await asyncio.to_thread(geocode, location)
+    if place:
+        print(f"Using gazetteer coordinates for {location}: {place.name} {place.coordinates}")
+        return place.coordinates
+    
+    # If the place is not in the gazetteer, use LLM to extract location information
     print(f"Querying LLM for coordinates of: {location}")
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """Ekstraher stedsinformasjon fra brukerens spørsmål.
-        For kjente norske byer, returner koordinater i følgende format: [breddegrad, lengdegrad]
-        
-        Eksempler:
-        - Oslo: [59.9139, 10.7522]
-        - Bergen: [60.3913, 5.3221]
-        - Trondheim: [63.4305, 10.3951]
-        - Stavanger: [58.9700, 5.7331]
-        - Tromsø: [69.6492, 18.9553]
-        
-        For mindre kjente steder eller steder utenfor Norge, gjør ditt beste for å gi omtrentlige koordinater.
-        Returner resultatet som et array med to tall: [breddegrad, lengdegrad]
-        """),
-        ("human", "{location}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
-    location_result = await chain.ainvoke({"location": location})
+    location_result = await chain_registry.ainvoke("pan_to_location", {"location": location})
     
     print(f"LLM response for {location}: {location_result}")
     
@@ -216,7 +262,6 @@ async def pan_to_location(location: str) -> Tuple[float, float]:
         # Parse the coordinates
         coords_str = location_result.strip()
         # Extract numbers from the string
-        import re
         coords = re.findall(r'[-+]?\d*\.\d+|\d+', coords_str)
         if len(coords) >= 2:
             # Convert to float
@@ -226,11 +271,6 @@ async def pan_to_location(location: str) -> Tuple[float, float]:
             return (lat, lng)
         else:
             print(f"Could not extract coordinates from: {coords_str}")
-            # Check if the response contains any city name we know
-            for city, coords in city_coordinates.items():
-                if city in coords_str.lower():
-                    print(f"Found city name {city} in response, using its coordinates")
-                    return coords
             
             # Default to Oslo if we can't extract or match anything
             print(f"Defaulting to Oslo coordinates")
@@ -313,18 +353,22 @@ async def add_markers(locations: List[str], clear: bool = False) -> List[Dict]:
         print("Clearing all markers")
         return []
     
+    # Resolve all locations concurrently; only names missing from the gazetteer hit the LLM
+    results = await asyncio.gather(
+        *(pan_to_location(location) for location in locations),
+        return_exceptions=True
+    )
+    
     markers = []
-    for location in locations:
-        try:
-            # Get coordinates for the location
-            coords = await pan_to_location(location)
-            markers.append({
-                "lat": coords[0],
-                "lng": coords[1],
-                "label": location
-            })
-        except Exception as e:
-            print(f"Error creating marker for {location}: {e}")
+    for location, coords in zip(locations, results):
+        if isinstance(coords, Exception):
+            print(f"Error creating marker for {location}: {coords}")
+            continue
+        markers.append({
+            "lat": coords[0],
+            "lng": coords[1],
+            "label": location
+        })
     
     print(f"Added markers: {markers}")
     return markers
@@ -435,52 +479,8 @@ async def call_model(state: Dict) -> Dict:
         print("No user query found")
         return state
     
-    # Create system prompt for tool calling
-    system_prompt = """Du er en kartassistent som hjelper brukere med å navigere kart.
-    
-    Basert på brukerens forespørsel, bestem hvilke karthandlinger som skal utføres og returner dem i JSON-format.
-    
-    Tilgjengelige verktøy:
-    1. "PanMap" - Flytter kartet til en spesifisert lokasjon
-       Format: {{"tool": "PanMap", "params": {{"location": "stedsnavnet"}}}}
-       
-    2. "ZoomMap" - Setter zoom-nivået på kartet (1-18)
-       Format: {{"tool": "ZoomMap", "params": {{"level": zoom_level}}}}
-       VIKTIG: "level" må være et heltall mellom 1 og 18, IKKE en streng som "increase" eller "decrease".
-       
-    3. "ToggleLayers" - Viser eller skjuler kartlag
-       Format: {{"tool": "ToggleLayers", "params": {{"layers": ["lag1", "lag2"], "action": "show/hide/clear"}}}}
-       
-    4. "AddMarkers" - Legger til markører på kartet
-       Format: {{"tool": "AddMarkers", "params": {{"locations": ["sted1", "sted2"], "clear": true/false}}}}
-       
-    5. "FindMyLocation" - Finner brukerens nåværende posisjon og sentrerer kartet på den
-       Format: {{"tool": "FindMyLocation", "params": {{"zoom_level": 14, "add_marker": true/false}}}}
-       Du kan også bruke add_marker parameteren for å legge til en markør på brukerens posisjon.
-    
-    Analyser brukerens forespørsel og returner en JSON-array med verktøykall som skal utføres.
-    Eksempel: [{{"tool": "PanMap", "params": {{"location": "Oslo"}}}}, {{"tool": "ZoomMap", "params": {{"level": 14}}}}]
-    
-    Du kan kjenne igjen disse handlingene:
-    - Panorering: Når brukeren vil se et spesifikt sted (f.eks. "vis meg Oslo", "ta meg til Bergen")
-    - Zooming: Når brukeren vil zoome inn eller ut (f.eks. "zoom til nivå 16", "zoom inn")
-    - Kartlag: Når brukeren vil endre kartlag (f.eks. "vis satelittbilde", "skjul administrative grenser")
-    - Markører: Når brukeren vil markere steder (f.eks. "marker Oslo og Bergen", "fjern alle markører")
-    - Min posisjon: 
-      * Når brukeren vil finne sin egen posisjon (f.eks. "finn min posisjon", "vis hvor jeg er")
-      * Når brukeren vil legge til en markør på sin posisjon (f.eks. "sett markør på min lokasjon", "marker hvor jeg er")
-    """
-    
-    # Create tool calling prompt
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "{query}")
-    ])
-    
     # Use the LLM to generate tool calls
-    model = llm_manager.get_main_llm()
-    chain = prompt | model | StrOutputParser()
-    json_response = await chain.ainvoke({"query": latest_user_query})
+    json_response = await chain_registry.ainvoke("map_call_model", {"query": latest_user_query})
     print(f"Raw LLM JSON response: {json_response}")
     
     try:
@@ -513,7 +513,6 @@ async def call_model(state: Dict) -> Dict:
             # Third attempt: Look for individual JSON objects if array parsing failed
             if not tool_calls_json:
                 # Find all JSON objects in the text
-                import re
                 object_matches = re.finditer(r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}', cleaned_response, re.DOTALL)
                 for match in object_matches:
                     try:
@@ -707,26 +706,8 @@ async def generate_response(state: Dict) -> Dict:
                             break
                 break
     
-    # Create a response prompt template
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """Du er en kartassistent. Generer et svar som forklarer hvilke endringer som ble gjort med kartet.
-        
-        Handlinger utført: {actions}
-        Kartsentrum: {map_center}
-        Lokasjon: {location}
-        Zoom-nivå: {zoom_level}
-        Synlige lag: {visible_layers}
-        Markører: {markers}
-        
-        Hold svaret kort og konsist, men naturlig og hjelpsomt. Unngå tekniske detaljer med mindre brukeren spør spesifikt om det.
-        Det er VELDIG viktig at du nevner den korrekte lokasjonen som kartet nå er sentrert på.
-        """),
-        ("human", "{query}")
-    ])
-    
     # Generate the response
-    chain = prompt | llm | StrOutputParser()
-    response = await chain.ainvoke({
+    response = await chain_registry.ainvoke("map_generate_response", {
         "query": latest_query,
         "actions": ", ".join(actions) if actions else "info",
         "map_center": state.get("map_center", (59.9139, 10.7522)),
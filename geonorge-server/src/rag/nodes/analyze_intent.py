@@ -6,6 +6,7 @@ from ..models import ConversationState
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from llm import LLMManager
+from ..utils.history import history_manager
 import json
 import re
 
@@ -74,7 +75,7 @@ async def analyze_intent(state: Dict) -> Dict:
     chain = prompt | llm | StrOutputParser()
     intent = await chain.ainvoke({
         "message": last_message,
-        "chat_history": current_state.chat_history
+        "chat_history": history_manager.format(current_state.websocket_id or "", current_state.messages)
     })
     
     print(f"Raw intent response: {intent}")
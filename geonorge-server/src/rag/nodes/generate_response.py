@@ -6,7 +6,8 @@ from ..models import ConversationState
 from langchain.prompts import ChatPromptTemplate
 from helpers.websocket import send_websocket_message
 from llm import LLMManager
-from ..utils.common import active_websockets, format_history
+from ..utils.common import active_websockets
+from ..utils.history import history_manager
 from ..utils.templates import RESPONSE_TEMPLATES, NO_RESULTS_TEMPLATE
 
 
@@ -99,6 +100,6 @@ async def generate_response(state: Dict) -> Dict:
     # Update the conversation state with the full response
     full_response = "".join(response_chunks)
     current_state.messages.append({"role": "assistant", "content": full_response})
-    current_state.chat_history = format_history(current_state.messages)
+    current_state.chat_history = history_manager.format(current_state.websocket_id or "", current_state.messages)
 
     return current_state.to_dict() 
\ No newline at end of file
@@ -4,7 +4,8 @@ Invalid query handler node for the RAG workflow.
 from typing import Dict
 from helpers.websocket import send_websocket_message
 from ..models import ConversationState
-from ..utils.common import active_websockets, format_history
+from ..utils.common import active_websockets
+from ..utils.history import history_manager
 
 
 async def handle_invalid_query(state: Dict) -> Dict:
@@ -33,5 +34,5 @@ async def handle_invalid_query(state: Dict) -> Dict:
     await send_websocket_message("chatStream", {"payload": response, "isNewMessage": True}, websocket)
     
     current_state.messages.append({"role": "assistant", "content": response})
-    current_state.chat_history = format_history(current_state.messages)
+    current_state.chat_history = history_manager.format(current_state.websocket_id or "", current_state.messages)
     return current_state.to_dict() 
\ No newline at end of file
@@ -8,9 +8,12 @@ from langgraph.graph import START, END, StateGraph
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langgraph.graph.message import add_messages
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from pydantic import BaseModel, Field
 
+from llm import LLMManager, chain_registry
+
+from helpers.tracing import span, traced
 from helpers.websocket import send_websocket_action
 from .models.state import ConversationState
 from retrieval import GeoNorgeVectorRetriever
@@ -19,6 +22,71 @@ from .utils.common import register_websockets_dict
 from .models import ConversationState
 from .utils.image_processor import insert_image_rag_response
 
+# Prompts used by the workflow nodes. They are built once at import and the
+# chains using them are registered in GeoNorgeRAGWorkflow.__init__.
+REWRITE_QUERY_PROMPT = ChatPromptTemplate.from_messages([
+    ("human", """ \n 
+    Look at the input and try to reason about the underlying semantic intent / meaning. \n 
+    Here is the initial question:
+    \n ------- \n
+    {question} 
+    \n ------- \n
+    Formulate the question to ONLY be a SINGLE sentence for better geographical data retrieval: """)
+])
+
+ASSESS_RELEVANCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Du er en vurderer som skal avgjøre om informasjonen er relevant for brukerens spørsmål.
+    
+    Vurder BARE om informasjonen er relevant, ikke om den er fullstendig.
+    Gi 'yes' hvis informasjonen er relevant for spørsmålet, ellers 'no'.
+    Vær konservativ og si 'yes' selv om bare deler av informasjonen er relevant."""),
+    ("human", """
+    Her er informasjonen som ble hentet:
+    {context}
+    
+    Her er brukerens spørsmål:
+    {question}
+    
+    Er denne informasjonen relevant for spørsmålet? Svar kun med 'yes' eller 'no'.
+    """)
+])
+
+# The search_dataset tool already formats the response, just summarize it
+DATASET_SEARCH_RESPONSE_PROMPT = PromptTemplate(
+    template="""Du er en EKSPERT for geografiske datasett i Norge. 
+    Brukeren søkte etter datasett, og her er søkeresultatene:
+    
+    {context}
+    
+    Bruk informasjonen fra søkeresultatene til å svare på spørsmålet og foreslå datasett til brukeren: {question}
+    
+    Inkluder tittel, kort beskrivelse og lenke til hvert datasett i svaret. 
+    Du MÅ legge til formatering med bold (**) for titler.
+
+    
+    Svar:""",
+    input_variables=["question", "context"],
+)
+
+# Standard RAG prompt for general geographical information
+RAG_RESPONSE_PROMPT = PromptTemplate(
+    template="""Du er en assistent som svarer på spørsmål om geografiske data i Norge.
+    
+    Bruk informasjonen fra den forhåndsinnhentede konteksten for å svare på spørsmålet.
+    Hvis du ikke finner svaret i konteksten, si at du ikke har nok informasjon og foreslå alternative måter brukeren kan spørre.
+    Hold svaret konsist og fokusert på norske geografiske data.
+    Du MÅ legge til formatering med bold (**) for titler.
+    
+    Spørsmål: {question} 
+    
+    Kontekst:
+    {context}
+    
+    Svar:""",
+    input_variables=["question", "context"],
+)
+
+
 def tools_condition(state: Dict) -> str:
     """
     Determines if the agent wants to use a tool or if it has a final response.
@@ -182,6 +250,14 @@ class GeoNorgeRAGWorkflow:
         # Verify tools were created successfully
         print(f"Created tools successfully: {self.retrieval_tool.name}, {self.dataset_info_tool.name}")
         
+        # Build the LLM chains once; tools are bound a single time per workflow
+        llm = LLMManager().get_main_llm()
+        chain_registry.register("rag_agent", llm=llm.bind_tools([self.retrieval_tool, self.dataset_info_tool]))
+        chain_registry.register("rewrite_query", REWRITE_QUERY_PROMPT, llm)
+        chain_registry.register("assess_relevance", ASSESS_RELEVANCE_PROMPT, llm)
+        chain_registry.register("dataset_search_response", DATASET_SEARCH_RESPONSE_PROMPT, llm)
+        chain_registry.register("rag_response", RAG_RESPONSE_PROMPT, llm)
+        
         # Build the conversation workflow
         print("Building conversation workflow...")
         self.workflow = self._build_conversation_workflow()
@@ -191,7 +267,10 @@ class GeoNorgeRAGWorkflow:
         """Create a tool for retrieval operations using GeoNorgeVectorRetriever."""
         from langchain.tools import StructuredTool
 
-        def retrieve_geo_information(query: str) -> str:
+        class RetrieveGeoInformationInput(BaseModel):
+            query: str = Field(description="Search query for the GeoNorge database")
+
+        def retrieve_geo_information(query: str, view_bbox=None) -> str:
             """Search and retrieve geographical information from GeoNorge database."""
             import asyncio
             
@@ -199,7 +278,7 @@ class GeoNorgeRAGWorkflow:
             async def _retrieve_data():
                 try:
                     # Use the retriever to get relevant documents
-                    documents, vdb_response = await self.retriever.get_relevant_documents(query)
+                    documents, vdb_response = await self.retriever.get_relevant_documents(query, view_bbox=view_bbox)
                     
                     # Format the documents into a string for the LLM
                     formatted_docs = "\n\n".join([doc.page_content for doc in documents])
@@ -227,7 +306,8 @@ class GeoNorgeRAGWorkflow:
         return StructuredTool.from_function(
             func=retrieve_geo_information,
             name="retrieve_geo_information",
-            description="Search and retrieve geographical information from GeoNorge database based on vector search."
+            description="Search and retrieve geographical information from GeoNorge database based on vector search.",
+            args_schema=RetrieveGeoInformationInput
         )
         
     def _create_dataset_info_tool(self):
@@ -235,7 +315,10 @@ class GeoNorgeRAGWorkflow:
         from langchain.tools import StructuredTool
         from helpers.vector_database import get_vdb_response
         
-        def search_dataset(dataset_query: str) -> str:
+        class SearchDatasetInput(BaseModel):
+            dataset_query: str = Field(description="Query describing the dataset content")
+
+        def search_dataset(dataset_query: str, view_bbox=None) -> str:
             """Find dataset information using vector search."""
             import asyncio
             
@@ -243,7 +326,7 @@ class GeoNorgeRAGWorkflow:
             async def _search_data():
                 try:
                     # Use the vector database directly to find datasets matching the query
-                    vdb_response = await get_vdb_response(dataset_query)
+                    vdb_response = await get_vdb_response(dataset_query, view_bbox=view_bbox)
                     
                     if not vdb_response:
                         return "Ingen datasett funnet som matcher søket ditt."
@@ -288,19 +371,21 @@ class GeoNorgeRAGWorkflow:
         return StructuredTool.from_function(
             func=search_dataset,
             name="search_dataset",
-            description="Search for datasets using vector search based on a query about the dataset content."
+            description="Search for datasets using vector search based on a query about the dataset content.",
+            args_schema=SearchDatasetInput
         )
 
+    @traced("rag.agent")
     async def agent_node(self, state: AgentState) -> Dict:
         """
         Custom agent implementation that decides what action to take based on the query.
         
         This replaces the traditional ReAct agent with a custom implementation.
         """
-        from llm import LLMManager
         from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
         from helpers.websocket import send_websocket_message
         from .utils.common import active_websockets
+        from .utils.history import trim_to_recent_exchanges
         import json
         
         print("DEBUG agent_node: Starting agent processing")
@@ -410,6 +495,10 @@ class GeoNorgeRAGWorkflow:
                 if history_pairs:
                     chat_history_context = "\n\nTidligere samtale:\n" + "\n\n".join(history_pairs)
         
+        # Older turns are already covered by the (summarised) chat history above, so
+        # only the most recent exchanges are sent as individual messages
+        formatted_messages = trim_to_recent_exchanges(formatted_messages)
+        
         system_content = f"""Du er en EKSPERT assistent for Geonorge, spesialisert på å finne geodata og datasett.
         Ditt mål er å gi brukeren det mest nøyaktige og oppdaterte svaret ved å bruke verktøyene dine så ofte som mulig.
 
@@ -455,13 +544,8 @@ class GeoNorgeRAGWorkflow:
                 
             filtered_messages.append(msg)
         
-        # Get the LLM and bind tools
-        llm_manager = LLMManager()
-        llm = llm_manager.get_main_llm()
-        
-        # Create the tools
+        # The tool-bound LLM is built once in __init__
         tools = [self.retrieval_tool, self.dataset_info_tool]
-        llm_with_tools = llm.bind_tools(tools)
         
         # Print debugging info
         print(f"DEBUG agent_node: Using {len(tools)} tools")
@@ -480,7 +564,7 @@ class GeoNorgeRAGWorkflow:
                 response_chunks = []
                 full_response_content = ""
                 final_chunk = None
-                async for chunk in llm_with_tools.astream(filtered_messages):
+                async for chunk in chain_registry.astream("rag_agent", filtered_messages):
                     final_chunk = chunk  # Keep track of the last chunk object
                     # Accumulate content even if it might be tool calls initially
                     if hasattr(chunk, 'content'):
@@ -521,7 +605,7 @@ class GeoNorgeRAGWorkflow:
             else:
                 # If no websocket, just invoke the model normally
                 print(f"DEBUG agent_node: No websocket for streaming, using regular invoke")
-                response = await llm_with_tools.ainvoke(filtered_messages)
+                response = await chain_registry.ainvoke_message("rag_agent", filtered_messages)
             
             print(f"DEBUG agent_node: Got response type: {type(response)}")
             
@@ -553,6 +637,7 @@ class GeoNorgeRAGWorkflow:
                 "original_query": original_query
             }
     
+    @traced("rag.tool_execution")
     async def handle_tool_calls(self, state: AgentState) -> Dict:
         """Execute the tools called by the agent."""
         from langchain_core.messages import ToolMessage
@@ -592,6 +677,12 @@ class GeoNorgeRAGWorkflow:
         # Create a dict of available tools
         tools = [self.retrieval_tool, self.dataset_info_tool]
         tool_dict = {tool.name: tool for tool in tools}
+
+        # Restrict searches to what the user is looking at in the map, if known
+        from .map_workflow import get_map_view_bbox
+        view_bbox = get_map_view_bbox(state.get("websocket_id"))
+        if view_bbox:
+            print(f"DEBUG handle_tool_calls: Restricting search to map view {view_bbox}")
         
         # Execute each tool
         tool_results = []
@@ -652,7 +743,8 @@ class GeoNorgeRAGWorkflow:
                         print(f"DEBUG handle_tool_calls: Using metadata query: {metadata_query}")
                         
                         # Call the tool with the query
-                        result = tool.func(query)
+                        with span(f"tool.{tool_name}", **{"tool.query": query}):
+                            result = tool.func(query, view_bbox=view_bbox)
                         
                         # Get vector DB response for metadata context (for image insertion)
                         try:
@@ -661,7 +753,7 @@ class GeoNorgeRAGWorkflow:
                             # Get vector DB results for image metadata
                             async def _get_metadata():
                                 from helpers.vector_database import get_vdb_response
-                                return await get_vdb_response(metadata_query)
+                                return await get_vdb_response(metadata_query, view_bbox=view_bbox)
                                 
                             loop = asyncio.get_event_loop()
                             vdb_response = loop.run_until_complete(_get_metadata())
@@ -699,7 +791,8 @@ class GeoNorgeRAGWorkflow:
                         print(f"DEBUG handle_tool_calls: Using metadata query: {metadata_query}")
                         
                         # Call the tool with the dataset_query
-                        result = tool.func(dataset_query)
+                        with span(f"tool.{tool_name}", **{"tool.query": dataset_query}):
+                            result = tool.func(dataset_query, view_bbox=view_bbox)
                         
                         # Get vector DB response for metadata context (for image insertion)
                         try:
@@ -707,7 +800,7 @@ class GeoNorgeRAGWorkflow:
                             # Get vector DB results for image metadata
                             async def _get_metadata():
                                 from helpers.vector_database import get_vdb_response
-                                return await get_vdb_response(metadata_query)
+                                return await get_vdb_response(metadata_query, view_bbox=view_bbox)
                                 
                             loop = asyncio.get_event_loop()
                             vdb_response = loop.run_until_complete(_get_metadata())
@@ -753,11 +846,11 @@ class GeoNorgeRAGWorkflow:
             "metadata_context": metadata_context
         }
     
+    @traced("rag.rewrite_query")
     async def rewrite_query(self, state: AgentState) -> Dict:
         """
         Transform the query to produce a better question for retrieval.
         """
-        from llm import LLMManager
         
         messages = state["messages"]
         
@@ -780,21 +873,8 @@ class GeoNorgeRAGWorkflow:
             # We couldn't get the content, return state unchanged
             return state
             
-        # Create the prompt for query reformulation
-        prompt_msg = HumanMessage(
-            content=f""" \n 
-        Look at the input and try to reason about the underlying semantic intent / meaning. \n 
-        Here is the initial question:
-        \n ------- \n
-        {question} 
-        \n ------- \n
-        Formulate the question to ONLY be a SINGLE sentence for better geographical data retrieval: """
-        )
-        
-        # Use our LLM manager to get the model
-        llm_manager = LLMManager()
-        model = llm_manager.get_main_llm()
-        response = await model.ainvoke([prompt_msg])
+        # Reformulate the query with the prebuilt rewrite chain
+        rewritten_question = await chain_registry.ainvoke("rewrite_query", {"question": question})
         
         # Create new messages list, filtering out the original message
         new_messages = []
@@ -803,7 +883,7 @@ class GeoNorgeRAGWorkflow:
                 new_messages.append(msg)
         
         # Add the improved query
-        new_messages.append(HumanMessage(content=response.content))
+        new_messages.append(HumanMessage(content=rewritten_question))
 
         # Preserve other state fields when returning the update
         return {
@@ -814,12 +894,12 @@ class GeoNorgeRAGWorkflow:
             "metadata_context": state.get("metadata_context", []) # Preserve metadata
         }
         
+    @traced("rag.grading")
     async def assess_relevance(self, state: AgentState) -> Literal["generate", "rewrite"]:
         """
         Determines whether the retrieved documents are relevant to the question.
         Similar to the grade_documents function in the tutorial.
         """
-        from llm import LLMManager
         
         messages = state["messages"]
         
@@ -900,33 +980,11 @@ class GeoNorgeRAGWorkflow:
             print("DEBUG assess_relevance: No query found at all, defaulting to rewrite")
             return "rewrite"
         
-        # Create the relevance assessment prompt
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """Du er en vurderer som skal avgjøre om informasjonen er relevant for brukerens spørsmål.
-            
-            Vurder BARE om informasjonen er relevant, ikke om den er fullstendig.
-            Gi 'yes' hvis informasjonen er relevant for spørsmålet, ellers 'no'.
-            Vær konservativ og si 'yes' selv om bare deler av informasjonen er relevant."""),
-            ("human", f"""
-            Her er informasjonen som ble hentet:
-            {context}
-            
-            Her er brukerens spørsmål:
-            {original_query}
-            
-            Er denne informasjonen relevant for spørsmålet? Svar kun med 'yes' eller 'no'.
-            """)
-        ])
-        
         try:
-            # Get LLM and invoke the prompt
-            llm_manager = LLMManager()
-            llm = llm_manager.get_main_llm()
-            
-            chain = prompt | llm | StrOutputParser()
-            
-            result = await chain.ainvoke({})
+            result = await chain_registry.ainvoke("assess_relevance", {
+                "context": context,
+                "question": original_query
+            })
             result = result.lower().strip()
             print(f"DEBUG assess_relevance: Relevance assessment result: {result}")
             
@@ -940,12 +998,11 @@ class GeoNorgeRAGWorkflow:
             # Default to generate on error
             return "generate"
             
+    @traced("rag.generation")
     async def generate_final_response(self, state: AgentState) -> Dict:
         """
         Generate a final response based on the retrieved information.
         """
-        from langchain_core.prompts import PromptTemplate
-        from llm import LLMManager
         from helpers.websocket import send_websocket_message, send_websocket_action
         from .utils.common import active_websockets, get_websocket
         import json
@@ -1038,47 +1095,12 @@ class GeoNorgeRAGWorkflow:
         
         print(f"DEBUG generate_final_response: Using query '{query_for_response}' with retrieved info of length {len(retrieved_info)}")
         
-        # Create the appropriate RAG prompt based on which tool was used
+        # Pick the prebuilt response chain based on which tool was used
         if tool_type == "search_dataset":
-            # The search_dataset tool already formats the response, just summarize it
-            prompt = PromptTemplate(
-                template="""Du er en EKSPERT for geografiske datasett i Norge. 
-                Brukeren søkte etter datasett, og her er søkeresultatene:
-                
-                {context}
-                
-                Bruk informasjonen fra søkeresultatene til å svare på spørsmålet og foreslå datasett til brukeren: {question}
-                
-                Inkluder tittel, kort beskrivelse og lenke til hvert datasett i svaret. 
-                Du MÅ legge til formatering med bold (**) for titler.
-
-                
-                Svar:""",
-                input_variables=["question", "context"],
-            )
+            response_chain = "dataset_search_response"
         else:
-            # Standard RAG prompt for general geographical information
-            prompt = PromptTemplate(
-                template="""Du er en assistent som svarer på spørsmål om geografiske data i Norge.
-                
-                Bruk informasjonen fra den forhåndsinnhentede konteksten for å svare på spørsmålet.
-                Hvis du ikke finner svaret i konteksten, si at du ikke har nok informasjon og foreslå alternative måter brukeren kan spørre.
-                Hold svaret konsist og fokusert på norske geografiske data.
-                Du MÅ legge til formatering med bold (**) for titler.
-                
-                Spørsmål: {question} 
-                
-                Kontekst:
-                {context}
-                
-                Svar:""",
-                input_variables=["question", "context"],
-            )
-        
-        # Create and run the generation chain
-        llm_manager = LLMManager()
-        llm = llm_manager.get_main_llm()
-        chain = prompt | llm | StrOutputParser()
+            response_chain = "rag_response"
+        response_inputs = {"question": query_for_response, "context": retrieved_info}
 
         # Send the response through websocket
         if websocket:
@@ -1097,7 +1119,7 @@ class GeoNorgeRAGWorkflow:
                 response_chunks = []
                 print(f"DEBUG: Starting to stream tokens")
                 try:
-                    async for chunk in (prompt | llm).astream({"question": query_for_response, "context": retrieved_info}):
+                    async for chunk in chain_registry.astream(response_chain, response_inputs):
                         if hasattr(chunk, 'content'):
                             response_chunks.append(chunk.content)
                             print(f"DEBUG: Streaming chunk: {chunk.content[:20]}...")
@@ -1153,15 +1175,15 @@ class GeoNorgeRAGWorkflow:
                 except Exception as e:
                     print(f"ERROR in generate_final_response: {e}")
                     # Default to generate on error
-                    response = await chain.ainvoke({"question": query_for_response, "context": retrieved_info})
+                    response = await chain_registry.ainvoke(response_chain, response_inputs)
             else:
                 print(f"DEBUG generate_final_response: Suppressing chat response in mixed workflow mode")
                 # Still generate the response for the supervisor to use
-                response = await chain.ainvoke({"question": query_for_response, "context": retrieved_info})
+                response = await chain_registry.ainvoke(response_chain, response_inputs)
         else:
             print(f"DEBUG generate_final_response: No websocket available to send response")
             # Generate response without streaming
-            response = await chain.ainvoke({"question": query_for_response, "context": retrieved_info})
+            response = await chain_registry.ainvoke(response_chain, response_inputs)
         
         return {"messages": [AIMessage(content=response)]}
 
@@ -1,12 +1,48 @@
 """
 Main entry points for the RAG workflow.
+
+The supervisor (and with it LangGraph, the workflows and the LLM clients) is
+imported and built on first use rather than when this module is imported, so
+the server binds its sockets first. The startup warm-up builds it in a
+thread (see ``helpers/prewarm.py``), and chat turns that arrive before it is
+done wait for it off the event loop (see ``get_supervisor_async``).
 """
+import asyncio
+import threading
 from typing import List, Dict, Any, Optional
-from .chain import GeoNorgeSupervisor
 from .utils.common import active_websockets
 
-# Initialize the enhanced RAG chain - use a single global instance
-enhanced_rag_chain = GeoNorgeSupervisor()
+# The single global supervisor instance, built by get_supervisor()
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """Return the supervisor, building it on first call."""
+    global _supervisor
+    if _supervisor is None:
+        with _supervisor_lock:
+            if _supervisor is None:
+                from .chain import GeoNorgeSupervisor
+                _supervisor = GeoNorgeSupervisor()
+    return _supervisor
+
+
+async def get_supervisor_async():
+    """
+    Return the supervisor without blocking the event loop.
+
+    While the warm-up is still building it, ``get_supervisor`` waits on the
+    build lock, so the wait happens in a worker thread.
+    """
+    if _supervisor is not None:
+        return _supervisor
+    return await asyncio.to_thread(get_supervisor)
+
+
+def supervisor_sessions() -> int:
+    """Sessions held by the supervisor, without building it."""
+    return len(_supervisor.sessions) if _supervisor is not None else 0
 
 
 async def get_rag_response(
@@ -17,6 +53,7 @@ async def get_rag_response(
 ) -> str:
     """Main entry point for the enhanced RAG chatbot."""
     session_id = str(id(websocket))
+    enhanced_rag_chain = await get_supervisor_async()
     
     # Store the websocket in the active_websockets dict directly to ensure it's available
     if websocket is not None:
@@ -27,6 +64,25 @@ async def get_rag_response(
     return await enhanced_rag_chain.chat(user_question, session_id, websocket)
 
 
+async def record_cached_exchange(user_question: str, answer: str, websocket: Any) -> None:
+    """
+    Add a turn answered from the response cache to the session state, so
+    follow-up questions see it in their history like any generated answer.
+    """
+    session_id = str(id(websocket))
+    supervisor = await get_supervisor_async()
+    state = supervisor.sessions.setdefault(session_id, {
+        "messages": [],
+        "chat_history": "",
+        "websocket_id": session_id,
+        "metadata_context": []
+    })
+    state.setdefault("messages", []).extend([
+        {"role": "human", "content": user_question},
+        {"role": "assistant", "content": answer},
+    ])
+
+
 async def get_rag_context(vdb_response):
     """Get enhanced context from vector database response."""
     # This function can be implemented if needed for specific context processing
@@ -7,20 +7,75 @@ from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, END, StateGraph
 from langgraph.types import Command
 
-from llm import LLMManager
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
+from llm import LLMManager, chain_registry
+from langchain_core.prompts import ChatPromptTemplate
 
 from .rag_workflow import GeoNorgeRAGWorkflow
 from .map_workflow import LeafletMapWorkflow
 from .utils.common import register_websockets_dict, format_history, active_websockets
+from .utils.history import history_manager
 from .utils.image_processor import insert_image_rag_response
+from helpers.tracing import traced
 from helpers.websocket import send_websocket_message
 from action_enums import Action
 import re
 import asyncio
 import uuid
 
+# Prompts are built once at import; the chains using them are registered in GeoNorgeSupervisor.__init__
+CLASSIFY_QUERY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Du er en assistent som avgjør om en brukerforespørsel handler om kartet, informasjonssøk, eller begge deler.
+    
+    Hvis forespørselen BARE handler om kartmanipulasjoner, som:
+    - Panorere, zoome eller flytte kartet til en lokasjon ("flytt kartet til Oslo", "zoom inn på Bergen")
+    - Vise eller skjule kartlag ("vis topografisk kart", "skjul satelittbilde")
+    - Legge til, fjerne eller finne markører ("sett markør i Trondheim", "fjern alle markører")
+    - Andre direkte kartmanipulasjoner
+    - Spesifikk bruk av kartet til å vise steder, uten å be om faktainformasjon om stedene
+    
+    Da skal du klassifisere det som "map" (kart).
+    
+    Hvis forespørselen BARE handler om å få informasjon, som:
+    - Å spørre om informasjon om geografiske data ("hva er FKB?", "fortell meg om N50")
+    - Søke etter datasett eller informasjon ("finn datasett om elver", "hvilke datasett finnes for skogsområder")
+    - Generelle informasjonsspørsmål om steder, data eller Geonorge/GeoGPT
+    - Spørsmål om fakta, uten å be om kartmanipulasjoner
+    
+    Da skal du klassifisere det som "rag" (informasjonssøk).
+    
+    Forespørselen skal KUN klassifiseres som "mixed" når det er TYDELIG at brukeren både:
+    1) Spør om faktabaserte informasjon om et tema, datasett eller geografisk fenomen, OG
+    2) Eksplisitt ber om spesifikke kartmanipulasjoner
+    
+    For eksempel:
+    - "Hva er FKB og kan du flytte kartet til Trondheim?" (mixed - både faktaspørsmål og kartmanipulasjon)
+    - "Fortell meg om arealressurskart og vis meg hvor jeg finner dette i kartet" (mixed)
+    
+    Men disse er IKKE mixed:
+    - "Flytt kartet til Oslo og sett zoom til 12" (map - bare kartoperasjoner)
+    - "Zoom inn på Bergen og sett markør i Oslo og Trondheim" (map - selv om det nevner byer er det bare kartoperasjoner)
+    - "Hva er N50 kartdata?" (rag - bare informasjonssøk)
+    
+    Returner bare ett enkelt ord: "map", "rag", eller "mixed".
+    """),
+    ("human", "{query}")
+])
+
+MERGE_RESULTS_PROMPT = ChatPromptTemplate.from_template("""
+    Du er en assistent som skal kombinere to svar til ett sammenhengende svar.
+    
+    Det første svaret inneholder informasjon om et geografisk tema.
+    Det andre svaret beskriver endringer gjort på et kart.
+    
+    Kombiner disse to svarene til ett sammenhengende svar som gir all informasjonen på en naturlig måte.
+    Begynn med den faktabaserte informasjonen, og avslutt med kartendringene.
+    
+    Informasjonssøksvar: {rag_response}
+    
+    Kartsvar: {map_response}
+""")
+
+
 # Helper function to ensure message dictionaries have required fields for conversion
 def fix_message_dict_for_conversion(message: Dict) -> Dict:
     """
@@ -95,6 +150,10 @@ class GeoNorgeSupervisor:
         llm_manager = LLMManager()
         self.model = llm_manager.get_main_llm()
         
+        # Build the supervisor's chains once instead of on every turn
+        chain_registry.register("classify_query", CLASSIFY_QUERY_PROMPT, self.model)
+        chain_registry.register("merge_results", MERGE_RESULTS_PROMPT, self.model)
+        
         # Register the websockets dictionary
         register_websockets_dict(self.active_websockets)
         
@@ -121,6 +180,7 @@ class GeoNorgeSupervisor:
         workflow = StateGraph(SupervisorStateSchema)
         
         # Define supervisor node that determines which workflow to use
+        @traced("supervisor.classification")
         async def classify_query(state):
             """Analyze the query and decide which workflow to use."""
             print(f"DEBUG classify_query: state type = {type(state)}")
@@ -149,46 +209,7 @@ class GeoNorgeSupervisor:
             print(f"DEBUG: Query for classification: {query}")
                 
             # Use the LLM to classify the query
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """Du er en assistent som avgjør om en brukerforespørsel handler om kartet, informasjonssøk, eller begge deler.
-                
-                Hvis forespørselen BARE handler om kartmanipulasjoner, som:
-                - Panorere, zoome eller flytte kartet til en lokasjon ("flytt kartet til Oslo", "zoom inn på Bergen")
-                - Vise eller skjule kartlag ("vis topografisk kart", "skjul satelittbilde")
-                - Legge til, fjerne eller finne markører ("sett markør i Trondheim", "fjern alle markører")
-                - Andre direkte kartmanipulasjoner
-                - Spesifikk bruk av kartet til å vise steder, uten å be om faktainformasjon om stedene
-                
-                Da skal du klassifisere det som "map" (kart).
-                
-                Hvis forespørselen BARE handler om å få informasjon, som:
-                - Å spørre om informasjon om geografiske data ("hva er FKB?", "fortell meg om N50")
-                - Søke etter datasett eller informasjon ("finn datasett om elver", "hvilke datasett finnes for skogsområder")
-                - Generelle informasjonsspørsmål om steder, data eller Geonorge/GeoGPT
-                - Spørsmål om fakta, uten å be om kartmanipulasjoner
-                
-                Da skal du klassifisere det som "rag" (informasjonssøk).
-                
-                Forespørselen skal KUN klassifiseres som "mixed" når det er TYDELIG at brukeren både:
-                1) Spør om faktabaserte informasjon om et tema, datasett eller geografisk fenomen, OG
-                2) Eksplisitt ber om spesifikke kartmanipulasjoner
-                
-                For eksempel:
-                - "Hva er FKB og kan du flytte kartet til Trondheim?" (mixed - både faktaspørsmål og kartmanipulasjon)
-                - "Fortell meg om arealressurskart og vis meg hvor jeg finner dette i kartet" (mixed)
-                
-                Men disse er IKKE mixed:
-                - "Flytt kartet til Oslo og sett zoom til 12" (map - bare kartoperasjoner)
-                - "Zoom inn på Bergen og sett markør i Oslo og Trondheim" (map - selv om det nevner byer er det bare kartoperasjoner)
-                - "Hva er N50 kartdata?" (rag - bare informasjonssøk)
-                
-                Returner bare ett enkelt ord: "map", "rag", eller "mixed".
-                """),
-                ("human", query)
-            ])
-            
-            chain = prompt | self.model | StrOutputParser()
-            classification = await chain.ainvoke({})
+            classification = await chain_registry.ainvoke("classify_query", {"query": query})
             classification = classification.strip().lower()
             
             print(f"Query classification: {classification}")
@@ -249,6 +270,7 @@ class GeoNorgeSupervisor:
             return {"NEXT": ["run_rag", "run_map"], "rag_state": rag_state, "map_state": map_state}
         
         # Define nodes to run each workflow
+        @traced("supervisor.rag_workflow")
         async def run_rag(state):
             """Run the RAG workflow with the provided state."""
             print(f"DEBUG run_rag: Running RAG workflow")
@@ -353,9 +375,11 @@ class GeoNorgeSupervisor:
                 # Create default message if none exists
                 clean_rag_state["messages"] = [{"role": "human", "content": "Jeg trenger informasjon om geografiske data"}]
             
-            # Create a properly formatted chat history from the messages for the RAG workflow to use
-            from .utils.common import format_history
-            clean_rag_state["chat_history"] = format_history(clean_rag_state["messages"])
+            # Reuse the bounded chat history built in chat(); only rebuild it if it is missing
+            if not clean_rag_state["chat_history"]:
+                clean_rag_state["chat_history"] = history_manager.format(
+                    clean_rag_state["websocket_id"], clean_rag_state["messages"]
+                )
             
             print(f"DEBUG: Created clean RAG state with query: {clean_rag_state['messages'][-1].get('content')}")
             print(f"DEBUG: Chat history length: {len(clean_rag_state['chat_history'])}")
@@ -381,6 +405,7 @@ class GeoNorgeSupervisor:
                     "NEXT": "merge_results"
                 }
         
+        @traced("supervisor.map_workflow")
         async def run_map(state):
             """Run the Map workflow with the provided state."""
             print(f"DEBUG run_map: Running Map workflow")
@@ -414,6 +439,7 @@ class GeoNorgeSupervisor:
             return {"map_result": result, "NEXT": "merge_results"}
         
         # Define node to merge results from parallel workflows
+        @traced("supervisor.merge_results")
         async def merge_results(state):
             """
             Merge results from multiple workflows.
@@ -570,26 +596,6 @@ class GeoNorgeSupervisor:
                         rag_response_str = str(rag_response) if rag_response else "Ingen informasjon funnet."
                         map_response_str = str(map_response) if map_response else "Ingen endringer gjort på kartet."
                         
-                        prompt_template = """
-                        Du er en assistent som skal kombinere to svar til ett sammenhengende svar.
-                        
-                        Det første svaret inneholder informasjon om et geografisk tema.
-                        Det andre svaret beskriver endringer gjort på et kart.
-                        
-                        Kombiner disse to svarene til ett sammenhengende svar som gir all informasjonen på en naturlig måte.
-                        Begynn med den faktabaserte informasjonen, og avslutt med kartendringene.
-                        
-                        Informasjonssøksvar: {rag_response}
-                        
-                        Kartsvar: {map_response}
-                        """
-                        
-                        # Create a prompt using from_template
-                        prompt = ChatPromptTemplate.from_template(prompt_template)
-                        
-                        # Build the chain with proper parameters
-                        chain = prompt | self.model | StrOutputParser()
-                        
                         # Get the original user query
                         query = ""
                         for msg in state_dict.get("messages", []):
@@ -617,9 +623,6 @@ class GeoNorgeSupervisor:
                             
                             if websocket:
                                 try:
-                                    # Create LLM chain for combined response
-                                    chain = prompt | self.model | StrOutputParser()
-                                    
                                     # Send initial empty message to start streaming
                                     print(f"DEBUG merge_results: Sending initial empty message")
                                     await send_websocket_message("chatStream", {"payload": "", "isNewMessage": True}, websocket)
@@ -627,7 +630,7 @@ class GeoNorgeSupervisor:
                                     # Stream token by token using astream
                                     print(f"DEBUG merge_results: Starting token streaming")
                                     combined_response = ""
-                                    async for chunk in (prompt | self.model).astream({
+                                    async for chunk in chain_registry.astream("merge_results", {
                                         "rag_response": rag_response_str,
                                         "map_response": map_response_str
                                     }):
@@ -679,7 +682,7 @@ class GeoNorgeSupervisor:
                                     traceback.print_exc()
                                     
                                     # Fall back to non-streaming
-                                    combined_response = await chain.ainvoke({
+                                    combined_response = await chain_registry.ainvoke("merge_results", {
                                         "rag_response": rag_response_str,
                                         "map_response": map_response_str
                                     })
@@ -931,7 +934,7 @@ class GeoNorgeSupervisor:
         if 'messages' not in current_state:
             current_state['messages'] = []
         current_state['messages'].append({"role": "human", "content": query})
-        current_state['chat_history'] = format_history(current_state['messages'])
+        current_state['chat_history'] = history_manager.format(session_id, current_state['messages'])
         
         # Invoke the supervisor chain
         config = {"configurable": {"thread_id": session_id}}
@@ -942,6 +945,9 @@ class GeoNorgeSupervisor:
         self.sessions[session_id] = final_state
         print(f"Updated session {session_id} with new state containing {len(final_state.get('messages', []))} messages")
         
+        # Fold turns that have left the verbatim window into the rolling summary
+        history_manager.schedule_summary(session_id, final_state.get('messages', []))
+        
         # Debug the final state after workflow completion
         if 'messages' in final_state:
             last_messages = final_state['messages'][-min(2, len(final_state['messages'])):]
@@ -1,56 +1,52 @@
 """
 Utility modules for the RAG workflow.
+
+Exports are imported on first access, so lightweight helpers (e.g.
+``format_history``) can be used without importing the LLM-backed modules.
 """
+import importlib
 
-from .dataset_utils import (
-    enrich_dataset_metadata,
-    process_vdb_response,
-    create_follow_up_context,
-    extract_dataset_info
-)
-
-from .document_grading import (
-    evaluate_document_relevance,
-)
-
-from .templates import (
-    RESPONSE_TEMPLATES,
-    NO_RESULTS_TEMPLATE
-)
-
-from .common import (
-    active_websockets,
-    register_websockets_dict,
-    format_history
-)
-
-from .image_processor import (
-    check_image_signal,
-    insert_image_rag_response
-)
-
-__all__ = [
+_EXPORTS = {
     # Dataset utils
-    'enrich_dataset_metadata',
-    'process_vdb_response',
-    'create_follow_up_context',
-    'extract_dataset_info',
-    
+    'enrich_dataset_metadata': '.dataset_utils',
+    'process_vdb_response': '.dataset_utils',
+    'create_follow_up_context': '.dataset_utils',
+    'extract_dataset_info': '.dataset_utils',
+
     # Document grading utils
-    'evaluate_document_relevance',
-    'prepare_documents_for_evaluation',
-    
+    'evaluate_document_relevance': '.document_grading',
+    'prepare_documents_for_evaluation': '.document_grading',
+
     # Templates
-    'RESPONSE_TEMPLATES',
-    'NO_RESULTS_TEMPLATE',
-    
+    'RESPONSE_TEMPLATES': '.templates',
+    'NO_RESULTS_TEMPLATE': '.templates',
+
     # Common utils
-    'active_websockets',
-    'register_websockets_dict',
-    'format_history',
-    
+    'active_websockets': '.common',
+    'register_websockets_dict': '.common',
+    'format_history': '.common',
+
+    # Map state
+    'persistent_map_states': '.map_state',
+    'get_map_view_bbox': '.map_state',
+
+    # Conversation history
+    'ConversationHistoryManager': '.history',
+    'history_manager': '.history',
+    'trim_to_recent_exchanges': '.history',
+
     # Image processing
-    'check_image_signal',
-    'insert_image_rag_response',
+    'check_image_signal': '.image_processor',
+    'insert_image_rag_response': '.image_processor',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
 
-] 
\ No newline at end of file
+__all__ = list(_EXPORTS)
@@ -4,8 +4,28 @@ Document relevance grading utilities for the RAG system.
 import json
 import re
 from typing import List, Dict, Any, Optional, Tuple
-from langchain.schema import StrOutputParser
-from langchain.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
+
+from helpers.tracing import traced
+from llm import chain_registry
+
+
+EVALUATION_PROMPT = ChatPromptTemplate.from_template("""
+    Du er en AI-assistent som hjelper til med å vurdere relevans av datasett basert på brukerens spørsmål.
+    
+    Brukerens spørsmål: {query}
+    
+    Nedenfor er en liste med datasett. Vurder hvert datasett og angi om det er relevant for brukerens spørsmål.
+    For hvert datasett, gi en score fra 0-100 hvor 100 er høyest relevans.
+    Datasett med 'dam', 'dammer', eller lignende vannrelaterte begreper bør få høy score når brukeren spør om dam-relatert informasjon.
+    
+    Returner resultatet i JSON-format
+    
+    Bruk 'true' (ikke 'True') og 'false' (ikke 'False') for boolske verdier i JSON.
+    
+    Datasett å vurdere:
+    {datasets_text}
+    """)
 
 
 async def prepare_documents_for_evaluation(metadata_context: List) -> Tuple[List[Dict], str]:
@@ -39,34 +59,6 @@ async def prepare_documents_for_evaluation(metadata_context: List) -> Tuple[List
     return documents_to_evaluate, datasets_text
 
 
-def create_evaluation_prompt(datasets_text: str) -> ChatPromptTemplate:
-    """
-    Create the evaluation prompt for the LLM.
-    
-    Args:
-        datasets_text: Formatted text representation of datasets
-        
-    Returns:
-        ChatPromptTemplate configured for relevance evaluation
-    """
-    return ChatPromptTemplate.from_template(f"""
-    Du er en AI-assistent som hjelper til med å vurdere relevans av datasett basert på brukerens spørsmål.
-    
-    Brukerens spørsmål: {{query}}
-    
-    Nedenfor er en liste med datasett. Vurder hvert datasett og angi om det er relevant for brukerens spørsmål.
-    For hvert datasett, gi en score fra 0-100 hvor 100 er høyest relevans.
-    Datasett med 'dam', 'dammer', eller lignende vannrelaterte begreper bør få høy score når brukeren spør om dam-relatert informasjon.
-    
-    Returner resultatet i JSON-format
-    
-    Bruk 'true' (ikke 'True') og 'false' (ikke 'False') for boolske verdier i JSON.
-    
-    Datasett å vurdere:
-    {datasets_text}
-    """)
-
-
 def extract_json_from_text(text: str) -> Dict:
     """
     Extract JSON from text that might contain markdown or other formatting.
@@ -153,6 +145,7 @@ def get_relevance_info(eval_item: Dict) -> Tuple[Optional[int], bool, int, str]:
     return doc_id, is_relevant, relevance_score, explanation
 
 
+@traced("grading.evaluate_documents")
 async def evaluate_document_relevance(
     metadata_context: List, 
     user_query: str, 
@@ -165,7 +158,7 @@ async def evaluate_document_relevance(
     Args:
         metadata_context: List of raw metadata rows
         user_query: User's original query
-        llm: LLM instance to use for evaluation
+        llm: LLM instance used when the evaluation chain is first built
         relevance_threshold: Score threshold for keeping documents (0-100)
         
     Returns:
@@ -183,13 +176,16 @@ async def evaluate_document_relevance(
     documents_to_evaluate, datasets_text = await prepare_documents_for_evaluation(metadata_context)
     print(f"Number of documents to grade: {len(documents_to_evaluate)}")
     
-    # Create evaluation prompt
-    prompt = create_evaluation_prompt(datasets_text)
+    # The evaluation chain is built on first use and reused afterwards
+    chain_registry.register("evaluate_document_relevance", EVALUATION_PROMPT, llm)
     
     try:
         # Call LLM for document relevance evaluation
         print("Calling LLM for document relevance evaluation...")
-        evaluation_result = await (prompt | llm | StrOutputParser()).ainvoke({"query": user_query})
+        evaluation_result = await chain_registry.ainvoke("evaluate_document_relevance", {
+            "query": user_query,
+            "datasets_text": datasets_text
+        })
         print(f"LLM evaluation result:\n{evaluation_result}")
         
         # Parse the LLM response
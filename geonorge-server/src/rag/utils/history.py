@@ -0,0 +1,230 @@
+"""
+Conversation history windowing and summarisation.
+
+Keeps the most recent exchanges of a session verbatim and folds older turns
+into a rolling summary, so the ``chat_history`` injected into prompts stays
+bounded no matter how long the conversation runs.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import CONFIG
+from helpers import metrics
+from .common import format_history
+
+
+SUMMARY_PROMPT = """Du oppsummerer en samtale mellom en bruker og GeoGPT, en assistent for geodata fra Geonorge.
+
+Eksisterende oppsummering:
+{summary}
+
+Nye meldinger som skal tas med i oppsummeringen:
+{messages}
+
+Skriv en oppdatert, kort oppsummering på norsk. Ta med hvilke temaer, steder og datasett
+(med eksakte titler) brukeren har spurt om, og hva assistenten svarte. Maks {max_chars} tegn."""
+
+
+def _role_and_content(msg: Any) -> Tuple[str, str]:
+    """Return the normalised role and text content of a dict or Message object."""
+    if isinstance(msg, dict):
+        role = (msg.get("role") or "").lower()
+        content = msg.get("content") or ""
+    elif hasattr(msg, "type") and hasattr(msg, "content"):
+        role = (msg.type or "").lower()
+        content = msg.content or ""
+    else:
+        return "unknown", str(msg) if msg is not None else ""
+    if not isinstance(content, str):
+        content = str(content)
+    return role, content
+
+
+def _is_conversational(msg: Any) -> bool:
+    """True for human messages and assistant messages that carry visible text."""
+    role, content = _role_and_content(msg)
+    return role in ("human", "user", "ai", "assistant") and bool(content.strip())
+
+
+def window_start(messages: List[Any], max_exchanges: int) -> int:
+    """
+    Find the index where the last ``max_exchanges`` exchanges begin.
+
+    An exchange starts at a human message and includes everything up to the
+    next human message (assistant replies, tool calls and tool results).
+
+    Args:
+        messages: Full message list for the session
+        max_exchanges: Number of trailing exchanges to keep verbatim
+
+    Returns:
+        Index into ``messages``; 0 if the whole list fits in the window
+    """
+    human_indices = [
+        i for i, msg in enumerate(messages)
+        if _role_and_content(msg)[0] in ("human", "user")
+    ]
+    if len(human_indices) <= max_exchanges:
+        return 0
+    return human_indices[-max_exchanges]
+
+
+def trim_to_recent_exchanges(messages: List[Any], max_exchanges: Optional[int] = None) -> List[Any]:
+    """Return only the messages belonging to the last ``max_exchanges`` exchanges."""
+    if max_exchanges is None:
+        max_exchanges = CONFIG["history"]["max_exchanges"]
+    return messages[window_start(messages, max_exchanges):]
+
+
+@dataclass
+class SessionHistory:
+    """Per-session summary state and formatted history cache."""
+    summary: str = ""
+    summarised_upto: int = 0
+    cache_key: Optional[Tuple] = None
+    cached_history: str = ""
+    summary_task: Optional[asyncio.Task] = None
+
+
+class ConversationHistoryManager:
+    """
+    Builds bounded ``chat_history`` strings for prompts.
+
+    The last ``max_exchanges`` exchanges are kept verbatim. Everything older is
+    folded into a summary that is updated incrementally in the background after
+    each turn, so summarisation never sits on the critical path of a response.
+    The formatted history is cached per session and only rebuilt when the
+    message list or the summary changes.
+    """
+
+    def __init__(self, max_exchanges: Optional[int] = None, summary_max_chars: Optional[int] = None):
+        history_config = CONFIG["history"]
+        self.max_exchanges = max_exchanges or history_config["max_exchanges"]
+        self.summary_max_chars = summary_max_chars or history_config["summary_max_chars"]
+        self.overflow_message_chars = history_config["overflow_message_chars"]
+        self._sessions: Dict[str, SessionHistory] = {}
+        self._llm = None
+
+    def _session(self, session_id: str) -> SessionHistory:
+        if session_id not in self._sessions:
+            self._sessions[session_id] = SessionHistory()
+        return self._sessions[session_id]
+
+    @staticmethod
+    def _messages_key(messages: List[Any]) -> Tuple:
+        if not messages:
+            return (0, None)
+        return (len(messages), hash(_role_and_content(messages[-1])))
+
+    def format(self, session_id: str, messages: List[Any]) -> str:
+        """
+        Get the bounded chat history for a session.
+
+        Args:
+            session_id: Conversation/session identifier
+            messages: Full message list for the session
+
+        Returns:
+            Summary of older turns followed by the recent exchanges verbatim
+        """
+        session = self._session(session_id)
+        key = (self._messages_key(messages), session.summarised_upto, len(session.summary))
+        metrics.record_cache("history", session.cache_key == key)
+        if session.cache_key == key:
+            return session.cached_history
+
+        # The message list can shrink if a session was reset; drop stale summary state
+        if session.summarised_upto > len(messages):
+            session.summary = ""
+            session.summarised_upto = 0
+
+        boundary = window_start(messages, self.max_exchanges)
+        parts = []
+        if session.summary:
+            parts.append(f"Oppsummering av tidligere samtale:\n{session.summary}")
+
+        # Turns that fell out of the window but are not summarised yet (summary
+        # still running or failed) are included in shortened form.
+        overflow = [
+            msg for msg in messages[session.summarised_upto:boundary]
+            if _is_conversational(msg)
+        ]
+        if overflow:
+            shortened = []
+            for msg in overflow:
+                role, content = _role_and_content(msg)
+                if len(content) > self.overflow_message_chars:
+                    content = content[:self.overflow_message_chars].rstrip() + " ..."
+                shortened.append({"role": role, "content": content})
+            parts.append(format_history(shortened))
+
+        recent = [msg for msg in messages[boundary:] if _is_conversational(msg)]
+        if recent:
+            parts.append(format_history(recent))
+
+        session.cache_key = key
+        session.cached_history = "\n\n".join(parts)
+        return session.cached_history
+
+    def schedule_summary(self, session_id: str, messages: List[Any]) -> None:
+        """
+        Fold turns that have left the verbatim window into the session summary.
+
+        Runs in a background task; at most one summary update per session is in
+        flight at a time.
+        """
+        session = self._session(session_id)
+        boundary = window_start(messages, self.max_exchanges)
+        if boundary <= session.summarised_upto:
+            return
+        if session.summary_task and not session.summary_task.done():
+            return
+        session.summary_task = asyncio.create_task(
+            self._update_summary(session, list(messages[:boundary]))
+        )
+
+    async def _update_summary(self, session: SessionHistory, messages: List[Any]) -> None:
+        new_messages = [
+            msg for msg in messages[session.summarised_upto:]
+            if _is_conversational(msg)
+        ]
+        if not new_messages:
+            session.summarised_upto = len(messages)
+            return
+
+        if self._llm is None:
+            from llm import LLMManager
+            self._llm = LLMManager().get_rewrite_llm()
+
+        prompt = SUMMARY_PROMPT.format(
+            summary=session.summary or "(ingen)",
+            messages=format_history(new_messages),
+            max_chars=self.summary_max_chars,
+        )
+        try:
+            response = await self._llm.ainvoke(prompt)
+            summary = response.content.strip() if hasattr(response, "content") else str(response).strip()
+        except Exception as e:
+            print(f"ERROR: Failed to update conversation summary: {e}")
+            return
+
+        session.summary = summary[:self.summary_max_chars]
+        session.summarised_upto = len(messages)
+        print(f"DEBUG: Conversation summary updated, covers {session.summarised_upto} messages ({len(session.summary)} chars)")
+
+    def pending_summaries(self) -> int:
+        """Number of summary updates running in the background."""
+        return sum(
+            1 for session in self._sessions.values()
+            if session.summary_task and not session.summary_task.done()
+        )
+
+    def drop(self, session_id: str) -> None:
+        """Forget all history state for a session."""
+        session = self._sessions.pop(session_id, None)
+        if session and session.summary_task and not session.summary_task.done():
+            session.summary_task.cancel()
+
+
+history_manager = ConversationHistoryManager()
@@ -1,167 +1,247 @@
 """
 Image processing functions for the RAG chain.
 """
+import asyncio
 import re
+import weakref
+from helpers import service_catalogue
 from helpers.websocket import send_websocket_message
-from helpers.download import dataset_has_download, get_download_url, get_standard_or_first_format, fetch_area_data
+from helpers.download import get_download_url, get_standard_or_first_format, fetch_area_data
 from helpers.fetch_valid_download_api_data import get_wms
+from helpers.tracing import span, traced
 from .dataset_utils import process_vdb_response
 
 
-async def check_image_signal(gpt_response, metadata_context_list):
+BOLD_PATTERN = re.compile(r'\*\*(.*?)\*\*')
+
+# Card enrichment runs after insert_image_rag_response returns. The server installs its
+# tracked spawn (see set_task_spawner) so a draining worker waits for it; without a
+# server the tasks are only kept referenced here
+_enrichment_tasks = set()
+_spawn_task = None
+
+# Last response a card was sent for, per websocket; the RAG workflow and the
+# supervisor both insert the card for the same answer
+_last_card_response = weakref.WeakKeyDictionary()
+
+
+def set_task_spawner(spawn):
     """
-    Check for image signals in the response and prepare image data.
-    
+    Run card enrichment through ``spawn``.
+
+    Args:
+        spawn: Function taking a coroutine and returning the task running it
+    """
+    global _spawn_task
+    _spawn_task = spawn
+
+
+def _spawn(coro):
+    if _spawn_task is not None:
+        return _spawn_task(coro)
+    task = asyncio.create_task(coro)
+    _enrichment_tasks.add(task)
+    task.add_done_callback(_enrichment_tasks.discard)
+    return task
+
+
+def _last_image_url(dataset):
+    """Return the last image URL of a dataset's comma-separated image field, or None."""
+    image_urls = [s.strip() for s in dataset["image"].split(",") if s.strip()]
+    return image_urls[-1] if image_urls else None
+
+
+def _titles_match(title, bold_text):
+    """Check whether a bold span in the response refers to a dataset title."""
+    bold_lower = bold_text.lower().replace(" ", "")
+    title_lower = title.replace(" ", "")
+
+    # Direct substring matching
+    if bold_lower in title_lower or title_lower in bold_lower:
+        return True
+
+    # Try word-based matching for partial matches
+    title_words = set(title_lower.split())
+    bold_words = set(bold_lower.split())
+    common_words = title_words.intersection(bold_words)
+
+    # If they share at least 2 significant words or more than 40% of words
+    return (len(common_words) >= 2 and
+            len(common_words) / max(len(title_words), len(bold_words)) > 0.4)
+
+
+def find_image_dataset(gpt_response, datasets):
+    """
+    Pick the dataset whose image should be shown with a response.
+
+    Datasets whose title matches a bold span in the response are preferred;
+    otherwise the first dataset with an image is used.
+
     Args:
         gpt_response: Generated text response that may contain bold titles
-        metadata_context_list: List of dataset metadata
-        
+        datasets: Dataset dictionaries with at least uuid, title and image
+
     Returns:
-        Dictionary with image data or False if no images found
+        Tuple of (dataset, image URL), or None if no dataset has an image
     """
-    print(f"DEBUG check_image_signal: Checking for images in response")
-    print(f"DEBUG check_image_signal: metadata_context_list type: {type(metadata_context_list)}")
-    print(f"DEBUG check_image_signal: metadata_context_list length: {len(metadata_context_list) if metadata_context_list else 0}")
-    
-    if not metadata_context_list:
-        print("DEBUG check_image_signal: No metadata context provided")
-        return False
-        
-    if isinstance(metadata_context_list, list) and len(metadata_context_list) > 0:
-        print(f"DEBUG check_image_signal: First metadata item: {metadata_context_list[0]}")
-    
-    field_names = ['uuid', 'title', 'abstract', 'image', 'distance']
-    dict_response = process_vdb_response(metadata_context_list, field_names)
-    
-    bold_titles = re.findall(r'\*\*(.*?)\*\*', gpt_response)
+    bold_titles = BOLD_PATTERN.findall(gpt_response)
     print(f"DEBUG check_image_signal: Found {len(bold_titles)} bold titles: {bold_titles}")
-    
+
     # If there are bold titles, try to match them with dataset names
     if bold_titles:
-        for obj in dict_response:
+        for obj in datasets:
             if not obj.get("title"):
                 print(f"DEBUG check_image_signal: Dataset missing title: {obj}")
                 continue
-                
+
             title = obj.get("title", "").lower()
-            print(f"DEBUG check_image_signal: Checking dataset: {title}")
-            
             for bold_text in bold_titles:
-                bold_lower = bold_text.lower().replace(" ", "")
-                title_lower = title.replace(" ", "")
-                print(f"DEBUG check_image_signal: Comparing '{title_lower}' with '{bold_lower}'")
-                
-                # Use more flexible matching criteria
-                match_found = False
-                
-                # Direct substring matching
-                if bold_lower in title_lower or title_lower in bold_lower:
-                    print(f"DEBUG check_image_signal: Found direct match! Dataset: {obj.get('title')}")
-                    match_found = True
+                if not _titles_match(title, bold_text):
+                    continue
+                print(f"DEBUG check_image_signal: Found match! Dataset: {obj.get('title')}")
+                if obj.get("uuid") and obj.get("image"):
+                    image_url = _last_image_url(obj)
+                    if image_url:
+                        return obj, image_url
+                    print(f"DEBUG check_image_signal: No valid image URLs in image field")
                 else:
-                    # Try word-based matching for partial matches
-                    title_words = set(title_lower.split())
-                    bold_words = set(bold_lower.split())
-                    common_words = title_words.intersection(bold_words)
-                    
-                    # If they share at least 2 significant words or more than 40% of words
-                    significant_match = (len(common_words) >= 2 and 
-                                       len(common_words) / max(len(title_words), len(bold_words)) > 0.4)
-                    
-                    if significant_match:
-                        print(f"DEBUG check_image_signal: Found word-based match! Dataset: {obj.get('title')}")
-                        print(f"DEBUG check_image_signal: Common words: {common_words}")
-                        match_found = True
-                
-                if match_found:
-                    if obj.get("uuid") and obj.get("image"):
-                        print(f"DEBUG check_image_signal: Dataset has image: {obj.get('image')}")
-                        image_field = obj["image"]
-                        image_urls = [s.strip() for s in image_field.split(",") if s.strip()]
-                        
-                        if not image_urls:
-                            print(f"DEBUG check_image_signal: No valid image URLs in image field")
-                            continue
-                            
-                        dataset_image_url = image_urls[-1]
-                        dataset_uuid = obj["uuid"]
-                        dataset_title = obj["title"]
-                        download_url = None
-                        wms_url = None
-                        download_formats = []
-
-                        # --- FETCH WMS/DOWNLOAD INFO HERE (ON DEMAND) ---
-                        try:
-                            wms_url = await get_wms(dataset_uuid)
-                            formats_api_response = await fetch_area_data(dataset_uuid)
-                            download_formats = formats_api_response
-                            if await dataset_has_download(dataset_uuid):
-                                standard_format = await get_standard_or_first_format(dataset_uuid)
-                                if standard_format:
-                                    download_url = await get_download_url(dataset_uuid, standard_format)
-                                    print(f"DEBUG check_image_signal: Found download URL: {download_url}")
-                        except Exception as e:
-                            print(f"DEBUG check_image_signal: Failed to get WMS/download info for {dataset_uuid}: {e}")
-                        # --- END FETCH ON DEMAND ---
-
-                        return {
-                            "uuid": dataset_uuid,
-                            "title": dataset_title,
-                            "datasetImageUrl": dataset_image_url,
-                            "downloadUrl": download_url,
-                            "wmsUrl": wms_url,
-                            "downloadFormats": download_formats
-                        }
-                    else:
-                        print(f"DEBUG check_image_signal: Dataset missing UUID or image: UUID={obj.get('uuid')}, has_image={obj.get('image') is not None}")
-    
+                    print(f"DEBUG check_image_signal: Dataset missing UUID or image: UUID={obj.get('uuid')}, has_image={obj.get('image') is not None}")
+
     # FALLBACK: If no bold titles matched but we have valid datasets with images, use the first one
     print("DEBUG check_image_signal: No matching dataset found. Trying fallback to first dataset with image")
-    for obj in dict_response:
+    for obj in datasets:
         if obj.get("uuid") and obj.get("image"):
-            print(f"DEBUG check_image_signal: Using fallback dataset: {obj.get('title')}")
-            image_field = obj["image"]
-            image_urls = [s.strip() for s in image_field.split(",") if s.strip()]
-            
-            if not image_urls:
-                continue
-                
-            dataset_image_url = image_urls[-1]
-            dataset_uuid = obj["uuid"]
-            dataset_title = obj["title"]
-            download_url = None
-            wms_url = None
-            download_formats = []
-
-            # --- FETCH WMS/DOWNLOAD INFO HERE (FALLBACK ON DEMAND) ---
-            try:
-                wms_url = await get_wms(dataset_uuid)
-                formats_api_response = await fetch_area_data(dataset_uuid)
-                download_formats = formats_api_response
-                if await dataset_has_download(dataset_uuid):
-                    standard_format = await get_standard_or_first_format(dataset_uuid)
-                    if standard_format:
-                        download_url = await get_download_url(dataset_uuid, standard_format)
-            except Exception as e:
-                print(f"DEBUG check_image_signal: Failed to get WMS/download info for fallback {dataset_uuid}: {e}")
-            # --- END FETCH ON DEMAND ---
-
-            return {
-                "uuid": dataset_uuid,
-                "title": dataset_title,
-                "datasetImageUrl": dataset_image_url,
-                "downloadUrl": download_url,
-                "wmsUrl": wms_url,
-                "downloadFormats": download_formats
-            }
+            image_url = _last_image_url(obj)
+            if image_url:
+                print(f"DEBUG check_image_signal: Using fallback dataset: {obj.get('title')}")
+                return obj, image_url
+    return None
+
+
+def select_image_dataset(gpt_response, metadata_context_list):
+    """
+    Choose the dataset shown as an image card with a response, without any network calls.
+
+    Args:
+        gpt_response: Generated text response that may contain bold titles
+        metadata_context_list: List of dataset metadata
+
+    Returns:
+        Dictionary with uuid, title and datasetImageUrl, or False if no images found
+    """
+    if not metadata_context_list:
+        print("DEBUG check_image_signal: No metadata context provided")
+        return False
+
+    field_names = ['uuid', 'title', 'abstract', 'image', 'distance']
+    dict_response = process_vdb_response(metadata_context_list, field_names)
+
+    match = find_image_dataset(gpt_response, dict_response)
+    if not match:
+        print("DEBUG check_image_signal: No datasets with images found at all")
+        return False
+
+    obj, dataset_image_url = match
+    return {
+        "uuid": obj["uuid"],
+        "title": obj["title"],
+        "datasetImageUrl": dataset_image_url,
+    }
+
+
+async def resolve_image_card(dataset_uuid, on_update):
+    """
+    Look up the WMS and download details of an image card concurrently.
+
+    The WMS capabilities and the download areas are fetched at the same time;
+    the download URL needs the areas, so it follows them. ``get_wms`` and
+    ``fetch_area_data`` share in-flight requests and cache their results, so
+    datasets whose formats were already fetched for the chat are not fetched
+    again. A fresh service catalogue row answers both without any request,
+    except the WMS of datasets the catalogue has no WMS for.
+
+    Args:
+        dataset_uuid: UUID of the dataset on the card
+        on_update: Coroutine function called with each resolved group of
+            ``insertImage`` fields (wmsUrl, downloadFormats, datasetDownloadUrl)
+    """
+    entry = (await service_catalogue.lookup([dataset_uuid])).get(dataset_uuid)
+    if entry:
+        await on_update({"downloadFormats": entry["downloadFormats"], "datasetDownloadUrl": entry["downloadUrl"]})
+        if entry["wmsStatus"] == "available":
+            await on_update({"wmsUrl": entry["wmsUrl"]})
+            return
+
+    async def resolve_wms():
+        await on_update({"wmsUrl": await get_wms(dataset_uuid)})
+
+    async def resolve_download():
+        download_formats = await fetch_area_data(dataset_uuid)
+        await on_update({"downloadFormats": download_formats})
+        if not download_formats:
+            return
+        standard_format = await get_standard_or_first_format(dataset_uuid, prefetched_area_data=download_formats)
+        if standard_format:
+            download_url = await get_download_url(dataset_uuid, standard_format)
+            print(f"DEBUG check_image_signal: Found download URL: {download_url}")
+            await on_update({"datasetDownloadUrl": download_url})
+
+    lookups = [resolve_wms()] if entry else [resolve_wms(), resolve_download()]
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"DEBUG check_image_signal: Failed to get WMS/download info for {dataset_uuid}: {result}")
+
+
+async def check_image_signal(gpt_response, metadata_context_list):
+    """
+    Check for image signals in the response and prepare image data.
     
-    print("DEBUG check_image_signal: No datasets with images found at all")
-    return False
+    Args:
+        gpt_response: Generated text response that may contain bold titles
+        metadata_context_list: List of dataset metadata
+        
+    Returns:
+        Dictionary with image data or False if no images found
+    """
+    print(f"DEBUG check_image_signal: Checking for images in response")
+
+    card = select_image_dataset(gpt_response, metadata_context_list)
+    if not card:
+        return False
+
+    resolved = {"datasetDownloadUrl": None, "wmsUrl": None, "downloadFormats": []}
+
+    async def collect(fields):
+        resolved.update(fields)
+
+    await resolve_image_card(card["uuid"], collect)
+    return {
+        **card,
+        "downloadUrl": resolved["datasetDownloadUrl"],
+        "wmsUrl": resolved["wmsUrl"],
+        "downloadFormats": resolved["downloadFormats"]
+    }
 
 
+async def _patch_image_card(dataset_uuid, websocket):
+    """Send the WMS and download fields of a card that is already shown as they resolve."""
+    async def send_update(fields):
+        await send_websocket_message("updateImageCard", {"datasetUuid": dataset_uuid, **fields}, websocket)
+
+    with span("image_card.enrichment", **{"dataset.uuid": dataset_uuid}):
+        await resolve_image_card(dataset_uuid, send_update)
+
+
+@traced("image_insertion")
 async def insert_image_rag_response(full_response, vdb_response, websocket):
     """
     Insert image data into the RAG response.
+
+    The ``insertImage`` card is sent as soon as the dataset is chosen, with
+    empty WMS and download fields. Those are looked up in the background and
+    sent as ``updateImageCard`` patches as they resolve, so the turn does not
+    wait for the Geonorge APIs. A card is sent once per response.
     
     Args:
         full_response: Complete text response from the LLM
@@ -202,7 +282,6 @@ async def insert_image_rag_response(full_response, vdb_response, websocket):
                 
                 # Get fresh metadata for this query
                 try:
-                    import asyncio
                     from helpers.vector_database import get_vdb_response
                     
                     vdb_response = await get_vdb_response(query)
@@ -214,9 +293,17 @@ async def insert_image_rag_response(full_response, vdb_response, websocket):
                 print("DEBUG insert_image_rag_response: Could not extract query from response")
                 return
         
-        # Check for image signals and get dataset info
-        dataset_info = await check_image_signal(full_response, vdb_response)
+        # Choose the dataset; its WMS and download details are patched in later
+        print(f"DEBUG check_image_signal: Checking for images in response")
+        dataset_info = select_image_dataset(full_response, vdb_response)
         if dataset_info:
+            try:
+                if _last_card_response.get(websocket) == full_response:
+                    print("DEBUG insert_image_rag_response: Image already sent for this response")
+                    return
+                _last_card_response[websocket] = full_response
+            except TypeError:
+                pass
             print(f"DEBUG insert_image_rag_response: Found dataset image, sending to websocket")
             try:
                 # Ensure all required fields are present
@@ -235,13 +322,14 @@ async def insert_image_rag_response(full_response, vdb_response, websocket):
                         "datasetUuid": dataset_info["uuid"],
                         "datasetTitle": dataset_info.get("title", ""),
                         "datasetImageUrl": dataset_info["datasetImageUrl"],
-                        "datasetDownloadUrl": dataset_info.get("downloadUrl"),  # This may be null
-                        "wmsUrl": dataset_info.get("wmsUrl"),  # This may be null
-                        "downloadFormats": dataset_info.get("downloadFormats", [])  # This may be empty list
+                        "datasetDownloadUrl": None,  # Patched in by updateImageCard
+                        "wmsUrl": None,
+                        "downloadFormats": []
                     },
                     websocket
                 )
                 print("DEBUG insert_image_rag_response: Successfully sent image message to websocket")
+                _spawn(_patch_image_card(dataset_info["uuid"], websocket))
             except Exception as e:
                 print(f"DEBUG insert_image_rag_response: Error sending image message: {e}")
                 import traceback
@@ -0,0 +1,30 @@
+"""
+Map state of each client, shared by the map workflow and the search handler.
+
+Kept apart from ``rag.map_workflow`` so the server can read a client's map
+view without importing LangGraph and the LLM clients.
+"""
+from typing import Optional, Tuple
+
+from config import CONFIG
+from helpers.spatial import map_view_bbox
+
+# websocket id -> last known map state (map_center, zoom_level, markers, ...)
+persistent_map_states = {}
+
+
+def get_map_view_bbox(websocket_id: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Get the area shown in a client's map, for restricting dataset searches to it.
+
+    Returns None when the client has no map state yet or the map is zoomed out
+    so far that the view covers most of the country.
+    """
+    if not websocket_id or websocket_id not in persistent_map_states:
+        return None
+    map_state = persistent_map_states[websocket_id]
+    center = map_state.get("map_center")
+    zoom = map_state.get("zoom_level")
+    if not center or zoom is None or zoom < CONFIG["search"]["spatial_min_zoom"]:
+        return None
+    return map_view_bbox(tuple(center), zoom)
@@ -6,16 +6,16 @@ import re
 import json
 
 from langchain_core.documents import Document
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.prompts import ChatPromptTemplate
 
 from helpers.vector_database import get_vdb_response
 from .rewrite_instructions import QUERY_REWRITE_PROMPT
-from llm import LLMManager
+from llm import chain_registry
 
-llm_manager = LLMManager()
-rewrite_llm = llm_manager.get_rewrite_llm()
+TRANSFORM_QUERY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", QUERY_REWRITE_PROMPT),
+    ("human", "{query}")
+])
 
 class GeoNorgeVectorRetriever:
     """
@@ -23,12 +23,7 @@ class GeoNorgeVectorRetriever:
     and retrieves relevant documents from the vector database.
     """
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        chain_registry.register("transform_query", TRANSFORM_QUERY_PROMPT)
 
     async def _transform_query(self, query: str) -> str:
         """Transform the user query to get better search results."""
@@ -58,15 +53,7 @@ class GeoNorgeVectorRetriever:
             
             print(f"Sanitized query: {query}")
         
-        rewrite_llm = LLMManager().get_main_llm()
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", QUERY_REWRITE_PROMPT),
-            ("human", query)
-        ])
-        
-        chain = prompt | rewrite_llm | StrOutputParser()
-        transformed_query = await chain.ainvoke({"query": query})
+        transformed_query = await chain_registry.ainvoke("transform_query", {"query": query})
         
         print(f"Transformed query: {transformed_query.strip()}")
         print("---------------------")
@@ -131,8 +118,14 @@ class GeoNorgeVectorRetriever:
             metadata=metadata
         )
 
-    async def get_relevant_documents(self, query: str) -> Tuple[List[Document], Any]:
-        """Retrieve relevant documents from the Postgres pgvector database."""
+    async def get_relevant_documents(self, query: str, view_bbox: Optional[Tuple[float, float, float, float]] = None) -> Tuple[List[Document], Any]:
+        """
+        Retrieve relevant documents from the Postgres pgvector database.
+
+        Args:
+            query: Search query
+            view_bbox: Optional (west, south, east, north) map view; datasets outside it are skipped
+        """
         try:
             # # Transform the query to improve retrieval quality
             # transformed_query = await self._transform_query(query)
@@ -142,7 +135,7 @@ class GeoNorgeVectorRetriever:
             # print("---------------------")
             
             # Query the vector database
-            vdb_response = await get_vdb_response(query)
+            vdb_response = await get_vdb_response(query, view_bbox=view_bbox)
             print(f"Vector DB returned {len(vdb_response)} results")
             
             # Add debugging for vdb_response structure
@@ -9,10 +9,15 @@ import asyncio
 import datetime
 import json
 import logging
+import os
 import requests
+import signal
+import socket
 import sys
+import threading
 import traceback
 import websockets
+from werkzeug.serving import make_server
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,7 +29,10 @@ sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 # Import config directly from project root
 from config import CONFIG
 
-from rag import get_rag_response
+from rag import get_rag_response, record_cached_exchange
+from rag.utils.history import history_manager
+from rag.utils.map_state import get_map_view_bbox
+from llm import chain_registry
 from helpers.download import (
     get_dataset_download_formats, 
     get_dataset_download_and_wms_status,
@@ -35,6 +43,15 @@ from helpers.download import (
 )
 from helpers.vector_database import get_vdb_response, get_vdb_search_response
 from helpers.websocket import send_websocket_message, send_websocket_action
+from helpers.response_cache import response_cache, recording, replay_response
+from helpers.admission import admission, client_key, send_retrieval_only_answer
+from helpers.tracing import start_trace
+from helpers import metrics
+from helpers.token_tracker import token_tracker
+from helpers.service_catalogue import harvester as service_catalogue_harvester
+from helpers.query_log import query_log
+from helpers.prewarm import prewarm, readiness
+from helpers.upstream import kartkatalog_url, upstream_url
 
 # Constants
 WMS_RETRY_TIMEOUT = 30 
@@ -54,6 +71,21 @@ class ChatServer:
     def __init__(self) -> None:
         self.clients: Set[Any] = set()
         self.client_messages: Dict[Any, List[Dict[str, Any]]] = {}
+        # Strong references keep fire-and-forget tasks alive; also reported in /metrics
+        self.background_tasks: Set[asyncio.Task] = set()
+        # Chat turns being answered; a stopping worker waits for these before closing connections
+        self.turns_in_progress = 0
+
+    def is_idle(self) -> bool:
+        """ Whether no chat turn or background task is running. """
+        return self.turns_in_progress == 0 and not self.background_tasks
+
+    def spawn(self, coro: Any) -> asyncio.Task:
+        """ Run a coroutine in the background, tracked until it finishes. """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
 
     async def register(self, websocket: Any) -> None:
         self.clients.add(websocket)
@@ -62,9 +94,18 @@ class ChatServer:
     async def unregister(self, websocket: Any) -> None:
         self.clients.remove(websocket)
         self.client_messages.pop(websocket, None)
+        history_manager.drop(str(id(websocket)))
 
     async def handle_chat_form_submit(self, websocket: Any, user_question: str) -> None:
         messages = self.client_messages.get(websocket, [])
+        self.turns_in_progress += 1
+        try:
+            with start_trace("chat.turn", session_id=str(id(websocket)), turn_id=len(messages) // 2):
+                await self._handle_chat_turn(websocket, user_question, messages)
+        finally:
+            self.turns_in_progress -= 1
+
+    async def _handle_chat_turn(self, websocket: Any, user_question: str, messages: List[Dict[str, Any]]) -> None:
         try:
             # Register the websocket directly with common.active_websockets
             from rag.utils.common import active_websockets
@@ -72,28 +113,23 @@ class ChatServer:
             active_websockets[websocket_id] = websocket
             print(f"DEBUG server: Directly registered websocket with ID {websocket_id} in common.active_websockets")
             print(f"DEBUG server: Active websockets now: {list(active_websockets.keys())}")
-            
-            vdb_response = await get_vdb_response(user_question)
-            
-            # Get only download formats for each dataset in vdb_response
-            datasets_with_formats = []
-            if vdb_response:
-                datasets_with_formats = await get_dataset_download_formats(vdb_response)
-            
-            # await send_websocket_message(Action.USER_MESSAGE.value, user_question, websocket)
-
-            # Send RAG request with streaming
-            full_rag_response = await get_rag_response(
-                user_question,
-                datasets_with_formats, 
-                vdb_response,
-                websocket
-            )
-            
-            if datasets_with_formats:
-                await send_websocket_message(Action.CHAT_DATASETS.value, datasets_with_formats, websocket)
-            
-    
+            query_log.record(user_question)
+
+            # Repeated questions are replayed from the semantic response cache
+            has_history = bool(messages)
+            # The chat search is restricted to the map view, so answers are only shared within the same view
+            view_bbox = get_map_view_bbox(websocket_id)
+            cached_response = await response_cache.lookup(user_question, has_history, view_bbox)
+            if cached_response is not None:
+                print(f"DEBUG server: Answering from response cache (cached question: {cached_response.question[:50]})")
+                datasets_with_formats = cached_response.chat_datasets or []
+                full_rag_response = await replay_response(cached_response, websocket)
+                await record_cached_exchange(user_question, full_rag_response, websocket)
+            else:
+                with recording(websocket) as recorder:
+                    datasets_with_formats, full_rag_response = await self._generate_answer(websocket, user_question)
+                await response_cache.store(recorder, user_question, has_history, view_bbox)
+
             # Add messages to history with timestamp and exchange_id
             timestamp = datetime.datetime.now().isoformat()
             exchange_id = len(messages) // 2
@@ -121,6 +157,36 @@ class ChatServer:
             logger.error("Stack trace: %s", traceback.format_exc())
             await send_websocket_action(Action.STREAM_COMPLETE.value, websocket)
 
+    async def _generate_answer(self, websocket: Any, user_question: str) -> Tuple[List[Dict[str, Any]], str]:
+        """ Run the RAG pipeline for a question, streaming the answer and sending its datasets. """
+        vdb_response = await get_vdb_response(user_question)
+
+        # Get only download formats for each dataset in vdb_response
+        datasets_with_formats = []
+        if vdb_response:
+            datasets_with_formats = await get_dataset_download_formats(vdb_response)
+
+        # await send_websocket_message(Action.USER_MESSAGE.value, user_question, websocket)
+
+        # Send RAG request with streaming, once admitted; when the LLM pipeline is saturated
+        # the datasets found are sent without an LLM answer
+        async with admission.admit(client_key(websocket), websocket) as admitted:
+            if admitted:
+                full_rag_response = await get_rag_response(
+                    user_question,
+                    datasets_with_formats,
+                    vdb_response,
+                    websocket
+                )
+            else:
+                full_rag_response = await send_retrieval_only_answer(vdb_response, websocket)
+                await record_cached_exchange(user_question, full_rag_response, websocket)
+
+        if datasets_with_formats:
+            await send_websocket_message(Action.CHAT_DATASETS.value, datasets_with_formats, websocket)
+
+        return datasets_with_formats, full_rag_response
+
     async def _retry_and_send_wms_update(self, websocket: Any, uuid: str, wms_capabilities_url: str, title: str) -> None:
         """ Background task to retry fetching WMS capabilities with a longer timeout and send an update. """
         try:
@@ -157,9 +223,15 @@ class ChatServer:
             websocket: The client websocket connection.
             query: The search query submitted by the user.
         """
+        with start_trace("search", session_id=str(id(websocket)), **{"search.query": query}):
+            await self._handle_search(websocket, query)
+
+    async def _handle_search(self, websocket: Any, query: str) -> None:
         try:
+            query_log.record(query)
             # 1. Initial Fetch (using short WMS timeout internally)
-            vdb_search_response = await get_vdb_search_response(query)
+            view_bbox = get_map_view_bbox(str(id(websocket)))
+            vdb_search_response = await get_vdb_search_response(query, view_bbox=view_bbox)
             datasets_with_status = await get_dataset_download_and_wms_status(vdb_search_response)
             
             # 2. Send Initial Results Immediately
@@ -177,7 +249,7 @@ class ChatServer:
                     if uuid and url and title:
                         logger.info(f"Scheduling background WMS retry for {uuid} ({title})")
                         # Launch the retry task without awaiting it
-                        asyncio.create_task(self._retry_and_send_wms_update(websocket, uuid, url, title))
+                        self.spawn(self._retry_and_send_wms_update(websocket, uuid, url, title))
                     else:
                         logger.warning(f"Skipping WMS retry for dataset due to missing info: {dataset}")
 
@@ -204,7 +276,7 @@ class ChatServer:
                 return
                 
             elif action == Action.SEARCH_FORM_SUBMIT.value:
-                asyncio.create_task(self.handle_search_form_submit(websocket, data["payload"]))
+                self.spawn(self.handle_search_form_submit(websocket, data["payload"]))
                 return
                 
             elif action == Action.SHOW_DATASET.value:                
@@ -253,7 +325,7 @@ async def _fetch_wms_capabilities(wms_url: str) -> Optional[Dict[str, Any]]:
     try:
         # Run blocking requests call in executor
         loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(None, lambda: requests.get(wms_url, timeout=10))
+        response = await loop.run_in_executor(None, lambda: requests.get(upstream_url(wms_url), timeout=10))
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         
         # Run blocking XML parsing in executor
@@ -307,6 +379,12 @@ def get_wms_info():
     except ElementTree.ParseError:
         return jsonify({"error": "Failed to parse WMS XML response"}), 500
 
+# Add LLM chain statistics endpoint
+@app.route('/llm-stats', methods=['GET'])
+def get_llm_stats():
+    """ Return per-chain call counts, latencies and token usage """
+    return jsonify(chain_registry.get_stats())
+
 # Add Download Dataset Endpoint
 @app.route('/download-dataset', methods=['POST'])
 def download_dataset_endpoint():
@@ -534,7 +612,7 @@ def search_http_endpoint():
 
     logger.info(f"Received HTTP search request for term: '{term}'")
     limit = 20 # Keep limit consistent with frontend
-    geonorge_api_url = f"https://kartkatalog.geonorge.no/api/search?text={requests.utils.quote(term)}&facets[1]name=type&facets[1]value=dataset&limit={limit}"
+    geonorge_api_url = kartkatalog_url(f"/api/search?text={requests.utils.quote(term)}&facets[1]name=type&facets[1]value=dataset&limit={limit}")
 
     try:
         # --- Step 1: Call Geonorge Search API ---
@@ -697,17 +775,111 @@ def search_http_endpoint():
         logger.error(traceback.format_exc())
         return jsonify({"error": "An unexpected server error occurred during search."}), 500
 
-def run_flask():
-    """Run Flask in a separate thread"""
-    host = CONFIG.get("server", {}).get("host", "0.0.0.0") # Bind to all interfaces
-    http_port = CONFIG.get("server", {}).get("http_port", 5000)
-    app.run(host=host, port=http_port, debug=False, use_reloader=False)
+def register_server_metrics(server: ChatServer) -> None:
+    """ Expose ChatServer and supervisor state as gauges in /metrics. """
+    from rag.response_handlers import supervisor_sessions
+
+    metrics.gauge_callback("geogpt_websockets_active", "Open WebSocket connections", lambda: len(server.clients))
+    metrics.gauge_callback(
+        "geogpt_sessions_active", "Conversation sessions held in memory by component",
+        lambda: {
+            "supervisor": supervisor_sessions(),
+            "history": len(history_manager._sessions),
+        },
+        ["component"],
+    )
+    metrics.gauge_callback(
+        "geogpt_background_tasks", "Background tasks still running by kind",
+        lambda: {
+            "chat_server": len(server.background_tasks),
+            "history_summary": history_manager.pending_summaries(),
+        },
+        ["kind"],
+    )
+    metrics.gauge_callback("geogpt_chat_turns_in_progress", "Chat turns being answered",
+                           lambda: server.turns_in_progress)
+
+def http_response(connection: Any, status: int, body: str, content_type: str) -> Any:
+    """ Build a plain HTTP response from process_request for either websockets server implementation. """
+    if hasattr(connection, "respond"):
+        response = connection.respond(status, body)
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = content_type
+        return response
+    return (status, websockets.datastructures.Headers([("Content-Type", content_type)]), body.encode("utf-8"))
+
+def metrics_response(connection: Any) -> Any:
+    """ Build the /metrics response. """
+    return http_response(connection, 200, metrics.render(), metrics.CONTENT_TYPE)
+
+def ready_response(connection: Any) -> Any:
+    """ Build the /ready response: 200 once the startup warm-up is done, 503 before. """
+    return http_response(connection, 200 if readiness.ready else 503,
+                         readiness.response_body().decode("utf-8"), "application/json")
+
+def reuse_port_socket(host: str, port: int) -> socket.socket:
+    """ A listening socket that other worker processes can bind to as well (SO_REUSEPORT). """
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+def start_flask() -> Any:
+    """
+    Serve the Flask app from a daemon thread.
+
+    Returns:
+        The werkzeug server; call ``shutdown()`` on it to stop serving
+    """
+    server_config = CONFIG["server"]
+    host, http_port = server_config["host"], server_config["http_port"]
+    fd = None
+    if server_config["reuse_port"]:
+        fd = reuse_port_socket(host, http_port).detach()
+    http_server = make_server(host, http_port, app, threaded=True, fd=fd)
+    threading.Thread(target=http_server.serve_forever, name="flask", daemon=True).start()
+    logger.info("HTTP server running on http://%s:%s", host, http_port)
+    return http_server
+
+def notify_launcher_ready() -> None:
+    """ Tell launcher.py that this worker has warmed up, through the pipe it passed in GEOGPT_READY_FD. """
+    fd = os.environ.pop("GEOGPT_READY_FD", None)
+    if not fd:
+        return
+    try:
+        os.write(int(fd), b"ready\n")
+        os.close(int(fd))
+    except OSError as e:
+        logger.warning(f"Could not report readiness to the launcher: {e}")
+
+async def drain(ws_server: Any, server: ChatServer) -> None:
+    """
+    Stop accepting connections and close the open ones once their chat turns are answered.
+
+    Waits at most ``drain_timeout`` seconds. Clients are closed with 1012
+    (service restart) and reconnect to another worker.
+    """
+    loop = asyncio.get_running_loop()
+    ws_server.server.close()
+    deadline = loop.time() + CONFIG["server"]["drain_timeout"]
+    logger.info(f"Draining {len(server.clients)} connections, {server.turns_in_progress} chat turns in progress")
+    while not server.is_idle() and loop.time() < deadline:
+        await asyncio.sleep(0.5)
+    if not server.is_idle():
+        logger.warning(f"Drain timed out with {server.turns_in_progress} chat turns in progress")
+    ws_server.close(code=1012, reason="Server restarting")
+    await ws_server.wait_closed()
 
 async def main() -> None:
     """
     Initialize and run both the WebSocket server and Flask app
     """
     server = ChatServer()
+    # Image cards are enriched after the turn has been answered; a drain waits for that too
+    from rag.utils.image_processor import set_task_spawner
+    set_task_spawner(server.spawn)
     host = CONFIG.get("server", {}).get("host", "0.0.0.0") # Bind to all interfaces
     ws_port = CONFIG.get("server", {}).get("port", 8080)
 
@@ -719,9 +891,17 @@ async def main() -> None:
         "http://geogpt.geokrs.no"
     ]
     logger.info(f"Allowed WebSocket origins: {allowed_origins}")
+    register_server_metrics(server)
 
     async def process_request(path: str, request_headers: websockets.Headers) -> Optional[Tuple[int, websockets.Headers, bytes]]:
         """Handles CORS preflight requests and checks origin for WebSocket connections."""
+
+        # Prometheus scrapes and readiness probes are served here, on the event loop, without an Origin header
+        request_path = getattr(request_headers, "path", path)
+        if isinstance(request_path, str) and request_path.split("?")[0] == "/metrics":
+            return metrics_response(path)
+        if isinstance(request_path, str) and request_path.split("?")[0] == "/ready":
+            return ready_response(path)
         
         actual_headers = None
         if hasattr(request_headers, 'get'): # Check if it behaves like a dict/Headers object
@@ -757,22 +937,63 @@ async def main() -> None:
         logger.debug(f"Allowing GET request from allowed origin: {origin}")
         return None # Let websockets library handle the handshake
 
-    # Start WebSocket server with CORS handling
+    # Start WebSocket server with CORS handling; workers started by launcher.py share the port
+    reuse_port = CONFIG["server"]["reuse_port"]
     ws_server = await websockets.serve(
         server.ws_handler,
         host,
         ws_port,
         compression=None,
-        process_request=process_request
+        process_request=process_request,
+        reuse_port=reuse_port,
     )
     logger.info("WebSocket server running on ws://%s:%s", host, ws_port)
 
-    # Start Flask server in a separate thread
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, run_flask)
+    # With several workers a scrape of the shared port reaches any one of them; each also has its own port
+    metrics_server = None
+    metrics_port = CONFIG["server"]["metrics_port"]
+    if metrics_port:
+        async def process_metrics_request(path: str, request_headers: websockets.Headers) -> Any:
+            request_path = getattr(request_headers, "path", path)
+            if isinstance(request_path, str) and request_path.split("?")[0] == "/ready":
+                return ready_response(path)
+            return metrics_response(path)
 
-    # Keep the WebSocket server running
-    await ws_server.wait_closed()
+        # The worker replacing this one during a rolling restart binds the same port
+        metrics_server = await websockets.serve(server.ws_handler, host, metrics_port,
+                                                process_request=process_metrics_request, reuse_port=reuse_port)
+        logger.info("Metrics of this worker on http://%s:%s/metrics", host, metrics_port)
+
+    # Token usage is kept in memory and written to SQLite in the background
+    token_tracker.start()
+
+    # Keep the download/WMS details of all datasets fresh in the service catalogue
+    service_catalogue_harvester.start()
+
+    # Questions are counted for warming; /ready answers 503 until the warm-up is done
+    query_log.start()
+    warmup_task = asyncio.create_task(prewarm())
+    warmup_task.add_done_callback(lambda _: notify_launcher_ready())
+
+    # Start Flask server in a separate thread
+    http_server = start_flask()
+
+    # SIGTERM (launcher.py, docker stop) lets running chat turns finish before the worker exits
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    logger.info("Shutting down")
+    warmup_task.cancel()
+    await drain(ws_server, server)
+    if metrics_server is not None:
+        metrics_server.close()
+    http_server.shutdown()
+    await service_catalogue_harvester.stop()
+    await query_log.stop()
+    await token_tracker.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -23,6 +23,26 @@ CREATE TABLE if not exists text_embedding_3_large
     metadatacreationdate TEXT,
     productInformation   TEXT,
     parentId             TEXT,        -- Assuming parentId is a UUID referencing another entity
-    title_vector         vector(3072) -- pgvector column with 3072 dimensions
+    title_vector         vector(3072), -- pgvector column with 3072 dimensions
+    bbox                 box,         -- geoBox parsed to (west, south)/(east, north) in lon/lat
+    search_tsv           tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('norwegian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('norwegian', coalesce(keyword, '')), 'B') ||
+        setweight(to_tsvector('norwegian', coalesce(abstract, '')), 'C')
+    ) STORED                          -- full-text branch of hybrid search
 );
 
+-- Tables created before hybrid search get the full-text column on the next run
+ALTER TABLE text_embedding_3_large ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('norwegian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('norwegian', coalesce(keyword, '')), 'B') ||
+    setweight(to_tsvector('norwegian', coalesce(abstract, '')), 'C')
+) STORED;
+
+-- Lets searches filter on the current map view (bbox && box) before vector ranking
+CREATE INDEX if not exists text_embedding_3_large_bbox_idx
+    ON text_embedding_3_large USING gist (bbox);
+
+-- Full-text lookups for acronyms and exact titles (FKB, N50, DTM10) that embed poorly
+CREATE INDEX if not exists text_embedding_3_large_search_tsv_idx
+    ON text_embedding_3_large USING gin (search_tsv);
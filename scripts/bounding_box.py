@@ -0,0 +1,82 @@
+"""
+Tolking av boundingBox-feltet fra Geonorge-metadata.
+
+Feltet er lagret som kommaseparert tekst i rekkefølgen vest, øst, sør, nord,
+men desimalene bruker også komma ("2,00,33,00,57,00,72,00"), og antall
+desimaler varierer fra datasett til datasett ("2,33,57,72", "1,37,58,5,81,75").
+Vi prøver derfor alle måter å gruppere tokenene i fire tall på, beholder
+gyldige bokser og velger den mest sannsynlige.
+"""
+import itertools
+
+# Metadata i katalogen gjelder i praksis Norge og havområdene rundt
+PLAUSIBLE_MIN_LATITUDE = 45.0
+
+
+def _to_number(tokens):
+    if len(tokens) == 1:
+        return float(tokens[0])
+    integer, decimals = tokens
+    if not decimals.isdigit():
+        raise ValueError(f"Ugyldig desimaldel: {decimals}")
+    return float(f"{integer}.{decimals}")
+
+
+def _groupings(tokens):
+    """Alle måter å dele tokenene i fire tall på, der hvert tall er ett eller to tokens."""
+    extra = len(tokens) - 4
+    if extra < 0 or extra > 4:
+        return
+    for two_token_positions in itertools.combinations(range(4), extra):
+        numbers = []
+        index = 0
+        try:
+            for position in range(4):
+                width = 2 if position in two_token_positions else 1
+                numbers.append(_to_number(tokens[index:index + width]))
+                index += width
+        except ValueError:
+            continue
+        yield tuple(numbers)
+
+
+def _is_valid(west, east, south, north):
+    return (
+        -180 <= west <= east <= 180
+        and -90 <= south <= north <= 90
+    )
+
+
+def parse_bounding_box(raw):
+    """
+    Tolk et boundingBox-felt til (vest, sør, øst, nord).
+
+    Når flere tolkninger er gyldige, foretrekkes bokser med breddegrader i
+    Norges-området, og deretter den største boksen, slik at et romlig filter
+    heller tar med et datasett for mye enn ett for lite.
+
+    Returnerer None hvis feltet er tomt eller ikke kan tolkes.
+    """
+    if not raw:
+        return None
+    tokens = [token.strip() for token in str(raw).split(",") if token.strip()]
+
+    candidates = []
+    for west, east, south, north in _groupings(tokens):
+        if not _is_valid(west, east, south, north):
+            continue
+        plausible = south >= PLAUSIBLE_MIN_LATITUDE
+        area = (east - west) * (north - south)
+        candidates.append(((plausible, area), (west, south, east, north)))
+
+    if not candidates:
+        return None
+    return max(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def to_pg_box(bbox):
+    """Formater (vest, sør, øst, nord) som en PostgreSQL box-literal (x = lengdegrad, y = breddegrad)."""
+    if bbox is None:
+        return None
+    west, south, east, north = bbox
+    return f"(({east},{north}),({west},{south}))"
@@ -0,0 +1,114 @@
+"""
+Bygger stedsnavnfilen som brukes av gazetteer-modulen i geonorge-server
+(helpers/gazetteer.py) fra en nedlastet SSR/Stedsnavn-eksport.
+
+Støtter GeoJSON FeatureCollection og GeoJSON med én feature per linje
+(.geojsonl/.ndjson). Koordinatene må være geografiske (EPSG:4258/4326).
+
+Bruk:
+    python build_gazetteer.py <stedsnavn.geojson> [utfil.csv]
+"""
+import csv
+import json
+import os
+import sys
+
+DEFAULT_OUTPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "geonorge-server", "src", "data", "stedsnavn.csv"
+)
+
+NAME_KEYS = ("skrivemåte", "skrivemate", "stedsnavn", "navn", "name")
+TYPE_KEYS = ("navneobjekttype", "navneobjektType", "type")
+MUNICIPALITY_KEYS = ("kommunenavn", "kommune", "kommuner", "municipality")
+POPULATION_KEYS = ("folketall", "innbyggere", "population")
+
+
+def first_value(properties, keys):
+    """Hent første ikke-tomme verdi for en av nøklene, også fra lister med objekter."""
+    for key in keys:
+        value = properties.get(key)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if isinstance(value, dict):
+            value = first_value(value, keys + NAME_KEYS)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def safe_int(value):
+    try:
+        return int(str(value).replace(" ", ""))
+    except (TypeError, ValueError):
+        return 0
+
+
+def representative_point(geometry):
+    """Returner (lon, lat) for et punkt, eller første koordinat for andre geometrier."""
+    if not geometry:
+        return None
+    coords = geometry.get("coordinates")
+    while isinstance(coords, list) and coords and isinstance(coords[0], list):
+        coords = coords[0]
+    if not coords or len(coords) < 2:
+        return None
+    return float(coords[0]), float(coords[1])
+
+
+def iter_features(path):
+    """Les features fra en FeatureCollection eller fra en fil med én feature per linje."""
+    if path.endswith((".geojsonl", ".ndjson", ".jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data.get("features", [])
+
+
+def build_gazetteer(input_path, output_path):
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    written = 0
+    skipped = 0
+
+    with open(output_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out, delimiter=";")
+        writer.writerow(["name", "lat", "lon", "type", "municipality", "population"])
+
+        for feature in iter_features(input_path):
+            properties = feature.get("properties") or {}
+            name = first_value(properties, NAME_KEYS)
+            point = representative_point(feature.get("geometry"))
+            if not name or not point:
+                skipped += 1
+                continue
+
+            lon, lat = point
+            if abs(lon) > 180 or abs(lat) > 90:
+                print("❌ Koordinatene ser ut til å være projiserte (f.eks. UTM). Eksporter med EPSG:4258 eller EPSG:4326.")
+                sys.exit(1)
+
+            writer.writerow([
+                str(name).strip(),
+                f"{lat:.6f}",
+                f"{lon:.6f}",
+                str(first_value(properties, TYPE_KEYS) or "").strip().lower(),
+                str(first_value(properties, MUNICIPALITY_KEYS) or "").strip(),
+                safe_int(first_value(properties, POPULATION_KEYS)),
+            ])
+            written += 1
+            if written % 100000 == 0:
+                print(f"📍 {written} stedsnavn skrevet...")
+
+    print(f"✅ Skrev {written} stedsnavn til {output_path} ({skipped} hoppet over)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    build_gazetteer(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else DEFAULT_OUTPUT)
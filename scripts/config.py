@@ -22,5 +22,30 @@ CONFIG = {
         "azure_embedding_api_key": os.getenv("AZURE_EMBEDDING_API_KEY", ""),
         "azure_embeddings_endpoint": os.getenv("AZURE_EMBEDDING_BASEURL", ""),
         "azure_gpt_api_key": os.getenv("AZURE_GPT_API_KEY", "")
+    },
+    "embedding": {
+        # "azure" eller "local" (deterministiske vektorer uten nettverk, for utvikling og CI).
+        # Må være den samme som serveren bruker, ellers kan ikke søket matche vektorene.
+        "provider": os.getenv("EMBEDDING_PROVIDER", "azure").lower(),
+        # Vektorstørrelse fra den lokale leverandøren, må passe med vector-kolonnene
+        "dimensions": int(os.getenv("EMBEDDING_DIMENSIONS", "3072")),
+        "api_url": os.getenv(
+            "AZURE_EMBEDDING_URL",
+            "https://kartai-openai.openai.azure.com/openai/deployments/text-embedding-3-large/embeddings?api-version=2023-05-15"
+        ),
+        # Kvoten for deploymenten i Azure (forespørsler og tokens per minutt)
+        "requests_per_minute": int(os.getenv("EMBEDDING_RPM", "600")),
+        "tokens_per_minute": int(os.getenv("EMBEDDING_TPM", "350000")),
+        # Maks tokens og tekster per forespørsel
+        "max_batch_tokens": int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "16000")),
+        "max_batch_size": int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "256")),
+        # Antall batcher som er i gang samtidig
+        "concurrency": int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+        "max_retries": int(os.getenv("EMBEDDING_MAX_RETRIES", "5")),
+    },
+    "vectors": {
+        # Antall dimensjoner i den kompakte halfvec-kopien av combined_text_vector
+        # (Matryoshka-avkorting av text-embedding-3-large). 0 slår den av.
+        "compact_dimensions": int(os.getenv("COMPACT_VECTOR_DIMENSIONS", "1024")),
     }
 }
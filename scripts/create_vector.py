@@ -1,12 +1,11 @@
+import asyncio
 import os
 import sys
-from aiohappyeyeballs import start_connection
 import pandas as pd
-import requests
 import json
 import config
 import socket
-import time
+from embedding_pipeline import EmbeddingPipeline, content_hash, use_local_embeddings
 
 # Correct API URL format using the correct domain
 BASE_URL = config.CONFIG["api"]["azure_embeddings_endpoint"] or os.environ.get("AZURE_EMBEDDING_URL") or os.environ.get("AZURE_EMBEDDING_ENDPOINT")
@@ -40,60 +39,16 @@ def test_connection():
         print(f"Connection test failed: {e}")
         return False
 
-def fetch_embeddings(texts, model=MODEL, batch_size=10):
-    headers = {
-        "api-key": f"{API_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    all_embeddings = []
-
-    total_batches = (len(texts) + batch_size - 1) // batch_size
-    print(f"🔄 Totalt {total_batches} batcher skal behandles...")
-
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        current_batch = (i // batch_size) + 1
-        print(f"📦 Behandler batch {current_batch}/{total_batches} (rader {i}-{i + len(batch) - 1})...")
-
-        data = {"model": model, "input": batch}
-
-        # Prøv å hente embeddings – vent til vi får et svar som ikke er 429
-        while True:
-            try:
-                response = requests.post(API_URL, headers=headers, json=data)
-            except Exception as e:
-                print(f"❌ Feil i batch {current_batch}: {e}. Venter 5 sekunder og prøver på nytt...")
-                time.sleep(5)
-                continue
-
-            if response.status_code == 429:
-                # Bruk eventuelt "Retry-After" header for ventetid, ellers 5 sekunder som fallback
-                wait_time = int(response.headers.get("Retry-After", 5))
-                print(f"⏳ Fikk 429 Too Many Requests – venter i {wait_time} sekunder før ny forespørsel...")
-                time.sleep(wait_time)
-                continue
-            else:
-                # Fikk et svar som ikke er 429, avslutt while-løkken
-                break
-
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            print(f"❌ Feil i batch {current_batch} etter retries: {e}")
-            continue
-
-        result = response.json()
-
-        if "data" not in result:
-            print(f"❌ API-respons mangler 'data': {response.text}")
-            continue
-
-        all_embeddings.extend(result["data"])
-        print(f"✅ Ferdig med batch {current_batch}: Totalt embeddings hentet: {len(all_embeddings)}")
-        time.sleep(0.5)  # Hjelper med å unngå rate limit
-
-    return {"data": all_embeddings}
+def fetch_embeddings(texts, model=MODEL):
+    """
+    Hent embeddings for alle tekstene via den asynkrone pipelinen i embedding_pipeline.py.
+
+    Returnerer {"data": [{"embedding": ...}, ...]} i samme rekkefølge som ``texts``.
+    Kaster EmbeddingPipelineError hvis noen batcher feiler, slik at vektorene aldri
+    forskyves i forhold til radene.
+    """
+    embeddings = EmbeddingPipeline(api_url=API_URL, api_key=API_KEY).embed(texts)
+    return {"data": [{"embedding": embedding} for embedding in asyncio.run(embeddings)]}
 
 def process_csv(file_path, output_path, columns_to_combine):
     """
@@ -111,6 +66,7 @@ def process_csv(file_path, output_path, columns_to_combine):
 
         # Legg til 'title_vector' i DataFrame
         df['title_vector'] = [json.dumps(e['embedding']) for e in title_embeddings['data']]
+        df['title_hash'] = [content_hash(title) for title in titles]
 
         # Hent embeddings for kombinerte tekster (hvis nødvendig)
         combined_texts = df['combined_text'].tolist()
@@ -118,6 +74,7 @@ def process_csv(file_path, output_path, columns_to_combine):
 
         # Legg til 'combined_text_vector' i DataFrame
         df['combined_text_vector'] = [json.dumps(e['embedding']) for e in combined_embeddings['data']]
+        df['combined_text_hash'] = [content_hash(text) for text in combined_texts]
 
         # Lagre ny CSV
         df.to_csv(output_path, sep='|', index=False)
@@ -139,8 +96,8 @@ if __name__ == "__main__":
         if not os.path.exists(input_file):
             raise FileNotFoundError(f"Input file not found: {input_file}")
 
-        # Test connection
-        if not test_connection():
+        # Test connection (lokale embeddings trenger ikke Azure)
+        if not use_local_embeddings() and not test_connection():
             raise ConnectionError("Failed to establish connection to Azure API")
 
         # Process the CSV
@@ -0,0 +1,322 @@
+"""
+Asynkron innhenting av embeddings fra Azure OpenAI for ingest-skriptene.
+
+- Tekstene deles i batcher etter antall tokens (tiktoken), ikke antall rader.
+- En token bucket for forespørsler (RPM) og en for tokens (TPM) holder oss
+  innenfor Azure-kvoten, så vi slipper å vente på 429-svar.
+- Flere batcher er i gang samtidig, og resultatene settes sammen i samme
+  rekkefølge som tekstene.
+- Batcher som feiler legges i en retry-kø. Hvis en batch fortsatt feiler etter
+  siste forsøk, kastes en feil i stedet for å returnere vektorer som ikke
+  lenger stemmer med radene.
+
+Med EMBEDDING_PROVIDER=local lages vektorene lokalt av
+geonorge-server/src/helpers/local_embeddings.py i stedet, uten nettverk og
+API-nøkkel, slik at ingest kan kjøres mot pgvector-containeren på en laptop.
+
+Bruk:
+    from embedding_pipeline import embed_texts
+    vectors = embed_texts(texts)
+"""
+import asyncio
+import hashlib
+import importlib.util
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import aiohttp
+import tiktoken
+
+import config
+
+MODEL = "text-embedding-3-large"
+# Modellnavnet til den lokale leverandøren (samme som LocalEmbeddingProvider.model på serveren)
+LOCAL_MODEL = "local-hashed-bow"
+# Lengste input text-embedding-3-large godtar
+MAX_INPUT_TOKENS = 8191
+# Der helpers/local_embeddings.py ligger: i repoet og i backend-imaget (/app/src)
+SERVER_SRC_DIRS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geonorge-server", "src"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+]
+
+_local_embeddings = None
+
+
+def use_local_embeddings() -> bool:
+    return config.CONFIG["embedding"]["provider"] == "local"
+
+
+def embedding_model() -> str:
+    """Navnet på modellen som lager vektorene med gjeldende EMBEDDING_PROVIDER."""
+    return LOCAL_MODEL if use_local_embeddings() else MODEL
+
+
+def load_local_embeddings():
+    """Last serverens helpers/local_embeddings.py, så ingest og søk lager identiske vektorer."""
+    global _local_embeddings
+    if _local_embeddings is None:
+        for directory in SERVER_SRC_DIRS:
+            path = os.path.join(directory, "helpers", "local_embeddings.py")
+            if os.path.exists(path):
+                spec = importlib.util.spec_from_file_location("local_embeddings", path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                _local_embeddings = module
+                break
+        else:
+            raise ImportError("Fant ikke helpers/local_embeddings.py i geonorge-server/src")
+    return _local_embeddings
+
+
+def content_hash(text) -> str:
+    """
+    Hash av teksten som embeddes, lagret ved siden av vektoren.
+
+    Modellnavnet inngår, så et modellbytte (også til/fra lokale embeddings)
+    gjør alle lagrede vektorer utdaterte.
+    """
+    text = text if isinstance(text, str) else ""
+    return hashlib.sha256(f"{embedding_model()}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingPipelineError(Exception):
+    """En eller flere batcher kunne ikke embeddes etter alle forsøk."""
+
+
+class RateLimited(Exception):
+    """API-et svarte 429; ``retry_after`` er ventetiden det ba om."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"429 Too Many Requests, Retry-After {retry_after}s")
+        self.retry_after = retry_after
+
+
+class BatchTooLarge(Exception):
+    """API-et avviste batchen (400), typisk fordi den inneholder for mange tokens."""
+
+
+class TokenBucket:
+    """
+    Token bucket som fylles kontinuerlig med ``per_minute / 60`` per sekund.
+
+    ``burst`` begrenser hvor mye som kan brukes på en gang; Azure håndhever
+    kvoten over korte vinduer, så vi tillater ikke et helt minutts kvote i ett rykk.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1.0, per_minute / 6.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # Større forespørsler enn bøtta rommer må fortsatt slippe gjennom
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate)
+                self._refill()
+            self.level -= amount
+
+    def pause(self, seconds: float):
+        """Tøm bøtta slik at neste forespørsel venter minst ``seconds`` (brukes ved 429)."""
+        self.level = min(self.level, -seconds * self.rate)
+        self.updated = time.monotonic()
+
+
+@dataclass
+class Batch:
+    start: int
+    texts: List[str]
+    tokens: int
+    attempt: int = 0
+
+
+class EmbeddingPipeline:
+    """
+    Henter embeddings for mange tekster med flere samtidige batcher innenfor RPM/TPM-kvoten.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ):
+        settings = config.CONFIG["embedding"]
+        self.api_url = api_url
+        self.api_key = api_key
+        self.max_batch_tokens = max_batch_tokens or settings["max_batch_tokens"]
+        self.max_batch_size = max_batch_size or settings["max_batch_size"]
+        self.concurrency = concurrency or settings["concurrency"]
+        self.max_retries = max_retries if max_retries is not None else settings["max_retries"]
+        self.request_bucket = TokenBucket(requests_per_minute or settings["requests_per_minute"])
+        self.token_bucket = TokenBucket(tokens_per_minute or settings["tokens_per_minute"])
+        self.local = use_local_embeddings()
+        self.dimensions = settings["dimensions"]
+
+        if self.local:
+            # Ingen forespørsler og ingen kvote, så tokens trenger ikke telles
+            self.encoder = None
+        else:
+            try:
+                self.encoder = tiktoken.encoding_for_model(MODEL)
+            except KeyError:
+                self.encoder = tiktoken.get_encoding("cl100k_base")
+
+    def _prepare(self, text) -> tuple:
+        """Returner (tekst, antall tokens); tomme tekster erstattes og for lange kuttes."""
+        text = text if isinstance(text, str) and text.strip() else " "
+        tokens = self.encoder.encode(text)
+        if len(tokens) > MAX_INPUT_TOKENS:
+            tokens = tokens[:MAX_INPUT_TOKENS]
+            text = self.encoder.decode(tokens)
+        return text, len(tokens)
+
+    def make_batches(self, texts: List[str]) -> List[Batch]:
+        """Del tekstene i sammenhengende batcher begrenset av tokens og antall."""
+        batches = []
+        current: List[str] = []
+        current_tokens = 0
+        start = 0
+        for index, raw_text in enumerate(texts):
+            text, tokens = self._prepare(raw_text)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(Batch(start, current, current_tokens))
+                current, current_tokens, start = [], 0, index
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(Batch(start, current, current_tokens))
+        return batches
+
+    async def _post(self, session: aiohttp.ClientSession, batch: Batch) -> List[List[float]]:
+        await self.request_bucket.acquire()
+        await self.token_bucket.acquire(batch.tokens)
+        headers = {"api-key": self.api_key, "Content-Type": "application/json"}
+        async with session.post(self.api_url, headers=headers, json={"model": MODEL, "input": batch.texts}) as response:
+            if response.status == 429:
+                retry_after = float(response.headers.get("Retry-After", 5))
+                self.request_bucket.pause(retry_after)
+                self.token_bucket.pause(retry_after)
+                raise RateLimited(retry_after)
+            if response.status == 400 and len(batch.texts) > 1:
+                raise BatchTooLarge(await response.text())
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+            result = await response.json()
+
+        data = result.get("data")
+        if not data or len(data) != len(batch.texts):
+            raise RuntimeError(f"Forventet {len(batch.texts)} embeddings, fikk {len(data or [])}")
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    async def _worker(self, session, queue: asyncio.Queue, results: list, failed: List[Batch], progress: dict):
+        while True:
+            batch = await queue.get()
+            try:
+                embeddings = await self._post(session, batch)
+                results[batch.start:batch.start + len(embeddings)] = embeddings
+                progress["done"] += len(embeddings)
+                print(f"✅ {progress['done']}/{progress['total']} embeddings hentet")
+            except BatchTooLarge:
+                # Splitt batchen i to og prøv delene hver for seg
+                middle = len(batch.texts) // 2
+                for part_start, part in ((0, batch.texts[:middle]), (middle, batch.texts[middle:])):
+                    tokens = sum(len(self.encoder.encode(text)) for text in part)
+                    queue.put_nowait(Batch(batch.start + part_start, part, tokens, batch.attempt))
+                print(f"✂️ Batch fra rad {batch.start} ble avvist, deler den i to")
+            except RateLimited as e:
+                # 429 er flytkontroll og teller ikke som et mislykket forsøk
+                print(f"⏳ Batch fra rad {batch.start} ble begrenset, prøver igjen om {e.retry_after:.1f}s")
+                progress["pending_retries"] += 1
+                asyncio.create_task(self._requeue(queue, batch, e.retry_after, progress))
+            except Exception as e:
+                batch.attempt += 1
+                if batch.attempt > self.max_retries:
+                    print(f"❌ Batch fra rad {batch.start} feilet etter {self.max_retries} forsøk: {e}")
+                    failed.append(batch)
+                else:
+                    delay = min(60, 2 ** batch.attempt)
+                    print(f"⏳ Batch fra rad {batch.start} feilet ({e}), nytt forsøk {batch.attempt} om {delay}s")
+                    progress["pending_retries"] += 1
+                    asyncio.create_task(self._requeue(queue, batch, delay, progress))
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def _requeue(queue: asyncio.Queue, batch: Batch, delay: float, progress: dict):
+        """Legg en feilet batch tilbake i køen etter ``delay`` sekunder."""
+        await asyncio.sleep(delay)
+        queue.put_nowait(batch)
+        progress["pending_retries"] -= 1
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Hent embeddings for ``texts``.
+
+        Returns:
+            Én vektor per tekst, i samme rekkefølge som ``texts``
+
+        Raises:
+            EmbeddingPipelineError: Hvis noen batcher fortsatt feiler etter alle forsøk
+        """
+        if self.local:
+            vectors = load_local_embeddings().embed_texts(list(texts), self.dimensions)
+            print(f"✅ {len(vectors)} lokale embeddings laget")
+            return vectors
+
+        batches = self.make_batches(texts)
+        results: list = [None] * len(texts)
+        failed: List[Batch] = []
+        progress = {"done": 0, "total": len(texts), "pending_retries": 0}
+        print(f"🔄 {len(texts)} tekster fordelt på {len(batches)} batcher, {self.concurrency} samtidige")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for batch in batches:
+            queue.put_nowait(batch)
+
+        async with aiohttp.ClientSession() as session:
+            workers = [
+                asyncio.create_task(self._worker(session, queue, results, failed, progress))
+                for _ in range(self.concurrency)
+            ]
+            # Køen kan være tom mens batcher venter på et nytt forsøk
+            while True:
+                await queue.join()
+                if progress["pending_retries"] == 0 and queue.empty():
+                    break
+                await asyncio.sleep(0.1)
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if failed:
+            rows = sorted(batch.start for batch in failed)
+            raise EmbeddingPipelineError(f"{len(failed)} batcher feilet (første rad i hver: {rows})")
+        return results
+
+
+def embed_texts(texts: List[str], **kwargs) -> List[List[float]]:
+    """Synkron innpakning av ``EmbeddingPipeline.embed`` med endepunktet fra config."""
+    pipeline = EmbeddingPipeline(
+        api_url=config.CONFIG["embedding"]["api_url"],
+        api_key=config.CONFIG["api"]["azure_embedding_api_key"],
+        **kwargs,
+    )
+    return asyncio.run(pipeline.embed(list(texts)))
@@ -0,0 +1,270 @@
+"""
+Inkrementell oppdatering av text_embedding_3_large fra en ny metadataeksport.
+
+I stedet for å embedde hele katalogen på nytt (create_vector.py + insert_csv.py)
+sammenlignes eksporten med tabellen:
+
+- nye datasett settes inn med nye embeddings,
+- datasett der tittel eller kombinert tekst er endret får nye embeddings,
+- datasett der bare øvrige metadata er endret oppdateres uten API-kall,
+- datasett som ikke lenger finnes i eksporten slettes (PDF-rader berøres ikke).
+
+Hvilken tekst en vektor ble laget av lagres som en hash i title_hash og
+combined_text_hash. Rader fra før hashene fantes får hashen fylt inn uten nye
+embeddings når den lagrede teksten er den samme som i eksporten. En hash av
+hele eksportraden lagres i metadata_hash, så rader der ingenting er endret
+ikke skrives i det hele tatt. Endrede rader oppdateres i bolker med
+UPDATE ... FROM (VALUES ...).
+
+Bruk:
+    python incremental_index.py [metadata.csv] [--dry-run]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_batch, execute_values
+
+from bounding_box import parse_bounding_box, to_pg_box
+from config import DB_CONFIG
+from embedding_pipeline import content_hash, embed_texts
+
+TABLE_NAME = "text_embedding_3_large"
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cleaned_metadata.csv")
+# Samme kolonner som create_vector.py slår sammen til combined_text
+COMBINED_COLUMNS = ["title", "abstract", "keyword"]
+# Kolonner som skrives av dette skriptet og ikke kommer fra eksporten
+MANAGED_COLUMNS = {"combined_text", "title_vector", "combined_text_vector", "title_hash", "combined_text_hash",
+                   "metadata_hash", "bbox"}
+# Rader per UPDATE-setning
+UPDATE_PAGE_SIZE = 500
+
+
+def metadata_hash(row):
+    """Hash av alle feltene i en eksportrad, for å hoppe over uendrede rader."""
+    return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def read_export(path):
+    """Les eksporten og beregn combined_text og hasher slik create_vector.py gjør."""
+    df = pd.read_csv(path, delimiter="|", dtype=str)
+    df = df.drop_duplicates(subset="uuid", keep="first")
+    export = df.astype(object).where(df.notna(), None)
+    df["metadata_hash"] = [metadata_hash(row) for row in export.to_dict("records")]
+    df["title"] = df["title"].fillna("")
+    df["combined_text"] = df[COMBINED_COLUMNS].fillna("").agg(" ".join, axis=1)
+    df["title_hash"] = df["title"].map(content_hash)
+    df["combined_text_hash"] = df["combined_text"].map(content_hash)
+    return df.astype(object).where(df.notna(), None)
+
+
+def table_columns(cursor):
+    """Kolonnene i tabellen med typen sin, f.eks. {"title": "text", "title_vector": "vector(3072)"}."""
+    cursor.execute(
+        """
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """,
+        (TABLE_NAME,)
+    )
+    return dict(cursor.fetchall())
+
+
+def metadata_rows_condition(columns, alias=""):
+    """SQL-betingelse som skiller metadata-rader fra PDF-rader lagt inn av insert_pdf.py."""
+    return f"{alias}schema IS DISTINCT FROM 'pdf'" if "schema" in columns else "TRUE"
+
+
+def load_existing(cursor, columns):
+    """Hent hash, tekst og om vektorene finnes for alle metadata-rader i tabellen."""
+    combined_text = "combined_text" if "combined_text" in columns else "NULL"
+    cursor.execute(f"""
+        SELECT uuid, title, {combined_text}, title_hash, combined_text_hash,
+               title_vector IS NOT NULL, combined_text_vector IS NOT NULL, metadata_hash
+        FROM {TABLE_NAME}
+        WHERE {metadata_rows_condition(columns)}
+    """)
+    return {
+        row[0]: {
+            "title": row[1],
+            "combined_text": row[2],
+            "title_hash": row[3],
+            "combined_text_hash": row[4],
+            "has_title_vector": row[5],
+            "has_combined_vector": row[6],
+            "metadata_hash": row[7],
+        }
+        for row in cursor.fetchall()
+    }
+
+
+def needs_embedding(stored, text_field, hash_field, vector_field, new_text, new_hash):
+    """
+    Avgjør om en tekst må embeddes på nytt.
+
+    Returnerer (embed, backfill): backfill betyr at vektoren er gyldig, men
+    hashen mangler og bare skal fylles inn.
+    """
+    if stored is None or not stored[vector_field]:
+        return True, False
+    if stored[hash_field] == new_hash:
+        return False, False
+    if stored[hash_field] is None and stored[text_field] == new_text:
+        return False, True
+    return True, False
+
+
+def plan_changes(df, existing):
+    """Finn hvilke rader som er nye, endret eller borte, og hvilke tekster som må embeddes."""
+    plan = {"insert": [], "update": [], "delete": [], "title": [], "combined": [], "backfilled": 0, "unchanged": 0}
+    export_uuids = set()
+    for row in df.to_dict("records"):
+        uuid = row["uuid"]
+        if not uuid:
+            continue
+        export_uuids.add(uuid)
+        stored = existing.get(uuid)
+
+        embed_title, backfill_title = needs_embedding(
+            stored, "title", "title_hash", "has_title_vector", row["title"], row["title_hash"])
+        embed_combined, backfill_combined = needs_embedding(
+            stored, "combined_text", "combined_text_hash", "has_combined_vector",
+            row["combined_text"], row["combined_text_hash"])
+        plan["backfilled"] += backfill_title + backfill_combined
+
+        if (stored is not None and not (embed_title or embed_combined or backfill_title or backfill_combined)
+                and stored["metadata_hash"] == row["metadata_hash"]):
+            plan["unchanged"] += 1
+            continue
+        if embed_title:
+            plan["title"].append(row)
+        if embed_combined:
+            plan["combined"].append(row)
+        plan["insert" if stored is None else "update"].append(row)
+
+    plan["delete"] = sorted(set(existing) - export_uuids)
+    return plan
+
+
+def embed_rows(rows, text_field):
+    if not rows:
+        return []
+    return embed_texts([row[text_field] for row in rows])
+
+
+def apply_changes(connection, plan, columns, export_columns):
+    """Skriv endringene i én transaksjon."""
+    data_columns = [c for c in export_columns if c.lower() in columns and c.lower() not in MANAGED_COLUMNS]
+    bbox_source = next((c for c in export_columns if c.lower() in ("boundingbox", "geobox")), None)
+    has_bbox = "bbox" in columns and bbox_source is not None
+    has_combined_text = "combined_text" in columns
+    metadata_rows = metadata_rows_condition(columns)
+
+    title_vectors = {row["uuid"]: vector for row, vector in zip(plan["title"], embed_rows(plan["title"], "title"))}
+    combined_vectors = {
+        row["uuid"]: vector
+        for row, vector in zip(plan["combined"], embed_rows(plan["combined"], "combined_text"))
+    }
+
+    def row_values(row):
+        values = {column: row[column] for column in data_columns}
+        values["title_hash"] = row["title_hash"]
+        values["combined_text_hash"] = row["combined_text_hash"]
+        values["metadata_hash"] = row["metadata_hash"]
+        if has_combined_text:
+            values["combined_text"] = row["combined_text"]
+        if has_bbox:
+            values["bbox"] = to_pg_box(parse_bounding_box(row[bbox_source]))
+        if row["uuid"] in title_vectors:
+            values["title_vector"] = json.dumps(title_vectors[row["uuid"]])
+        if row["uuid"] in combined_vectors:
+            values["combined_text_vector"] = json.dumps(combined_vectors[row["uuid"]])
+        return values
+
+    # Rader med nye vektorer har flere kolonner enn de andre; hver gruppe oppdateres i bolker
+    updates = {}
+    for row in plan["update"]:
+        values = row_values(row)
+        updates.setdefault(tuple(values), []).append((row["uuid"], *values.values()))
+
+    with connection.cursor() as cursor:
+        for update_columns, rows in updates.items():
+            assignments = ", ".join(f"{column} = v.{column}::{columns[column.lower()]}" for column in update_columns)
+            execute_values(
+                cursor,
+                f"""
+                UPDATE {TABLE_NAME} AS t SET {assignments}
+                FROM (VALUES %s) AS v(uuid, {', '.join(update_columns)})
+                WHERE t.uuid = v.uuid AND {metadata_rows_condition(columns, "t.")}
+                """,
+                rows,
+                page_size=UPDATE_PAGE_SIZE,
+            )
+
+        if plan["insert"]:
+            insert_values = [row_values(row) for row in plan["insert"]]
+            insert_columns = list(insert_values[0])
+            execute_batch(
+                cursor,
+                f"INSERT INTO {TABLE_NAME} ({', '.join(insert_columns)}) VALUES ({', '.join(['%s'] * len(insert_columns))})",
+                [tuple(values[column] for column in insert_columns) for values in insert_values]
+            )
+
+        if plan["delete"]:
+            cursor.execute(
+                f"DELETE FROM {TABLE_NAME} WHERE uuid = ANY(%s) AND {metadata_rows}",
+                (plan["delete"],)
+            )
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oppdater embeddings inkrementelt fra en metadataeksport.")
+    parser.add_argument("input", nargs="?", default=DEFAULT_INPUT, help="Metadata-CSV med '|' som skilletegn")
+    parser.add_argument("--dry-run", action="store_true", help="Vis hva som ville blitt endret uten å skrive")
+    args = parser.parse_args()
+
+    df = read_export(args.input)
+    if df.empty:
+        # En tom eksport ville ellers slettet hele katalogen
+        print("❌ Eksporten inneholder ingen rader, avbryter.")
+        sys.exit(1)
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS title_hash TEXT;")
+            cursor.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS combined_text_hash TEXT;")
+            cursor.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS metadata_hash TEXT;")
+            connection.commit()
+            columns = table_columns(cursor)
+            existing = load_existing(cursor, columns)
+
+        plan = plan_changes(df, existing)
+        print(f"📊 {len(df)} datasett i eksporten, {len(existing)} i tabellen")
+        print(f"➕ Nye: {len(plan['insert'])}  ✏️ Endret: {len(plan['update'])}  "
+              f"⏸️ Uendret: {plan['unchanged']}  🗑️ Borte: {len(plan['delete'])}")
+        print(f"🔢 Embeddings: {len(plan['title'])} titler og {len(plan['combined'])} kombinerte tekster "
+              f"({plan['backfilled']} hasher fylt inn uten nye embeddings)")
+
+        if args.dry_run:
+            print("ℹ️ Tørrkjøring, ingen endringer skrevet.")
+            return
+
+        apply_changes(connection, plan, columns, list(df.columns))
+        print("✅ Tabellen er oppdatert.")
+    except Exception as e:
+        connection.rollback()
+        print(f"❌ Feil under inkrementell oppdatering: {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
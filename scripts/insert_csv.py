@@ -1,8 +1,10 @@
 import csv
+import json
+import struct
 import psycopg2
-from psycopg2.extras import execute_batch
 import config
 import sys
+from bounding_box import parse_bounding_box, to_pg_box
 
 # Databasekonfigurasjon
 db_config = config.DB_CONFIG
@@ -31,78 +33,237 @@ except Exception as e:
 table_name = "text_embedding_3_large"  # Juster tabellnavnet etter behov
 file_path = "all_columns_vectorized.csv"  # Angi riktig filsti
 
-def create_table_from_csv(file_path, table_name):
+# Vektorkolonnene er JSON-lister med 3072 tall og er større enn standardgrensen i csv-modulen
+csv.field_size_limit(sys.maxsize)
+
+# Kolonner med kommaseparert utstrekning (vest, øst, sør, nord) som tolkes til bbox
+BOUNDING_BOX_COLUMNS = ("boundingbox", "geobox")
+
+# Fulltekstvektor over tittel, nøkkelord og sammendrag, med tittelen vektet høyest
+SEARCH_TSV_EXPRESSION = (
+    "setweight(to_tsvector('norwegian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('norwegian', coalesce(keyword, '')), 'B') || "
+    "setweight(to_tsvector('norwegian', coalesce(abstract, '')), 'C')"
+)
+
+# Kompakt kopi av combined_text_vector for grovsøk: de første N dimensjonene,
+# normalisert på nytt og lagret som halfvec (2 byte per tall i stedet for 4)
+COMPACT_DIMENSIONS = config.CONFIG["vectors"]["compact_dimensions"]
+COMPACT_VECTOR_EXPRESSION = (
+    f"l2_normalize(subvector(combined_text_vector, 1, {COMPACT_DIMENSIONS}))::halfvec({COMPACT_DIMENSIONS})"
+)
+
+# Binærformatet til COPY: signatur, flagg og lengde på header-utvidelsen
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+
+
+def bounding_box_column(headers):
+    """Finn kolonnen med datasettets utstrekning, hvis CSV-filen har en."""
+    for header in headers:
+        if header.lower() in BOUNDING_BOX_COLUMNS:
+            return header
+    return None
+
+
+def column_type(header):
+    if header == "id":
+        return "INT"
+    if header.endswith("_vector"):
+        return "VECTOR(3072)"
+    return "TEXT"
+
+
+def table_schema(headers):
     """
-    Opprett en tabell i PostgreSQL basert på CSV-innhold.
+    Returner kolonnene som lastes fra CSV-filen som (navn, type), pluss en bbox-kolonne
+    tolket fra boundingBox/geoBox hvis filen har en.
     """
-    try:
-        with connection.cursor() as cursor:
-            with open(file_path, mode="r", encoding="utf-8") as file:
-                reader = csv.DictReader(file, delimiter="|")
-                headers = reader.fieldnames
-
-                if not headers:
-                    raise ValueError("Ingen kolonner funnet i CSV-filen.")
-
-                create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ("
-                for header in headers:
-                    if header == "id":
-                        create_table_query += f"{header} INT,"
-                    elif header.endswith("_vector"):
-                        create_table_query += f"{header} VECTOR(3072),"
-                    else:
-                        create_table_query += f"{header} TEXT,"
-                create_table_query = create_table_query.rstrip(",") + ");"
-
-                cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
-                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-                cursor.execute(create_table_query)
-                connection.commit()
-                print(f"✅ Tabellen '{table_name}' ble opprettet.")
-    except Exception as e:
-        print(f"❌ Feil under oppretting av tabellen: {e}")
-        connection.rollback()
+    columns = [(header, column_type(header)) for header in headers]
+    if bounding_box_column(headers) and "bbox" not in headers:
+        columns.append(("bbox", "BOX"))
+    return columns
+
+
+def encode_field(value, type_name):
+    """Koder én verdi i COPY-binærformat (lengde + bytes), eller NULL for tomme verdier."""
+    if value is None or value == "":
+        return NULL_FIELD
+    if type_name == "INT":
+        payload = struct.pack(">i", int(float(value)))
+    elif type_name.startswith("VECTOR"):
+        # pgvector: antall dimensjoner, et ubrukt felt og float4-verdiene
+        numbers = json.loads(value)
+        payload = struct.pack(f">hh{len(numbers)}f", len(numbers), 0, *numbers)
+    elif type_name == "BOX":
+        # box: øvre høyre hjørne etterfulgt av nedre venstre, som float8
+        west, south, east, north = value
+        payload = struct.pack(">dddd", east, north, west, south)
+    else:
+        payload = value.encode("utf-8")
+    return struct.pack(">i", len(payload)) + payload
+
+
+def copy_rows(reader, columns):
+    """Generator som gjør CSV-rader om til COPY-binærdata én rad om gangen."""
+    bbox_source = bounding_box_column(reader.fieldnames)
+    field_count = struct.pack(">h", len(columns))
+    yield COPY_HEADER
+    for row in reader:
+        parts = [field_count]
+        for name, type_name in columns:
+            if name == "bbox" and type_name == "BOX":
+                value = parse_bounding_box(row.get(bbox_source))
+            else:
+                value = row.get(name)
+            parts.append(encode_field(value, type_name))
+        yield b"".join(parts)
+    yield COPY_TRAILER
+
+
+class GeneratorReader:
+    """Fil-lignende objekt over en bytes-generator, slik at copy_expert kan lese fra den i biter."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b""
+        self.rows = -2  # Header og trailer telles ikke
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+                self.rows += 1
+            except StopIteration:
+                break
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def create_table(cursor, name, columns):
+    """Opprett tabellen med fulltekstkolonnen generert fra tittel, nøkkelord og sammendrag."""
+    definitions = [f"{column} {type_name}" for column, type_name in columns]
+    column_names = {column.lower() for column, _ in columns}
+    if {"title", "keyword", "abstract"} <= column_names:
+        definitions.append(f"search_tsv tsvector GENERATED ALWAYS AS ({SEARCH_TSV_EXPRESSION}) STORED")
+    if COMPACT_DIMENSIONS and "combined_text_vector" in column_names:
+        definitions.append(
+            f"combined_text_compact halfvec({COMPACT_DIMENSIONS}) "
+            f"GENERATED ALWAYS AS ({COMPACT_VECTOR_EXPRESSION}) STORED"
+        )
+    cursor.execute(f"DROP TABLE IF EXISTS {name};")
+    cursor.execute(f"CREATE TABLE {name} ({', '.join(definitions)});")
 
-def insert_csv_data(file_path, table_name):
+
+def create_search_indexes(cursor, name, index_prefix):
+    """
+    Opprett indeksene som brukes av søket i geonorge-server: GiST-indeks på bbox
+    for kartutsnitt, GIN-indeks på fulltekstkolonnen for hybridsøk og HNSW-indeks
+    på de kompakte vektorene for grovsøket.
+    """
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
+        (name,)
+    )
+    columns = {row[0] for row in cursor.fetchall()}
+
+    if "bbox" in columns:
+        cursor.execute(f"CREATE INDEX {index_prefix}_bbox_idx ON {name} USING gist (bbox);")
+        print("✅ Romlig indeks opprettet.")
+    else:
+        print("⚠️ Ingen bbox-kolonne, hopper over romlig indeks.")
+
+    if "search_tsv" in columns:
+        cursor.execute(f"CREATE INDEX {index_prefix}_search_tsv_idx ON {name} USING gin (search_tsv);")
+        print("✅ Fulltekstindeks opprettet.")
+    else:
+        print("⚠️ Mangler title/keyword/abstract, hopper over fulltekstindeks.")
+
+    if "combined_text_compact" in columns:
+        cursor.execute(
+            f"CREATE INDEX {index_prefix}_combined_text_compact_idx ON {name} "
+            "USING hnsw (combined_text_compact halfvec_l2_ops);"
+        )
+        print(f"✅ HNSW-indeks opprettet for kompakte vektorer ({COMPACT_DIMENSIONS} dimensjoner).")
+
+    cursor.execute(f"ANALYZE {name};")
+
+
+def table_indexes(cursor, name):
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (name,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def swap_tables(cursor, table_name, staging_name):
+    """
+    Bytt ut den aktive tabellen med staging-tabellen i én transaksjon.
+
+    Spørringer mot den gamle tabellen fortsetter til byttet, og ser den nye
+    tabellen rett etterpå; låsen holdes bare mens navnene endres.
     """
-    Sett inn data fra en CSV-fil i PostgreSQL-tabellen.
+    old_name = f"{table_name}_old"
+    cursor.execute(f"DROP TABLE IF EXISTS {old_name};")
+    for index in table_indexes(cursor, table_name):
+        cursor.execute(f"ALTER INDEX {index} RENAME TO {index}_old;")
+    cursor.execute(f"ALTER TABLE IF EXISTS {table_name} RENAME TO {old_name};")
+    cursor.execute(f"ALTER TABLE {staging_name} RENAME TO {table_name};")
+    for index in table_indexes(cursor, table_name):
+        if index.startswith(staging_name):
+            cursor.execute(f"ALTER INDEX {index} RENAME TO {table_name}{index[len(staging_name):]};")
+    cursor.execute(f"DROP TABLE IF EXISTS {old_name};")
+
+
+def load_csv(file_path, table_name):
     """
+    Last CSV-filen inn i en staging-tabell med COPY og bytt den inn som aktiv tabell.
+
+    Radene strømmes fra filen til databasen, så minnebruken er konstant uansett
+    filstørrelse, og den aktive tabellen kan brukes helt til byttet.
+    """
+    staging_name = f"{table_name}_staging"
     try:
-        with connection.cursor() as cursor:
-            with open(file_path, mode="r", encoding="utf-8") as file:
-                reader = csv.DictReader(file, delimiter="|")
-                rows = [row for row in reader]
+        with connection.cursor() as cursor, open(file_path, mode="r", encoding="utf-8", newline="") as file:
+            reader = csv.DictReader(file, delimiter="|")
+            if not reader.fieldnames:
+                raise ValueError("Ingen kolonner funnet i CSV-filen.")
+            columns = table_schema(reader.fieldnames)
 
-            if not rows:
-                raise ValueError("CSV-filen inneholder ingen rader.")
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+            create_table(cursor, staging_name, columns)
+            print(f"✅ Staging-tabellen '{staging_name}' ble opprettet.")
 
-            columns = ", ".join(rows[0].keys())
-            values_template = ", ".join(["%s"] * len(rows[0]))
-            insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values_template})"
+            stream = GeneratorReader(copy_rows(reader, columns))
+            column_list = ", ".join(column for column, _ in columns)
+            cursor.copy_expert(
+                f"COPY {staging_name} ({column_list}) FROM STDIN WITH (FORMAT binary)",
+                stream
+            )
+            if stream.rows <= 0:
+                raise ValueError("CSV-filen inneholder ingen rader.")
+            print(f"✅ {stream.rows} rader fra '{file_path}' ble kopiert inn.")
 
-            execute_batch(cursor, insert_query, [tuple(row.values()) for row in rows])
-            connection.commit()
-            print(f"✅ Data fra '{file_path}' ble satt inn i tabellen '{table_name}'.")
+            create_search_indexes(cursor, staging_name, staging_name)
+            swap_tables(cursor, table_name, staging_name)
+        connection.commit()
+        print(f"✅ Tabellen '{table_name}' er byttet ut med de nye dataene.")
     except Exception as e:
-        print(f"❌ Feil under innsetting av data: {e}")
+        print(f"❌ Feil under lasting av data: {e}")
         connection.rollback()
 
-def insert_csv_data_modified(file_path, table_name):
-    """
-    Opprett en tabell basert på CSV og sett inn data.
-    """
-    create_table_from_csv(file_path, table_name)
-    insert_csv_data(file_path, table_name)
 
 def main():
     """
-    Hovedfunksjon for å opprette tabell og sette inn data.
+    Hovedfunksjon for å laste CSV-filen inn i databasen.
     """
     try:
-        insert_csv_data_modified(file_path, table_name)
+        load_csv(file_path, table_name)
     finally:
         connection.close()
         print("🔒 Forbindelsen til databasen ble lukket.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
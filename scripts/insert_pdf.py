@@ -1,72 +1,68 @@
 import os
+import sys
 import uuid
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import PyPDF2
 import psycopg2
-import aiohttp
-import asyncio
+from psycopg2.extras import execute_values
 from config import DB_CONFIG, CONFIG
+from embedding_pipeline import EmbeddingPipeline
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def get_semantic_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
-    """Split text into semantic chunks using RecursiveCharacterTextSplitter."""
-    text_splitter = RecursiveCharacterTextSplitter(
+# Number of worker processes extracting and chunking PDFs
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+# Number of documents being embedded and inserted at the same time
+PDF_DOCUMENT_CONCURRENCY = int(os.getenv("PDF_DOCUMENT_CONCURRENCY", "2"))
+
+
+def get_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
         separators=["\n\n", "\n", ".", " ", ""]
     )
-    return text_splitter.split_text(text)
-
-async def get_embedding(text):
-    """Get embedding from Azure OpenAI API."""
-    headers = {
-        'Content-Type': 'application/json',
-        'api-key': CONFIG["api"]["azure_embedding_api_key"]
-    }
-    
-    data = {
-        'input': text,
-        'model': 'text-embedding-3-large'
-    }
-    
-    base_url = CONFIG["api"]["azure_embeddings_endpoint"]
-    deployment_name = "text-embedding-3-large"
-    api_version = "2024-02-15-preview"
-    
-    endpoint = f"{base_url}/openai/deployments/{deployment_name}/embeddings?api-version={api_version}"
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            endpoint,
-            headers=headers,
-            json=data
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                return result['data'][0]['embedding']
-            else:
-                error_data = await response.text()
-                print(f"Full endpoint URL: {endpoint}")
-                print(f"Response status: {response.status}")
-                raise Exception(f'Azure OpenAI API error: {error_data}')
-
-def extract_text_from_pdf(pdf_path):
-    """Extract text content from PDF file."""
+
+def get_semantic_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list:
+    """Split text into semantic chunks using RecursiveCharacterTextSplitter."""
+    return get_text_splitter(chunk_size, chunk_overlap).split_text(text)
+
+def iter_pages(pdf_path):
+    """Yield the text of one page at a time, so the whole document is never held as one string."""
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        text = ''
         for page in reader.pages:
-            text += page.extract_text() + '\n'
-    return text.strip()
+            yield page.extract_text() or ''
+
+def iter_chunks(pages, chunk_size: int = 1000, chunk_overlap: int = 200):
+    """
+    Chunk a stream of pages.
+
+    Only the unfinished last chunk is carried over to the next page, where it is
+    re-split together with the new text, so chunks can span page boundaries and
+    keep their overlap while memory stays bounded by a couple of pages.
+    """
+    splitter = get_text_splitter(chunk_size, chunk_overlap)
+    buffer = ''
+    for page_text in pages:
+        buffer = f"{buffer}\n{page_text}" if buffer else page_text
+        if len(buffer) < 2 * chunk_size:
+            continue
+        chunks = splitter.split_text(buffer)
+        yield from chunks[:-1]
+        buffer = chunks[-1] if chunks else ''
+    if buffer.strip():
+        yield from splitter.split_text(buffer)
 
 def get_pdf_metadata(pdf_path):
     """Extract basic metadata from PDF file."""
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        info = reader.metadata
+        info = reader.metadata or {}
         creation_date = info.get('/CreationDate', '')
         if creation_date and creation_date.startswith('D:'):
             creation_date = creation_date[2:14]
@@ -76,95 +72,131 @@ def get_pdf_metadata(pdf_path):
                 creation_date = datetime.now().strftime('%Y-%m-%d')
         else:
             creation_date = datetime.now().strftime('%Y-%m-%d')
-        
+
         return {
-            'title': info.get('/Title', os.path.basename(pdf_path)),
+            'title': info.get('/Title') or os.path.basename(pdf_path),
             'creation_date': creation_date,
             'author': info.get('/Author', '')
         }
 
-async def insert_pdf_chunk_to_db(cur, chunk_text: str, base_data: dict, chunk_index: int):
-    """Insert a single chunk of PDF text into the database."""
-    # Create chunk-specific data
-    data = base_data.copy()
-    data['uuid'] = str(uuid.uuid4())  # Each chunk gets a unique UUID
-    data['abstract'] = chunk_text
-    data['title'] = f"{base_data['title']} (Del {chunk_index + 1})" if chunk_index > 0 else base_data['title']
-    
-    # Get embeddings for this chunk
-    title_vector = await get_embedding(data['title'])
-    combined_text = f"{data['title']} {chunk_text}"
-    combined_text_vector = await get_embedding(combined_text)
-    
-    # Insert into database
+def extract_document(pdf_path):
+    """
+    Extract metadata and chunks for one PDF. Runs in a worker process, since
+    PDF text extraction is CPU-bound.
+    """
+    metadata = get_pdf_metadata(pdf_path)
+    chunks = list(iter_chunks(iter_pages(pdf_path)))
+    return pdf_path, metadata, chunks
+
+def chunk_titles(metadata, chunks):
+    base_title = metadata['title']
+    return [f"{base_title} (Del {i + 1})" if i > 0 else base_title for i in range(len(chunks))]
+
+def build_rows(metadata, chunks, title_vectors, combined_vectors):
+    """Build one database row per chunk."""
+    rows = []
+    for index, (title, chunk_text) in enumerate(zip(chunk_titles(metadata, chunks), chunks)):
+        rows.append((
+            'pdf',                                   # schema
+            str(uuid.uuid4()),                       # Each chunk gets a unique UUID
+            'document',                              # hierarchylevel
+            title,
+            metadata['creation_date'],               # datasetcreationdate
+            chunk_text,                              # abstract
+            metadata['author'],                      # keyword
+            datetime.now().strftime('%Y-%m-%d'),     # metadatacreationdate
+            title_vectors[index],
+            combined_vectors[index],
+        ))
+    return rows
+
+async def embed_document(pipeline, metadata, chunks):
+    """Embed titles and combined texts for all chunks of a document in batched API calls."""
+    titles = chunk_titles(metadata, chunks)
+    combined_texts = [f"{title} {chunk}" for title, chunk in zip(titles, chunks)]
+    title_vectors, combined_vectors = await asyncio.gather(
+        pipeline.embed(titles),
+        pipeline.embed(combined_texts),
+    )
+    return title_vectors, combined_vectors
+
+def insert_document_rows(rows):
+    """Insert all chunks of a document in one statement and one transaction."""
     insert_query = """
-    INSERT INTO text_embedding_3_large 
-    (schema, uuid, hierarchylevel, title, datasetcreationdate, abstract, 
+    INSERT INTO text_embedding_3_large
+    (schema, uuid, hierarchylevel, title, datasetcreationdate, abstract,
      keyword, metadatacreationdate, title_vector, combined_text_vector)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    VALUES %s
     """
-    
-    try:
-        cur.execute(insert_query, (
-            data['schema'], data['uuid'], data['hierarchylevel'],
-            data['title'], data['datasetcreationdate'], data['abstract'],
-            data['keyword'], data['metadatacreationdate'], title_vector,
-            combined_text_vector
-        ))
-        print(f"Successfully inserted chunk {chunk_index + 1} for: {base_data['title']}")
-        return True
-    except Exception as e:
-        print(f"Error inserting chunk {chunk_index + 1} for {base_data['title']}: {e}")
-        return False
-
-async def insert_pdf_to_db(pdf_path):
-    """Process PDF and insert into database with semantic chunking."""
-    # Extract text and metadata
-    text_content = extract_text_from_pdf(pdf_path)
-    metadata = get_pdf_metadata(pdf_path)
-    
-    # Get semantic chunks
-    chunks = get_semantic_chunks(text_content)
-    
     conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
     try:
-        # Prepare base data
-        base_data = {
-            'schema': 'pdf',
-            'hierarchylevel': 'document',
-            'title': metadata['title'],
-            'datasetcreationdate': metadata['creation_date'],
-            'keyword': metadata['author'],
-            'metadatacreationdate': datetime.now().strftime('%Y-%m-%d'),
-        }
-        
-        # Insert each chunk
-        success_count = 0
-        for i, chunk in enumerate(chunks):
-            if await insert_pdf_chunk_to_db(cur, chunk, base_data, i):
-                success_count += 1
-                conn.commit()  # Commit after each successful chunk
-        
-        print(f"\nProcessing complete for {metadata['title']}:")
-        print(f"Total chunks: {len(chunks)}")
-        print(f"Successfully inserted chunks: {success_count}")
-        print(f"Failed chunks: {len(chunks) - success_count}")
-        
-    except Exception as e:
-        print(f"Error processing PDF: {e}")
+        with conn.cursor() as cur:
+            execute_values(cur, insert_query, rows, page_size=100)
+        conn.commit()
     finally:
-        cur.close()
         conn.close()
 
+async def ingest_document(pipeline, semaphore, pdf_path, metadata, chunks):
+    """Embed and insert one extracted document."""
+    async with semaphore:
+        name = os.path.basename(pdf_path)
+        if not chunks:
+            print(f"No text found in {name}, skipping")
+            return 0
+        try:
+            title_vectors, combined_vectors = await embed_document(pipeline, metadata, chunks)
+            rows = build_rows(metadata, chunks, title_vectors, combined_vectors)
+            await asyncio.to_thread(insert_document_rows, rows)
+            print(f"Inserted {len(rows)} chunks for: {metadata['title']}")
+            return len(rows)
+        except Exception as e:
+            print(f"Error processing {name}: {e}")
+            return 0
+
+async def insert_pdfs(pdf_paths):
+    """
+    Ingest PDFs: extraction and chunking run across a process pool, while
+    embedding and inserting run concurrently in the event loop for up to
+    PDF_DOCUMENT_CONCURRENCY documents at a time.
+    """
+    loop = asyncio.get_running_loop()
+    pipeline = EmbeddingPipeline(
+        api_url=CONFIG["embedding"]["api_url"],
+        api_key=CONFIG["api"]["azure_embedding_api_key"],
+    )
+    semaphore = asyncio.Semaphore(PDF_DOCUMENT_CONCURRENCY)
+    ingest_tasks = []
+
+    with ProcessPoolExecutor(max_workers=min(PDF_WORKERS, len(pdf_paths))) as executor:
+        extractions = [loop.run_in_executor(executor, extract_document, path) for path in pdf_paths]
+        for extraction in asyncio.as_completed(extractions):
+            try:
+                pdf_path, metadata, chunks = await extraction
+            except Exception as e:
+                print(f"Error extracting PDF: {e}")
+                continue
+            print(f"Extracted {len(chunks)} chunks from {os.path.basename(pdf_path)}")
+            # Start embedding this document while the pool keeps extracting the others
+            ingest_tasks.append(asyncio.create_task(
+                ingest_document(pipeline, semaphore, pdf_path, metadata, chunks)
+            ))
+
+    inserted = await asyncio.gather(*ingest_tasks)
+    print(f"\nProcessing complete:")
+    print(f"Documents: {len(pdf_paths)}")
+    print(f"Documents inserted: {sum(1 for count in inserted if count)}")
+    print(f"Total chunks inserted: {sum(inserted)}")
+
 async def main():
     """Main function to process PDFs in a directory."""
-    pdf_dir = input("Enter the directory path containing PDFs (relative to project root): ")
-    
+    if len(sys.argv) > 1:
+        pdf_dir = sys.argv[1]
+    else:
+        pdf_dir = input("Enter the directory path containing PDFs (relative to project root): ")
+
     # Convert to absolute path using project root
     abs_pdf_dir = os.path.join(PROJECT_ROOT, pdf_dir)
-    
+
     if not os.path.exists(abs_pdf_dir):
         print(f"Directory does not exist: {abs_pdf_dir}")
         print(f"Project root is: {PROJECT_ROOT}")
@@ -173,12 +205,18 @@ async def main():
             if os.path.isdir(os.path.join(PROJECT_ROOT, item)):
                 print(f"- {item}/")
         return
-    
-    for filename in os.listdir(abs_pdf_dir):
-        if filename.lower().endswith('.pdf'):
-            pdf_path = os.path.join(abs_pdf_dir, filename)
-            print(f"\nProcessing {filename}...")
-            await insert_pdf_to_db(pdf_path)
+
+    pdf_paths = [
+        os.path.join(abs_pdf_dir, filename)
+        for filename in sorted(os.listdir(abs_pdf_dir))
+        if filename.lower().endswith('.pdf')
+    ]
+    if not pdf_paths:
+        print(f"No PDF files found in {abs_pdf_dir}")
+        return
+
+    print(f"Processing {len(pdf_paths)} PDFs with {min(PDF_WORKERS, len(pdf_paths))} worker processes...")
+    await insert_pdfs(pdf_paths)
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -2,11 +2,15 @@ import psycopg2
 import asyncio
 from config import DB_CONFIG, CONFIG
 import aiohttp
+from embedding_pipeline import load_local_embeddings, use_local_embeddings
 
 # HELPER INCASE FILES ARENT BEING EMBEDDED or if you insert later.
 
 async def get_embedding(text):
-    """Get embedding from Azure OpenAI API."""
+    """Get embedding from Azure OpenAI API, or locally with EMBEDDING_PROVIDER=local."""
+    if use_local_embeddings():
+        return load_local_embeddings().embed_text(text, CONFIG["embedding"]["dimensions"])
+
     headers = {
         'Content-Type': 'application/json',
         'api-key': CONFIG["api"]["azure_embedding_api_key"]
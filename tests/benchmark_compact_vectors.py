@@ -0,0 +1,93 @@
+"""
+Benchmark recall@k and latency of the two-stage compact-vector search against exact search.
+
+Needs the database configured in geonorge-server/src/.env, loaded by
+scripts/insert_csv.py with COMPACT_VECTOR_DIMENSIONS > 0. Query vectors are the
+stored title vectors of randomly sampled datasets, so no embedding API calls
+are made; the exact ranking over combined_text_vector is the ground truth.
+
+Usage:
+    python tests/benchmark_compact_vectors.py [--queries 100] [--k 10] [--candidates 20 50 100 200]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "geonorge-server" / "src"))
+
+from helpers.connection import get_connection, return_connection  # noqa: E402
+from helpers.vector_database import RAG_COLUMNS, _run_vector_query  # noqa: E402
+
+
+def sample_query_vectors(count):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT title_vector::text FROM text_embedding_3_large
+                WHERE title_vector IS NOT NULL
+                ORDER BY random() LIMIT %s
+                """,
+                (count,)
+            )
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        return_connection(conn)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run(query_count, k, candidate_sizes):
+    queries = sample_query_vectors(query_count)
+    if not queries:
+        print("No title vectors found")
+        return
+
+    exact_latencies = []
+    truths = []
+    for vector in queries:
+        rows, latency = timed(_run_vector_query, RAG_COLUMNS, vector, None, k, two_stage=False)
+        truths.append({(row[0], row[1]) for row in rows})
+        exact_latencies.append(latency)
+
+    print(f"{len(queries)} queries, recall@{k} against exact search")
+    print(f"{'mode':<18} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':<18} {1.0:>8.3f} {percentile(exact_latencies, 50):>8.1f} {percentile(exact_latencies, 95):>8.1f}")
+
+    for candidates in candidate_sizes:
+        recalls = []
+        latencies = []
+        for vector, truth in zip(queries, truths):
+            rows, latency = timed(
+                _run_vector_query, RAG_COLUMNS, vector, None, k, two_stage=True, candidates=candidates
+            )
+            found = {(row[0], row[1]) for row in rows}
+            recalls.append(len(found & truth) / len(truth) if truth else 1.0)
+            latencies.append(latency)
+        label = f"compact@{candidates}"
+        print(
+            f"{label:<18} {statistics.mean(recalls):>8.3f} "
+            f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=100, help="Number of sampled query vectors")
+    parser.add_argument("--k", type=int, default=10, help="Cut-off for recall@k")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 200],
+                        help="Coarse-stage candidate counts to compare")
+    args = parser.parse_args()
+    run(args.queries, args.k, args.candidates)
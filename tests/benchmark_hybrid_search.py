@@ -0,0 +1,96 @@
+"""
+Benchmark recall and latency of vector-only versus hybrid (vector + full-text, RRF) search.
+
+Needs the database and the embedding API configured in geonorge-server/src/.env.
+The evaluation set is built from the catalogue itself: every acronym-like token
+in a dataset title (FKB, N50, DTM10, ...) becomes a query, and the datasets whose
+title contains that token are the expected hits.
+
+Usage:
+    python tests/benchmark_hybrid_search.py [--queries 50] [--k 10]
+"""
+import argparse
+import asyncio
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "geonorge-server" / "src"))
+
+from helpers.connection import get_connection, return_connection  # noqa: E402
+from helpers.fetch_openai_embeddings_api import fetch_openai_embeddings  # noqa: E402
+from helpers.vector_database import RAG_COLUMNS, _hybrid_search, _run_vector_query  # noqa: E402
+
+ACRONYM_PATTERN = re.compile(r"\b(?:[A-ZÆØÅ]{2,}\d*|[A-ZÆØÅ]+\d+)\b")
+
+
+def build_eval_set(max_queries):
+    """Map acronym queries to the set of uuids whose title contains the acronym."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT uuid, title FROM text_embedding_3_large WHERE title IS NOT NULL")
+            rows = cur.fetchall()
+    finally:
+        return_connection(conn)
+
+    expected = {}
+    for uuid, title in rows:
+        for token in set(ACRONYM_PATTERN.findall(title)):
+            expected.setdefault(token, set()).add(uuid)
+    # Tokens shared by most of the catalogue (e.g. "WMS") say nothing about recall
+    queries = sorted(
+        (token for token, uuids in expected.items() if len(uuids) <= 25),
+        key=lambda token: -len(expected[token]),
+    )
+    return {token: expected[token] for token in queries[:max_queries]}
+
+
+def recall(rows, relevant, k):
+    found = {row[0] for row in rows[:k]}
+    return len(found & relevant) / min(len(relevant), k)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(max_queries, k):
+    eval_set = build_eval_set(max_queries)
+    if not eval_set:
+        print("No acronym queries found in the catalogue")
+        return
+
+    results = {"vector": {"recall": [], "latency": []}, "hybrid": {"recall": [], "latency": []}}
+    for query, relevant in eval_set.items():
+        embedding = (await fetch_openai_embeddings(query))["data"][0]["embedding"]
+
+        started = time.perf_counter()
+        rows = await asyncio.to_thread(_run_vector_query, RAG_COLUMNS, embedding, None, k)
+        results["vector"]["latency"].append(time.perf_counter() - started)
+        results["vector"]["recall"].append(recall(rows, relevant, k))
+
+        started = time.perf_counter()
+        rows = await _hybrid_search(RAG_COLUMNS, query, embedding, None, k)
+        results["hybrid"]["latency"].append(time.perf_counter() - started)
+        results["hybrid"]["recall"].append(recall(rows, relevant, k))
+
+    print(f"{len(eval_set)} queries, recall@{k}")
+    print(f"{'mode':<8} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, values in results.items():
+        latencies = [value * 1000 for value in values["latency"]]
+        print(
+            f"{mode:<8} {statistics.mean(values['recall']):>8.3f} "
+            f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=50, help="Maximum number of acronym queries")
+    parser.add_argument("--k", type=int, default=10, help="Cut-off for recall@k")
+    args = parser.parse_args()
+    asyncio.run(run(args.queries, args.k))
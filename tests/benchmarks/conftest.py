@@ -0,0 +1,36 @@
+"""
+Shared setup for the micro-benchmarks.
+
+The server modules read their configuration at import time, so defaults for the
+local pgvector container are filled in before anything from
+geonorge-server/src is imported. Values from the environment or .env win.
+
+Runs are saved in ``.results`` next to this file wherever pytest is started
+from, unless ``--benchmark-storage`` is given.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVER_SRC = Path(__file__).resolve().parents[2] / "geonorge-server" / "src"
+RESULTS_DIR = Path(__file__).resolve().parent / ".results"
+DEFAULT_BENCHMARK_STORAGE = "file://./.benchmarks"
+sys.path.insert(0, str(SERVER_SRC))
+
+for key, value in {
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "postgres",
+    "DB_USER": "postgres",
+    "DB_PASSWORD": "postgres",
+}.items():
+    os.environ.setdefault(key, value)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # pytest-benchmark reads the storage in its own (trylast) pytest_configure
+    if config.getoption("benchmark_storage", None) == DEFAULT_BENCHMARK_STORAGE:
+        config.option.benchmark_storage = f"file://{RESULTS_DIR}"
@@ -0,0 +1,63 @@
+"""
+Cold start of the server: how long ``import server`` takes and what it loads.
+
+The import runs in a fresh interpreter with ``-X importtime``. The modules with
+the largest cumulative import time are written to
+``.results/importtime_server.txt`` on every run, so a slow new dependency shows
+up in the report. LangGraph, LangChain and the OpenAI/LangSmith clients must
+not be imported by the server module itself; they are loaded by the startup
+warm-up after the sockets are bound. The import must also stay within
+COLD_START_BUDGET_SECONDS (default 1.5).
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SERVER_SRC = Path(__file__).resolve().parents[2] / "geonorge-server" / "src"
+RESULTS_DIR = Path(__file__).resolve().parent / ".results"
+BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
+REPORT_LINES = 40
+# Top-level packages that only the chat pipeline needs
+DEFERRED_PACKAGES = {"langchain", "langchain_core", "langchain_openai", "langgraph", "langsmith", "openai",
+                     "tiktoken", "pandas"}
+
+
+def import_server():
+    """
+    Import the server in a fresh interpreter.
+
+    Returns:
+        (module, cumulative microseconds, nesting depth) for every imported module
+    """
+    env = {**os.environ, "LLM_PROVIDER": "fake", "EMBEDDING_PROVIDER": "local"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=SERVER_SRC, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(cumulative), (len(name) - len(name.lstrip())) // 2))
+    return modules
+
+
+def write_report(modules):
+    RESULTS_DIR.mkdir(exist_ok=True)
+    slowest = sorted(modules, key=lambda module: module[1], reverse=True)[:REPORT_LINES]
+    lines = [f"{cumulative / 1000:10.1f} ms  {'  ' * depth}{name}" for name, cumulative, depth in slowest]
+    (RESULTS_DIR / "importtime_server.txt").write_text("cumulative  module\n" + "\n".join(lines) + "\n")
+
+
+def test_import_server(benchmark):
+    modules = benchmark.pedantic(import_server, rounds=3, iterations=1)
+    write_report(modules)
+
+    server_seconds = dict((name, cumulative) for name, cumulative, _ in modules)["server"] / 1e6
+    assert server_seconds < BUDGET_SECONDS, f"import server took {server_seconds:.2f}s"
+
+    loaded = {name.split(".")[0] for name, _, _ in modules}
+    assert not loaded & DEFERRED_PACKAGES, f"server imports {sorted(loaded & DEFERRED_PACKAGES)} at startup"
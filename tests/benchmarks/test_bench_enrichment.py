@@ -0,0 +1,128 @@
+"""
+Benchmarks for the pure functions on the enrichment and response path: WMS
+capabilities parsing, download-API format conversion, VDB row conversion,
+image title matching and history formatting.
+"""
+import io
+import json
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from helpers.download import parse_wms_capabilities
+from helpers.fetch_valid_download_api import convert_v1_to_v2
+from rag.utils.common import format_history
+from rag.utils.dataset_utils import process_vdb_response
+from rag.utils.image_processor import find_image_dataset
+
+FIXTURES_DIR = Path(__file__).resolve().parents[1] / "fixtures" / "upstream"
+RAG_FIELDS = ['uuid', 'title', 'abstract', 'image', 'distance']
+
+
+def wms_capabilities_xml(layer_count):
+    """A WMS 1.3.0 capabilities document with ``layer_count`` nested layers, like large Geonorge services."""
+    layers = "".join(
+        f"<Layer queryable=\"1\"><Name>lag_{i}</Name><Title>Kartlag {i}</Title>"
+        f"<CRS>EPSG:25833</CRS><CRS>EPSG:3857</CRS>"
+        f"<EX_GeographicBoundingBox><westBoundLongitude>4.0</westBoundLongitude>"
+        f"<eastBoundLongitude>31.0</eastBoundLongitude><southBoundLatitude>57.0</southBoundLatitude>"
+        f"<northBoundLatitude>71.0</northBoundLatitude></EX_GeographicBoundingBox>"
+        f"<Style><Name>default</Name><Title>Standard</Title></Style></Layer>"
+        for i in range(layer_count)
+    )
+    formats = "".join(f"<Format>{f}</Format>" for f in ("image/png", "image/jpeg", "image/png8", "image/gif", "image/tiff"))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:xlink="http://www.w3.org/1999/xlink">'
+        "<Service><Name>WMS</Name><Title>Benchmark</Title></Service>"
+        f"<Capability><Request><GetCapabilities><Format>text/xml</Format></GetCapabilities><GetMap>{formats}</GetMap></Request>"
+        f"<Layer><Title>Benchmark</Title>{layers}</Layer></Capability></WMS_Capabilities>"
+    ).encode("utf-8")
+
+
+def v1_area_codelist(area_count):
+    """Download API V1 codelist: every area repeats projections, each with the same formats."""
+    projections = [
+        {
+            "code": code,
+            "name": name,
+            "codespace": f"http://www.opengis.net/def/crs/EPSG/0/{code}",
+            "formats": [{"name": f} for f in ("FGDB", "GML", "SOSI", "PostGIS", "GeoJSON")],
+        }
+        for code, name in (("25832", "EUREF89 UTM sone 32, 2d"), ("25833", "EUREF89 UTM sone 33, 2d"),
+                           ("25835", "EUREF89 UTM sone 35, 2d"), ("4258", "EUREF89 Geografisk"))
+    ]
+    areas = [{"code": "0000", "type": "landsdekkende", "name": "Hele landet", "projections": projections}]
+    areas += [
+        {"code": f"{i:04d}", "type": "kommune", "name": f"Kommune {i}", "projections": projections}
+        for i in range(1, area_count)
+    ]
+    return areas
+
+
+def vdb_rows(count):
+    return [
+        (f"uuid-{i}", f"Datasett {i} om bygninger og veger", "Beskrivelse " * 40,
+         f"https://example.com/{i}_s.png,https://example.com/{i}.png", 0.1 + i / 1000)
+        for i in range(count)
+    ]
+
+
+def chat_session(exchanges):
+    messages = []
+    for i in range(exchanges):
+        messages.append({"role": "user", "content": f"Spørsmål {i}: hvilke datasett finnes om flom i kommune {i}?"})
+        messages.append(AIMessage(content=f"Svar {i}: **Flomsoner** og **Aktsomhetsområder for flom** er relevante. " * 5))
+        messages.append(HumanMessage(content="Fortell mer"))
+    return messages
+
+
+@pytest.mark.parametrize("layer_count", [50, 500, 5000])
+def test_parse_wms_capabilities(benchmark, layer_count):
+    document = wms_capabilities_xml(layer_count)
+    result = benchmark(parse_wms_capabilities, document)
+    assert len(result["available_layers"]) == layer_count
+    assert len(result["available_formats"]) == 5
+
+
+def test_parse_wms_capabilities_fixture(benchmark):
+    fixture = json.loads((FIXTURES_DIR / "_wms" / "GetCapabilities.json").read_text(encoding="utf-8"))
+    document = fixture["body"].encode("utf-8")
+    result = benchmark(parse_wms_capabilities, document)
+    assert result["available_layers"]
+
+
+@pytest.mark.parametrize("area_count", [10, 360])
+def test_convert_v1_to_v2(benchmark, area_count):
+    areas = v1_area_codelist(area_count)
+    result = benchmark(convert_v1_to_v2, areas)
+    assert len(result) == area_count
+
+
+@pytest.mark.parametrize("row_count", [10, 20, 1000])
+def test_process_vdb_response(benchmark, row_count):
+    rows = vdb_rows(row_count)
+    result = benchmark(process_vdb_response, rows, RAG_FIELDS)
+    assert len(result) == row_count
+
+
+@pytest.mark.parametrize("dataset_count", [10, 100])
+def test_find_image_dataset(benchmark, dataset_count):
+    datasets = process_vdb_response(vdb_rows(dataset_count), RAG_FIELDS)
+    # The matching title is the last one, so every dataset is compared
+    response = ("Her er noen relevante datasett. **Flomsoner** og **Aktsomhetskart** er nyttige. " * 10
+                + f"Se også **Datasett {dataset_count - 1} om bygninger og veger**.")
+    # find_image_dataset prints DEBUG lines; the terminal would dominate the timing
+    with redirect_stdout(io.StringIO()):
+        dataset, image_url = benchmark(find_image_dataset, response, datasets)
+    assert dataset["uuid"] == f"uuid-{dataset_count - 1}"
+    assert image_url.endswith(f"{dataset_count - 1}.png")
+
+
+@pytest.mark.parametrize("exchanges", [10, 100, 1000])
+def test_format_history(benchmark, exchanges):
+    messages = chat_session(exchanges)
+    result = benchmark(format_history, messages)
+    assert result.count("\n") == len(messages) - 1
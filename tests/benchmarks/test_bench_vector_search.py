@@ -0,0 +1,115 @@
+"""
+Benchmarks for ``_vector_search`` on synthetic catalogue tables.
+
+Needs the pgvector database (the local container, or the one configured in
+geonorge-server/src/.env); the tests are skipped when it cannot be reached.
+Tables ``bench_catalogue_<rows>`` are created on the first run with random
+unit vectors and kept, so later runs measure only the queries. They have the
+same search columns and indexes as the table built by scripts/insert_csv.py,
+including the compact halfvec column, so both the exact scan and the two-stage
+search are measured. Sizes are set with BENCH_VECTOR_ROWS (default 1000,10000,100000).
+"""
+import os
+import random
+
+import pytest
+
+from config import CONFIG
+from helpers import vector_database
+from helpers.connection import get_connection, return_connection
+
+DIMENSIONS = 3072
+ROW_COUNTS = [int(n) for n in os.getenv("BENCH_VECTOR_ROWS", "1000,10000,100000").split(",")]
+
+
+def _connect_or_skip():
+    try:
+        return get_connection()
+    except Exception as e:
+        pytest.skip(f"pgvector database not available: {e}")
+
+
+def create_synthetic_table(conn, table, rows):
+    """Create and fill ``table`` unless it already holds ``rows`` rows."""
+    compact = CONFIG["search"]["compact_dimensions"]
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (table,))
+        if cur.fetchone()[0] is not None:
+            cur.execute(f"SELECT count(*) FROM {table}")
+            if cur.fetchone()[0] == rows:
+                return
+            cur.execute(f"DROP TABLE {table}")
+
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        cur.execute(f"""
+            CREATE TABLE {table} (
+                id SERIAL PRIMARY KEY,
+                uuid TEXT,
+                title TEXT,
+                abstract TEXT,
+                image TEXT,
+                metadatacreationdate TEXT,
+                getcapabilitiesurl TEXT,
+                bbox BOX,
+                combined_text_vector vector({DIMENSIONS}),
+                combined_text_compact halfvec({compact})
+                    GENERATED ALWAYS AS (l2_normalize(subvector(combined_text_vector, 1, {compact}))::halfvec({compact})) STORED
+            )
+        """)
+        # Random unit vectors, generated in the database to keep the setup fast
+        cur.execute(f"""
+            INSERT INTO {table} (uuid, title, abstract, image, metadatacreationdate, getcapabilitiesurl, bbox, combined_text_vector)
+            SELECT
+                md5(i::text),
+                'Syntetisk datasett ' || i,
+                repeat('Beskrivelse av datasettet. ', 20),
+                'https://example.com/' || i || '.png',
+                '2024-01-01',
+                CASE WHEN i % 3 = 0 THEN 'https://wms.example.com/' || i || '?service=WMS' END,
+                box(point(4 + (i % 27), 58 + (i % 13)), point(5 + (i % 27), 59 + (i % 13))),
+                l2_normalize(v.embedding)
+            FROM generate_series(1, %s) AS i,
+            LATERAL (
+                SELECT array_agg(random() - 0.5 + i * 0)::vector({DIMENSIONS}) AS embedding
+                FROM generate_series(1, {DIMENSIONS})
+            ) AS v
+        """, (rows,))
+        cur.execute(f"CREATE INDEX ON {table} USING gist (bbox)")
+        cur.execute(f"CREATE INDEX ON {table} USING hnsw (combined_text_compact halfvec_l2_ops)")
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+
+
+@pytest.fixture(scope="module", params=ROW_COUNTS, ids=lambda rows: f"{rows}rows")
+def synthetic_table(request):
+    conn = _connect_or_skip()
+    table = f"bench_catalogue_{request.param}"
+    try:
+        create_synthetic_table(conn, table, request.param)
+    finally:
+        return_connection(conn)
+    return table
+
+
+@pytest.fixture
+def query_vector():
+    rng = random.Random(42)
+    vector = [rng.uniform(-0.5, 0.5) for _ in range(DIMENSIONS)]
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector]
+
+
+@pytest.mark.parametrize("two_stage", [False, True], ids=["exact", "compact"])
+def test_vector_search(benchmark, monkeypatch, synthetic_table, query_vector, two_stage):
+    monkeypatch.setattr(vector_database, "TABLE_NAME", synthetic_table)
+    monkeypatch.setitem(CONFIG["search"], "compact_vectors", two_stage)
+    rows = benchmark(vector_database._vector_search, query_vector)
+    assert len(rows) == 20
+
+
+def test_vector_search_in_map_view(benchmark, monkeypatch, synthetic_table, query_vector):
+    monkeypatch.setattr(vector_database, "TABLE_NAME", synthetic_table)
+    monkeypatch.setitem(CONFIG["search"], "compact_vectors", False)
+    # Roughly the Oslo region
+    rows = benchmark(vector_database._vector_search, query_vector, (10.0, 59.5, 11.5, 60.2))
+    assert rows
@@ -0,0 +1,318 @@
+"""
+Load test for the WebSocket chat and search protocol of ChatServer.
+
+Simulated users each hold one WebSocket connection, like a browser tab, and
+loop over a weighted mix of Norwegian questions (queries.json): ``chatFormSubmit``
+or ``searchFormSubmit`` from action_enums.Action, then a random think time.
+Per request it records
+
+- chat: time to the first ``chatStream`` message and to ``streamComplete``
+- search: time to ``searchVdbResults``
+
+and a request that gets no answer within ``--timeout`` counts as an error.
+
+With ``--spawn`` the backend is started with fake backends (LLM_PROVIDER=fake,
+EMBEDDING_PROVIDER=local and the upstream mock from tests/mock_upstream.py), so
+only the pgvector database is needed. The catalogue must have been loaded with
+EMBEDDING_PROVIDER=local as well for the searches to return datasets. Limits
+given with ``--max-p95-*`` and ``--max-error-rate`` make the run exit with
+status 1 when they are exceeded, for use in CI.
+
+Usage:
+    python tests/load/ws_load.py --spawn --users 20 --duration 60 --max-p95-complete 8 --max-error-rate 0.01
+    python tests/load/ws_load.py --url ws://localhost:8080 --users 5 --requests 10 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import websockets
+
+TESTS_DIR = Path(__file__).resolve().parent.parent
+SERVER_SRC = TESTS_DIR.parent / "geonorge-server" / "src"
+sys.path.insert(0, str(SERVER_SRC))
+sys.path.insert(0, str(TESTS_DIR))
+
+from action_enums import Action  # noqa: E402
+
+QUERIES_FILE = Path(__file__).resolve().parent / "queries.json"
+# ChatServer only accepts WebSocket connections from the frontend origins
+DEFAULT_ORIGIN = "http://localhost:3000"
+CHAT_STREAM = "chatStream"
+
+FAKE_BACKEND_ENV = {
+    "LLM_PROVIDER": "fake",
+    "EMBEDDING_PROVIDER": "local",
+    "LANGSMITH_TRACING": "false",
+}
+
+
+class Metrics:
+    """Latencies in seconds and error counts per metric and request kind."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.empty_searches = 0
+
+    def record(self, metric, seconds):
+        self.latencies[metric].append(seconds)
+
+    def error(self, kind, reason):
+        self.errors[kind][reason] += 1
+
+    def error_rate(self):
+        total = sum(self.requests.values())
+        failed = sum(sum(reasons.values()) for reasons in self.errors.values())
+        return failed / total if total else 0.0
+
+    def summary(self):
+        return {
+            "requests": dict(self.requests),
+            "errors": {kind: dict(reasons) for kind, reasons in self.errors.items()},
+            "error_rate": self.error_rate(),
+            "empty_searches": self.empty_searches,
+            "latency_ms": {
+                metric: {
+                    "count": len(values),
+                    **{f"p{pct}": percentile(values, pct) * 1000 for pct in (50, 90, 95, 99)},
+                    "max": max(values) * 1000,
+                }
+                for metric, values in sorted(self.latencies.items()) if values
+            },
+        }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def load_queries(path, search_share):
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {kind: [(q["text"], q.get("weight", 1)) for q in data[kind]] for kind in ("chat", "search")}, search_share
+
+
+def pick(rng, queries, search_share):
+    mix, share = queries
+    kind = "search" if rng.random() < share else "chat"
+    texts, weights = zip(*mix[kind])
+    return kind, rng.choices(texts, weights=weights)[0]
+
+
+async def wait_for(inbox, actions, deadline):
+    """Wait until a message with one of ``actions`` arrives; returns (action, payload)."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        message = await asyncio.wait_for(inbox.get(), remaining)
+        if message is None:
+            raise ConnectionError("connection closed")
+        if message.get("action") in actions:
+            return message["action"], message.get("payload")
+
+
+async def run_chat(connection, inbox, question, metrics, timeout):
+    started = time.monotonic()
+    deadline = started + timeout
+    await connection.send(json.dumps({"action": Action.CHAT_FORM_SUBMIT.value, "payload": question}))
+    action, _ = await wait_for(inbox, {CHAT_STREAM, Action.STREAM_COMPLETE.value}, deadline)
+    if action == CHAT_STREAM:
+        metrics.record("chat_first_stream", time.monotonic() - started)
+        await wait_for(inbox, {Action.STREAM_COMPLETE.value}, deadline)
+    else:
+        # streamComplete without any streamed text is how ChatServer reports a failed request
+        metrics.error("chat", "no_stream")
+    metrics.record("chat_complete", time.monotonic() - started)
+
+
+async def run_search(connection, inbox, query, metrics, timeout):
+    started = time.monotonic()
+    await connection.send(json.dumps({"action": Action.SEARCH_FORM_SUBMIT.value, "payload": query}))
+    _, payload = await wait_for(inbox, {Action.SEARCH_VDB_RESULTS.value}, started + timeout)
+    metrics.record("search_results", time.monotonic() - started)
+    if not payload:
+        metrics.empty_searches += 1
+
+
+async def reader(connection, inbox):
+    try:
+        async for raw in connection:
+            try:
+                inbox.put_nowait(json.loads(raw))
+            except ValueError:
+                continue
+    except websockets.ConnectionClosed:
+        pass
+    inbox.put_nowait(None)
+
+
+async def simulated_user(user_id, args, queries, metrics, stop_at):
+    rng = random.Random(f"{args.seed}:{user_id}")
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    sent = 0
+    while time.monotonic() < stop_at and (not args.requests or sent < args.requests):
+        try:
+            async with websockets.connect(args.url, origin=args.origin, open_timeout=args.timeout,
+                                          max_size=None, compression=None) as connection:
+                inbox: asyncio.Queue = asyncio.Queue()
+                reader_task = asyncio.create_task(reader(connection, inbox))
+                try:
+                    while time.monotonic() < stop_at and (not args.requests or sent < args.requests):
+                        # Drop late messages (e.g. WMS updates) from the previous request
+                        while not inbox.empty():
+                            if inbox.get_nowait() is None:
+                                raise ConnectionError("connection closed")
+                        kind, text = pick(rng, queries, args.search_share)
+                        metrics.requests[kind] += 1
+                        sent += 1
+                        try:
+                            if kind == "chat":
+                                await run_chat(connection, inbox, text, metrics, args.timeout)
+                            else:
+                                await run_search(connection, inbox, text, metrics, args.timeout)
+                        except asyncio.TimeoutError:
+                            metrics.error(kind, "timeout")
+                        await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time else 0)
+                finally:
+                    reader_task.cancel()
+        except (OSError, ConnectionError, websockets.WebSocketException) as e:
+            metrics.error("connection", type(e).__name__)
+            await asyncio.sleep(1)
+
+
+async def wait_for_port(url, timeout):
+    host, port = url.split("://", 1)[1].split("/", 1)[0].rsplit(":", 1)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, int(port))
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server did not start listening on {host}:{port} within {timeout}s")
+
+
+async def start_fake_backends(args):
+    """Start the upstream mock in-process and the backend as a subprocess with fake backends."""
+    from aiohttp import web
+    from mock_upstream import Scenario, create_app
+
+    runner = web.AppRunner(create_app(Scenario.load(args.upstream_scenario)))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.mock_port).start()
+
+    env = {
+        **os.environ,
+        **FAKE_BACKEND_ENV,
+        "UPSTREAM_MOCK_URL": f"http://127.0.0.1:{args.mock_port}",
+        "FAKE_LLM_FIRST_TOKEN_MS": str(args.fake_first_token_ms),
+        "FAKE_LLM_TOKEN_MS": str(args.fake_token_ms),
+    }
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=SERVER_SRC, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_for_port(args.url, args.startup_timeout)
+    except Exception:
+        server.terminate()
+        await runner.cleanup()
+        raise
+    return server, runner
+
+
+def print_report(summary, duration):
+    total = sum(summary["requests"].values())
+    print(f"\n{total} requests in {duration:.1f}s ({total / duration:.1f}/s), "
+          f"error rate {summary['error_rate']:.2%}")
+    print(f"{'metric':<20} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for metric, values in summary["latency_ms"].items():
+        print(f"{metric:<20} {values['count']:>6} {values['p50']:>9.0f} {values['p90']:>9.0f} "
+              f"{values['p95']:>9.0f} {values['p99']:>9.0f} {values['max']:>9.0f}")
+    if summary["empty_searches"]:
+        print(f"searches without results: {summary['empty_searches']}")
+    for kind, reasons in summary["errors"].items():
+        print(f"errors {kind}: " + ", ".join(f"{reason}={count}" for reason, count in reasons.items()))
+
+
+def check_limits(summary, args):
+    """Return the limits that were exceeded."""
+    failures = []
+    limits = {
+        "chat_first_stream": args.max_p95_first_stream,
+        "chat_complete": args.max_p95_complete,
+        "search_results": args.max_p95_search,
+    }
+    for metric, limit in limits.items():
+        p95 = summary["latency_ms"].get(metric, {}).get("p95")
+        if limit is not None and p95 is not None and p95 > limit * 1000:
+            failures.append(f"{metric} p95 {p95:.0f} ms > {limit * 1000:.0f} ms")
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {summary['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    return failures
+
+
+async def main(args):
+    queries = load_queries(args.queries, args.search_share)
+    server = runner = None
+    if args.spawn:
+        server, runner = await start_fake_backends(args)
+    try:
+        metrics = Metrics()
+        started = time.monotonic()
+        stop_at = started + args.duration
+        print(f"Running {args.users} users against {args.url} for up to {args.duration}s")
+        await asyncio.gather(*(simulated_user(i, args, queries, metrics, stop_at) for i in range(args.users)))
+        duration = time.monotonic() - started
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+        if runner:
+            await runner.cleanup()
+
+    summary = metrics.summary()
+    print_report(summary, duration)
+    if args.json:
+        Path(args.json).write_text(json.dumps({"duration": duration, **summary}, indent=2), encoding="utf-8")
+    failures = check_limits(summary, args)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="ws://127.0.0.1:8080", help="WebSocket URL of ChatServer")
+    parser.add_argument("--origin", default=DEFAULT_ORIGIN, help="Origin header sent with the handshake")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="Stop starting new requests after this many seconds")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per user (0 = until --duration)")
+    parser.add_argument("--ramp-up", type=float, default=5, help="Spread user start-up over this many seconds")
+    parser.add_argument("--think-time", type=float, default=2, help="Mean pause between a user's requests in seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds before a request counts as timed out")
+    parser.add_argument("--search-share", type=float, default=0.4, help="Share of requests that are searches")
+    parser.add_argument("--queries", default=str(QUERIES_FILE), help="Weighted query mix (JSON)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write the summary to this file")
+    parser.add_argument("--spawn", action="store_true", help="Start the backend with fake LLM, embeddings and upstreams")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--upstream-scenario", default=str(TESTS_DIR / "fixtures" / "upstream_scenarios" / "fast.json"))
+    parser.add_argument("--fake-first-token-ms", type=float, default=300)
+    parser.add_argument("--fake-token-ms", type=float, default=20)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--server-log", help="Write the spawned server's output to this file")
+    parser.add_argument("--max-p95-first-stream", type=float, help="Limit in seconds for chat time to first chatStream")
+    parser.add_argument("--max-p95-complete", type=float, help="Limit in seconds for chat time to streamComplete")
+    parser.add_argument("--max-p95-search", type=float, help="Limit in seconds for time to searchVdbResults")
+    parser.add_argument("--max-error-rate", type=float, help="Maximum share of failed requests, e.g. 0.01")
+    sys.exit(asyncio.run(main(parser.parse_args())))
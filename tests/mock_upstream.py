@@ -0,0 +1,228 @@
+"""
+Mock server standing in for nedlasting.geonorge.no, kartkatalog.geonorge.no and WMS hosts.
+
+Start it and point the backend at it with UPSTREAM_MOCK_URL (see helpers/upstream.py):
+
+    python tests/mock_upstream.py --port 8765 --scenario tests/fixtures/upstream_scenarios/slow_wms.json
+    UPSTREAM_MOCK_URL=http://localhost:8765 python geonorge-server/src/server.py
+
+The backend requests ``/{host}/{path}?{query}``, or ``/_http/{host}/{path}?{query}``
+for services on plain http. Responses come from recorded fixtures under
+tests/fixtures/upstream/{host}/{path}/ (the same for both schemes):
+
+- ``<key>.json`` for the exact request, where key hashes method, query and body,
+- otherwise the nearest ``_default.json`` walking up from the path,
+- otherwise ``_wms/GetCapabilities.json`` for any WMS GetCapabilities request.
+
+A fixture is ``{"status": 200, "content_type": "...", "body": ...}``; a JSON body
+is stored as JSON, anything else as a string.
+
+A scenario file sets latency, error rate and timeouts per endpoint. The first
+rule whose ``match`` regex matches ``host/path`` applies, then ``default``:
+
+    {
+      "seed": 1,
+      "default": {"latency_ms": [20, 80]},
+      "endpoints": [
+        {"match": "GetCapabilities|wms", "latency_ms": [1500, 4000], "timeout_rate": 0.1},
+        {"match": "kartkatalog.geonorge.no/api/search", "error_rate": 0.2, "error_status": 429, "retry_after": 2}
+      ]
+    }
+
+Random draws come from one generator per rule seeded from ``seed``, so a
+sequential run is reproducible. A timed-out request is held for
+``timeout_seconds`` before a 504, long enough for the backend's client
+timeouts to fire first.
+
+With ``--record`` unknown requests are proxied to the real service and saved as
+fixtures. ``GET /_mock/stats`` returns request, error and timeout counts per rule,
+``PUT /_mock/scenario`` replaces the scenario and ``POST /_mock/reset`` clears the counts.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import aiohttp
+from aiohttp import web
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "upstream"
+DEFAULT_FIXTURE = "_default.json"
+WMS_CAPABILITIES_FIXTURE = Path("_wms") / "GetCapabilities.json"
+
+RULE_DEFAULTS = {
+    "latency_ms": [0, 0],
+    "error_rate": 0.0,
+    "error_status": 503,
+    "retry_after": None,
+    "timeout_rate": 0.0,
+    "timeout_seconds": 60.0,
+}
+
+
+class Scenario:
+    """Latency, error and timeout rules per endpoint."""
+
+    def __init__(self, data=None):
+        data = data or {}
+        seed = data.get("seed", 0)
+        self.default = {**RULE_DEFAULTS, **data.get("default", {}), "match": "default"}
+        self.rules = [
+            {**self.default, **rule, "pattern": re.compile(rule["match"])}
+            for rule in data.get("endpoints", [])
+        ]
+        self.random = {
+            rule["match"]: random.Random(f"{seed}:{rule['match']}")
+            for rule in [self.default, *self.rules]
+        }
+
+    @classmethod
+    def load(cls, path):
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")) if path else None)
+
+    def rule_for(self, target):
+        return next((rule for rule in self.rules if rule["pattern"].search(target)), self.default)
+
+    def draw(self, rule):
+        """Decide what happens to one request: (latency seconds, outcome)."""
+        rng = self.random[rule["match"]]
+        low, high = rule["latency_ms"]
+        latency = rng.uniform(low, high) / 1000
+        roll = rng.random()
+        if roll < rule["timeout_rate"]:
+            return latency, "timeout"
+        if roll < rule["timeout_rate"] + rule["error_rate"]:
+            return latency, "error"
+        return latency, "ok"
+
+
+def fixture_key(method, query, body):
+    return hashlib.sha1(f"{method}\n{query}\n{body}".encode("utf-8")).hexdigest()[:16]
+
+
+def fixture_dir(host, path):
+    parts = [part for part in path.split("/") if part and part not in (".", "..")]
+    return FIXTURES_DIR.joinpath(host, *parts)
+
+
+def is_wms_capabilities(query):
+    params = {key.lower(): values for key, values in parse_qs(query).items()}
+    return any(value.lower() == "getcapabilities" for value in params.get("request", []))
+
+
+def find_fixture(host, path, key, query):
+    directory = fixture_dir(host, path)
+    exact = directory / f"{key}.json"
+    if exact.exists():
+        return exact
+    while True:
+        candidate = directory / DEFAULT_FIXTURE
+        if candidate.exists():
+            return candidate
+        if directory == FIXTURES_DIR:
+            break
+        directory = directory.parent
+    if is_wms_capabilities(query):
+        return FIXTURES_DIR / WMS_CAPABILITIES_FIXTURE
+    return None
+
+
+def fixture_response(path):
+    fixture = json.loads(path.read_text(encoding="utf-8"))
+    body = fixture.get("body", "")
+    content_type = fixture.get("content_type", "application/json")
+    text = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+    return web.Response(status=fixture.get("status", 200), text=text, content_type=content_type.split(";")[0])
+
+
+async def record(scheme, host, path, request, body, key):
+    """Fetch the request from the real service and store it as a fixture."""
+    url = f"{scheme}://{host}/{path}"
+    async with aiohttp.ClientSession() as session:
+        async with session.request(
+            request.method, url, params=request.query, data=body or None,
+            headers={"Content-Type": request.headers.get("Content-Type", "application/json")},
+        ) as response:
+            content_type = response.headers.get("Content-Type", "application/octet-stream")
+            text = await response.text()
+            status = response.status
+    try:
+        stored_body = json.loads(text) if "json" in content_type else text
+    except ValueError:
+        stored_body = text
+    target = fixture_dir(host, path) / f"{key}.json"
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text(
+        json.dumps({"status": status, "content_type": content_type, "body": stored_body}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(f"Recorded {request.method} {url}?{request.query_string} -> {target.relative_to(FIXTURES_DIR)}")
+    return target
+
+
+def create_app(scenario, record_mode=False):
+    app = web.Application()
+    app["scenario"] = scenario
+    app["stats"] = defaultdict(lambda: {"requests": 0, "errors": 0, "timeouts": 0, "missing": 0})
+
+    async def stats(request):
+        return web.json_response(request.app["stats"])
+
+    async def set_scenario(request):
+        request.app["scenario"] = Scenario(await request.json())
+        return web.json_response({"ok": True})
+
+    async def reset(request):
+        request.app["stats"].clear()
+        return web.json_response({"ok": True})
+
+    async def upstream(request):
+        scheme = request.match_info.get("scheme", "https")
+        host = request.match_info["host"]
+        path = request.match_info["path"]
+        body = await request.text()
+        rule = request.app["scenario"].rule_for(f"{host}/{path}?{request.query_string}")
+        counters = request.app["stats"][rule["match"]]
+        counters["requests"] += 1
+
+        latency, outcome = request.app["scenario"].draw(rule)
+        await asyncio.sleep(latency)
+        if outcome == "timeout":
+            counters["timeouts"] += 1
+            await asyncio.sleep(rule["timeout_seconds"])
+            return web.Response(status=504, text="Gateway Timeout")
+        if outcome == "error":
+            counters["errors"] += 1
+            headers = {"Retry-After": str(rule["retry_after"])} if rule["retry_after"] is not None else None
+            return web.Response(status=rule["error_status"], text="Mocked upstream error", headers=headers)
+
+        key = fixture_key(request.method, request.query_string, body)
+        fixture = find_fixture(host, path, key, request.query_string)
+        if record_mode and (fixture is None or fixture.name == DEFAULT_FIXTURE or fixture.parent.name == "_wms"):
+            fixture = await record(scheme, host, path, request, body, key)
+        if fixture is None:
+            counters["missing"] += 1
+            return web.Response(status=404, text=f"No fixture for {host}/{path}")
+        return fixture_response(fixture)
+
+    app.router.add_get("/_mock/stats", stats)
+    app.router.add_put("/_mock/scenario", set_scenario)
+    app.router.add_post("/_mock/reset", reset)
+    app.router.add_route("*", "/_{scheme:http}/{host}/{path:.*}", upstream)
+    app.router.add_route("*", "/{host}/{path:.*}", upstream)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", help="Scenario JSON with per-endpoint latency, errors and timeouts")
+    parser.add_argument("--record", action="store_true", help="Proxy unknown requests to the real services and save them")
+    args = parser.parse_args()
+    web.run_app(create_app(Scenario.load(args.scenario), record_mode=args.record), host=args.host, port=args.port)
@@ -0,0 +1,22 @@
+"""
+Shared setup for the unit tests.
+
+The server modules read their configuration at import time, so the database
+settings get defaults before anything from geonorge-server/src is imported.
+None of the tests connect to a database or to Azure.
+"""
+import os
+import sys
+from pathlib import Path
+
+SERVER_SRC = Path(__file__).resolve().parents[2] / "geonorge-server" / "src"
+sys.path.insert(0, str(SERVER_SRC))
+
+for key, value in {
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "postgres",
+    "DB_USER": "postgres",
+    "DB_PASSWORD": "postgres",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,47 @@
+"""
+Fair queueing keys users by address; X-Forwarded-For is only believed when the
+connection comes from a configured reverse proxy.
+"""
+from types import SimpleNamespace
+
+from helpers.admission import client_key, parse_networks
+
+PROXIES = parse_networks(["10.0.0.0/8"])
+
+
+def connection(peer, forwarded=None):
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    return SimpleNamespace(remote_address=(peer, 52000), request=SimpleNamespace(headers=headers))
+
+
+def test_spoofed_forwarded_for_from_untrusted_peer_is_ignored():
+    websocket = connection("203.0.113.7", forwarded="198.51.100.1")
+    assert client_key(websocket, PROXIES) == "203.0.113.7"
+
+
+def test_forwarded_for_from_trusted_proxy_is_used():
+    websocket = connection("10.1.2.3", forwarded="198.51.100.1")
+    assert client_key(websocket, PROXIES) == "198.51.100.1"
+
+
+def test_client_supplied_hops_before_the_proxy_are_skipped():
+    # The client sent "1.2.3.4" itself; the proxy appended the address it saw
+    websocket = connection("10.1.2.3", forwarded="1.2.3.4, 198.51.100.1, 10.4.5.6")
+    assert client_key(websocket, PROXIES) == "198.51.100.1"
+
+
+def test_no_trusted_proxies_configured():
+    websocket = connection("10.1.2.3", forwarded="198.51.100.1")
+    assert client_key(websocket, []) == "10.1.2.3"
+
+
+def test_slow_calls_do_not_lower_the_limit_but_overload_does():
+    from helpers.admission import AdmissionController
+
+    controller = AdmissionController()
+    controller.limit = 4.0
+    for _ in range(3):
+        controller.record_llm_call()
+    assert controller.capacity == 4
+    controller.record_llm_call(overloaded=True)
+    assert controller.capacity < 4
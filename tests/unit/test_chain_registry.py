@@ -0,0 +1,30 @@
+"""
+A streamed chain is counted even when the caller stops reading early, e.g.
+because the client disconnected.
+"""
+import asyncio
+
+from llm.chain_registry import ChainRegistry
+
+
+class CountingChain:
+    async def astream(self, inputs, config, **kwargs):
+        for chunk in range(5):
+            yield chunk
+
+
+def test_abandoned_stream_is_recorded():
+    registry = ChainRegistry()
+    registry.get = lambda name: CountingChain()
+
+    async def read_two_chunks():
+        stream = registry.astream("answer", {})
+        async for chunk in stream:
+            if chunk == 1:
+                break
+        await stream.aclose()
+
+    asyncio.run(read_two_chunks())
+    stats = registry.get_stats()["answer"]
+    assert stats["calls"] == 1
+    assert stats["errors"] == 0
@@ -0,0 +1,46 @@
+"""
+get_connection waits for a free pool connection instead of failing as soon as
+every connection is checked out.
+"""
+import threading
+import time
+
+import pytest
+from psycopg2 import pool
+
+from helpers import connection
+
+
+class FakePool:
+    def getconn(self):
+        return object()
+
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def one_connection_pool(monkeypatch):
+    monkeypatch.setattr(connection, "connection_pool", FakePool())
+    monkeypatch.setattr(connection, "_available", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(connection, "_checked_out", 0)
+    monkeypatch.setitem(connection.db_config, "pool_timeout", 0.5)
+
+
+def test_waits_for_a_returned_connection(one_connection_pool):
+    conn = connection.get_connection()
+    threading.Timer(0.1, connection.return_connection, (conn,)).start()
+    started = time.monotonic()
+    second = connection.get_connection()
+    assert 0.05 < time.monotonic() - started < 0.5
+    assert connection.pool_stats()["in_use"] == 1
+    connection.return_connection(second)
+    assert connection.pool_stats()["in_use"] == 0
+
+
+def test_times_out_when_no_connection_is_returned(one_connection_pool):
+    conn = connection.get_connection()
+    with pytest.raises(pool.PoolError):
+        connection.get_connection()
+    connection.return_connection(conn)
+    connection.return_connection(connection.get_connection())
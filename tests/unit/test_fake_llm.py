@@ -0,0 +1,21 @@
+"""
+The fake model must recognise the prompts the pipeline actually sends, or the
+load tests exercise fallback paths instead of the real ones.
+"""
+import asyncio
+import json
+
+from llm.fake_llm import FakeChatModel
+from rag.utils.document_grading import EVALUATION_PROMPT, prepare_documents_for_evaluation
+
+
+async def _datasets_text():
+    rows = [("uuid-0", "Flomsoner", "Flom"), ("uuid-1", "Bygninger", "FKB")]
+    return (await prepare_documents_for_evaluation(rows))[1]
+
+
+def test_document_grading_prompt_gets_every_dataset_graded():
+    messages = EVALUATION_PROMPT.format_messages(query="flom i Bergen", datasets_text=asyncio.run(_datasets_text()))
+    grades = json.loads(FakeChatModel()._reply(messages))
+    assert [grade["id"] for grade in grades] == [0, 1]
+    assert all(grade["is_relevant"] for grade in grades)
@@ -0,0 +1,88 @@
+"""
+The supervisor and a rolling restart must never both fill a worker slot; a
+worker that is overwritten in ``Launcher.workers`` keeps serving the shared
+port without anyone stopping it.
+"""
+import asyncio
+import itertools
+
+import launcher
+from launcher import Launcher
+
+_pids = itertools.count(1000)
+
+
+class FakeProcess:
+    def __init__(self):
+        self.pid = next(_pids)
+        self.returncode = None
+        self._exited = asyncio.Event()
+
+    def exit(self, code=1):
+        self.returncode = code
+        self._exited.set()
+
+    async def wait(self):
+        await self._exited.wait()
+        return self.returncode
+
+
+class FakeLauncher(Launcher):
+    def __init__(self, workers):
+        super().__init__(workers)
+        self.started = []
+        self.stopped = []
+
+    async def start_worker(self, slot):
+        await asyncio.sleep(0.05)
+        process = FakeProcess()
+        self.started.append(process)
+        return process
+
+    async def stop_worker(self, process):
+        if process.returncode is None:
+            process.exit(0)
+        self.stopped.append(process)
+
+
+def run_race(monkeypatch, exit_first):
+    monkeypatch.setattr(launcher, "MAX_RESTART_DELAY_SECONDS", 0.01)
+
+    async def scenario():
+        runner = FakeLauncher(1)
+        original = FakeProcess()
+        runner.workers[0] = original
+        supervisor = asyncio.create_task(runner._supervise(0))
+        await asyncio.sleep(0)
+        if exit_first:
+            # The supervisor has emptied the slot and is starting a worker when SIGHUP arrives
+            original.exit()
+            await asyncio.sleep(0.02)
+            await runner.rolling_restart()
+        else:
+            # SIGHUP while the worker is exiting: the restart is already starting its replacement
+            restart = asyncio.create_task(runner.rolling_restart())
+            await asyncio.sleep(0.01)
+            original.exit()
+            await restart
+        await asyncio.sleep(0.2)
+        runner._stopping = True
+        supervisor.cancel()
+        await asyncio.gather(supervisor, *runner._retiring, return_exceptions=True)
+        return runner
+
+    return asyncio.run(scenario())
+
+
+def assert_no_orphans(runner):
+    serving = [process for process in runner.started if process.returncode is None]
+    assert serving == list(runner.workers.values())
+    assert len(serving) == 1
+
+
+def test_restart_while_supervisor_replaces_exited_worker(monkeypatch):
+    assert_no_orphans(run_race(monkeypatch, exit_first=True))
+
+
+def test_worker_exits_during_rolling_restart(monkeypatch):
+    assert_no_orphans(run_race(monkeypatch, exit_first=False))
@@ -0,0 +1,62 @@
+"""
+The semantic response cache must not serve the answer about one place to a
+question about another, even though their embeddings are nearly the same.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from helpers import response_cache as response_cache_module
+from helpers.response_cache import ResponseCache, ResponseRecorder
+
+
+def recorded_answer(markdown):
+    recorder = ResponseRecorder(websocket=object())
+    recorder.add("chatStream", {"payload": "", "isNewMessage": True})
+    recorder.add("chatStream", {"payload": markdown})
+    recorder.add("streamComplete", None)
+    return recorder
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache()
+    cache.enabled = True
+
+    async def same_embedding(question):
+        # Place-swapped questions embed almost identically; make them identical
+        return np.ones(8, dtype=np.float32) / np.sqrt(8)
+
+    async def no_version_check():
+        return None
+
+    monkeypatch.setattr(cache, "_embed", same_embedding)
+    monkeypatch.setattr(cache, "_check_index_version", no_version_check)
+    monkeypatch.setattr(response_cache_module.metrics, "record_cache", lambda *args: None)
+    return cache
+
+
+def test_place_swapped_question_misses(cache):
+    async def scenario():
+        await cache.store(recorded_answer("Flomsoner for Bergen ..."), "Hvilke flomdata finnes for Bergen?")
+        swapped = await cache.lookup("Hvilke flomdata finnes for Oslo?")
+        same = await cache.lookup("Hvilke flomdata finnes for Bergen?")
+        return swapped, same
+
+    swapped, same = asyncio.run(scenario())
+    assert swapped is None
+    assert same is not None and same.markdown == "Flomsoner for Bergen ..."
+
+
+def test_other_map_view_misses(cache):
+    async def scenario():
+        await cache.store(recorded_answer("Flomsoner i kartutsnittet ..."), "Hvilke flomdata finnes her?",
+                          view_bbox=(5.2, 60.3, 5.4, 60.45))
+        elsewhere = await cache.lookup("Hvilke flomdata finnes her?", view_bbox=(10.6, 59.85, 10.9, 59.97))
+        nearby = await cache.lookup("Hvilke flomdata finnes her?", view_bbox=(5.2001, 60.3, 5.4, 60.45))
+        return elsewhere, nearby
+
+    elsewhere, nearby = asyncio.run(scenario())
+    assert elsewhere is None
+    assert nearby is not None